@@ -2,7 +2,7 @@
 
 in float vert_Value;
 
-uniform sampler2D main_Texture;
+uniform sampler1D main_Texture;
 uniform vec2 u_PointValueRange;
 
 out vec4 out_Color;
@@ -10,5 +10,6 @@ out vec4 out_Color;
 void main()
 {
     float value = (vert_Value - u_PointValueRange.x) / (u_PointValueRange.y - u_PointValueRange.x);
-    out_Color = texture(main_Texture, vec2(0.5f, 1.0f - value));
+    // nearest sampling picks entry floor(value * size) of the lookup table, like palette.colorize
+    out_Color = texture(main_Texture, value);
 }
\ No newline at end of file
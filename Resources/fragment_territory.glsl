@@ -1,6 +1,9 @@
 #version 460 core
 
 uniform sampler2D main_Texture;
+uniform vec2 u_TextureScale;
+// part of the screen covered by the view being drawn, as offset and size
+uniform vec4 u_Viewport;
 
 in vec2 uv_Coords;
 
@@ -8,5 +11,8 @@ out vec4 out_Color;
 
 void main()
 {
-    out_Color = texture(main_Texture, uv_Coords);
-}
\ No newline at end of file
+    // the heatmap may only fill part of the texture while it is rendered at reduced resolution
+    vec2 limit = u_TextureScale - 0.5f / vec2(textureSize(main_Texture, 0));
+    vec2 uv = u_Viewport.xy + uv_Coords * u_Viewport.zw;
+    out_Color = texture(main_Texture, min(uv * u_TextureScale, limit));
+}
@@ -0,0 +1,213 @@
+"""
+
+Threshold alerts over the station series, grouped into events over the station neighbour graph.
+
+A rule compares a field with a threshold and asks for the condition to hold over a duration, such as
+'RN-60m > 30' or 'WS10 > 14 for 10 min'. Rules are evaluated for all stations and steps at once: the
+run of steps meeting the condition up to a step is its distance to the last step that did not, found
+with a running maximum over the step indices. Runs carry over from one evaluation to the next, so every
+ingest only evaluates the steps it added, and the few steps before them whose quality control flags
+new data can still change. Missing values and flagged values break a run.
+
+The stations triggering a rule at a step are grouped into events, the connected components of the
+Delaunay neighbour graph restricted to them, found by propagating the smallest station index along the
+edges. An event has its stations, the peak value, the time its earliest station triggered, its bounds
+and an outline, the convex hull of small octagons around the stations so that a single station gets
+one too.
+
+"""
+
+import re
+
+import numpy as np
+
+from timeseries import to_timestamp
+
+
+OPERATORS = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal}
+RULE_PATTERN = re.compile(r'^\s*(\S+)\s*(>=|<=|>|<)\s*(-?[0-9.]+)\s*(?:for\s+([0-9]+)\s*(min|h))?\s*$')
+# distance of the outlines from the stations, in map units
+OUTLINE_RADIUS = 8.0
+
+
+class Rule:
+    """A field compared with a threshold, holding for at least seconds."""
+
+    def __init__(self, field, operator, threshold, seconds=0, name=None):
+        self.field = field
+        self.operator = operator
+        self.threshold = threshold
+        self.seconds = seconds
+        self.name = name or '%s %s %g' % (field, operator, threshold)
+
+    @classmethod
+    def parse(cls, text):
+        """Rule from text such as 'RN-60m > 30' or 'WS10 > 14 for 10 min'."""
+        match = RULE_PATTERN.match(text)
+        if match is None:
+            raise ValueError("Invalid alert rule: %s" % text)
+        field, operator, threshold, duration, unit = match.groups()
+        seconds = int(duration) * (60 if unit == 'min' else 3600) if duration else 0
+        return cls(field, operator, float(threshold), seconds, text.strip())
+
+    def required_steps(self, step):
+        """Steps of step seconds the condition has to hold for, at least one."""
+        return max(-(-self.seconds // step), 1)
+
+    def condition(self, values):
+        # comparisons with NaN are False
+        with np.errstate(invalid='ignore'):
+            return OPERATORS[self.operator](values, self.threshold)
+
+    def peak(self, values):
+        return np.nanmin(values) if self.operator.startswith('<') else np.nanmax(values)
+
+
+def run_lengths(condition, carry):
+    """Length of the run of steps meeting the condition up to every step of a (steps, stations) array,
+    continuing the runs carry ended with before the first step."""
+    index = np.arange(1, len(condition) + 1)[:, None]
+    last_break = np.maximum.accumulate(np.where(condition, 0, index), axis=0)
+    return np.where(last_break == 0, carry + index, index - last_break)
+
+
+def components(mask, src, dst):
+    """Connected components of the stations in mask over the edges (src, dst). Returns the label of
+    every station, the smallest station index of its component, -1 outside of mask."""
+    keep = mask[src] & mask[dst]
+    src, dst = src[keep], dst[keep]
+    labels = np.where(mask, np.arange(len(mask)), -1)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, src, labels[dst])
+        # pointer jumping, every label points to a station of the same component
+        labels[mask] = labels[labels[mask]]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def cross(a, b):
+    return a[0] * b[1] - a[1] * b[0]
+
+
+def outline(positions, radius=OUTLINE_RADIUS):
+    """Convex hull of octagons around the positions, counter-clockwise (monotone chain)."""
+    angles = np.arange(8) * np.pi / 4 + np.pi / 8
+    points = (positions[:, None, :] + radius * np.stack((np.cos(angles), np.sin(angles)), axis=1)).reshape(-1, 2)
+    points = points[np.lexsort((points[:, 1], points[:, 0]))]
+
+    def chain(points):
+        hull = []
+        for p in points:
+            while len(hull) >= 2 and cross(hull[-1] - hull[-2], p - hull[-2]) <= 0:
+                hull.pop()
+            hull.append(p)
+        return hull[:-1]
+
+    return np.array(chain(points) + chain(points[::-1]))
+
+
+class Event:
+    """Connected stations triggering a rule at a time (epoch seconds). since is the time the earliest
+    of them started meeting the condition."""
+
+    def __init__(self, rule, time, since, stations, values, positions):
+        self.rule = rule
+        self.time = time
+        self.since = since
+        self.stations = stations
+        self.peak = rule.peak(values)
+        self.bounds = tuple(np.concatenate((positions.min(axis=0) - OUTLINE_RADIUS, positions.max(axis=0) + OUTLINE_RADIUS)).tolist())
+        self.outline = outline(positions)
+
+
+class AlertEngine:
+    """Incremental evaluation of rules over the steps of a store. The run lengths of the last
+    max_steps evaluated steps are kept, the last revisit of them are evaluated again on every update."""
+
+    def __init__(self, store, rules, max_steps=2880, revisit=0):
+        self.store = store
+        self.rules = list(rules)
+        self.max_steps = max_steps
+        self.revisit = revisit
+        self.fields = sorted({rule.field for rule in self.rules})
+        # timestamps of the first and the last kept step
+        self.first = None
+        self.last = None
+        self.runs = [None] * len(self.rules)
+
+    def update(self, start, end):
+        """Evaluates the steps from start to end (inclusive) that were not evaluated before. Returns the
+        number of steps evaluated, 0 when there was nothing new."""
+        step = self.store.step
+        start, end = to_timestamp(start) // step * step, to_timestamp(end) // step * step
+        if self.last is not None and self.first <= start <= self.last + step:
+            if end <= self.last:
+                return 0
+            begin = max(self.last + step * (1 - self.revisit), self.first)
+            kept = (begin - self.first) // step
+            self.runs = [runs[:kept] if kept else None for runs in self.runs]
+        else:
+            # not continuing the evaluated steps, runs cannot be carried over
+            begin, end = start, end if self.last is None else max(end, self.last)
+            self.first = self.last = None
+            self.runs = [None] * len(self.rules)
+        if begin > end:
+            return 0
+
+        columns = len(self.store.stations)
+        block = self.store.window(begin, end).block(columns, self.fields)
+        for r, rule in enumerate(self.rules):
+            carry = 0 if self.runs[r] is None else self.pad(self.runs[r][-1], columns).astype(np.int64)
+            runs = run_lengths(rule.condition(block[:, :, self.fields.index(rule.field)]), carry)
+            # long runs saturate, they only have to reach the required steps
+            runs = np.minimum(runs, np.iinfo(np.int16).max).astype(np.int16)
+            if self.runs[r] is not None:
+                runs = np.concatenate((self.pad(self.runs[r], columns), runs))
+            self.runs[r] = runs[-self.max_steps:]
+        self.first = end - (len(self.runs[0]) - 1) * step
+        self.last = end
+        return (end - begin) // step + 1
+
+    @staticmethod
+    def pad(runs, columns):
+        """Runs widened with zero runs for the stations registered since."""
+        if runs.shape[-1] == columns:
+            return runs
+        return np.concatenate((runs, np.zeros(runs.shape[:-1] + (columns - runs.shape[-1],), dtype=runs.dtype)), axis=-1)
+
+    def triggered(self, time):
+        """(rule, (stations,) run lengths) of the rules triggered at a time, none if the time was not
+        evaluated."""
+        if self.last is None:
+            return []
+        step = self.store.step
+        i = (to_timestamp(time) // step * step - self.first) // step
+        if i < 0 or i >= len(self.runs[0]):
+            return []
+        out = []
+        for rule, runs in zip(self.rules, self.runs):
+            if (runs[i] >= rule.required_steps(step)).any():
+                out.append((rule, runs[i]))
+        return out
+
+    def events(self, time, positions, edges):
+        """Events at a time. positions are the map positions of the store columns, NaN where unknown,
+        and edges the (src, dst) neighbour graph between them."""
+        triggered = self.triggered(time)
+        if not triggered:
+            return []
+        step = self.store.step
+        time = to_timestamp(time) // step * step
+        frame = self.store.window(time, time).frame(0)
+        events = []
+        for rule, runs in triggered:
+            runs = self.pad(runs, len(positions))
+            mask = (runs >= rule.required_steps(step)) & ~np.isnan(positions).any(axis=1)
+            labels = components(mask, *edges)
+            values = frame[:len(positions), self.store.field_index[rule.field]]
+            for label in np.unique(labels[mask]):
+                stations = np.nonzero(labels == label)[0]
+                since = time - (int(runs[stations].max()) - 1) * step
+                events.append(Event(rule, time, since, stations, values[stations], positions[stations]))
+        return events
@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+import numpy as np
+
+
+class AssetManager:
+    """Runs I/O and CPU bound loading steps on worker threads while the main thread creates the
+    GL context, and records when every step started and finished."""
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asset')
+        self.futures = {}
+        self.timeline = []
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.first_frame_time = None
+
+    def submit(self, name, func, *args):
+        self.futures[name] = self.executor.submit(self._run, name, func, *args)
+
+    def _run(self, name, func, *args):
+        with self.step(name):
+            return func(*args)
+
+    @contextmanager
+    def step(self, name):
+        """Records a step of the timeline, can also be used for work done on the main thread."""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.timeline.append((name, threading.current_thread().name, begin - self.start_time, end - self.start_time))
+
+    def result(self, name):
+        return self.futures[name].result()
+
+    def completed(self):
+        """Yields (name, result) of every submitted step in order of completion."""
+        names = {future: name for name, future in self.futures.items()}
+        for future in as_completed(names):
+            yield names[future], future.result()
+
+    def first_frame(self):
+        if self.first_frame_time is not None:
+            return
+        self.first_frame_time = time.perf_counter() - self.start_time
+        self.executor.shutdown(wait=False)
+        self.report()
+
+    def report(self):
+        for name, thread, begin, end in sorted(self.timeline, key=lambda step: step[2]):
+            logging.log(logging.INFO, "Startup %-20s %-12s %8.1f ms - %8.1f ms (%.1f ms)"
+                        % (name, thread, begin * 1000, end * 1000, (end - begin) * 1000))
+        if self.first_frame_time is not None:
+            logging.log(logging.INFO, "Time to first frame: %.1f ms" % (self.first_frame_time * 1000))
+
+
+def decode_image(file):
+    """Decodes an image into a (height, width, 4) uint8 RGBA array."""
+    # imported on the worker thread that decodes the first image instead of before the window opens
+    import PIL.Image
+
+    with PIL.Image.open(file) as image:
+        return np.ascontiguousarray(np.asarray(image.convert('RGBA'), dtype=np.uint8))
@@ -0,0 +1,72 @@
+"""
+
+Streaming parser for the comma separated KMA AWS format.
+
+Input arrives as byte chunks (an HTTP body or a file read piecewise). Complete lines are parsed in
+batches: the numeric columns of a whole batch are split and converted to floats in one NumPy call and
+the sentinel rule (values <= -50 are missing) is applied to the batch at once. Only the trailing
+partial line is carried over between chunks, so memory stays bounded by the batch size.
+
+"""
+
+import numpy as np
+
+
+NUMERIC_COLUMNS = 16
+SENTINEL = -50.0
+
+
+def iter_file(path, chunk_size=1 << 16):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def parse_lines(lines):
+    """Parses complete data lines. Returns (times, stations, values) of the batch."""
+    # every column, including the timestamp and station number, is numeric
+    fields = np.fromstring(b','.join(lines).decode('ascii'), dtype=np.float64, sep=',').reshape(len(lines), -1)
+    values = fields[:, 2:2 + NUMERIC_COLUMNS].astype(np.float32)
+    values[values <= SENTINEL] = np.nan
+    return fields[:, 0].astype(np.int64).astype(str), fields[:, 1].astype(np.int64).astype(str), values
+
+
+def parse_batches(chunks, batch_lines=8192):
+    """Yields (times, stations, values) for batches of at most batch_lines rows."""
+    pending = b''
+    lines = []
+    for chunk in chunks:
+        data = pending + chunk
+        cut = data.rfind(b'\n') + 1
+        pending = data[cut:]
+        # data lines end with a ',=' marker, comments start with '#'
+        lines += [line[:-2] for line in data[:cut].replace(b'\r', b'').split(b'\n') if line.endswith(b',=')]
+        while len(lines) >= batch_lines:
+            yield parse_lines(lines[:batch_lines])
+            lines = lines[batch_lines:]
+    pending = pending.rstrip(b'\r')
+    if pending.endswith(b',='):
+        lines.append(pending[:-2])
+    if lines:
+        yield parse_lines(lines)
+
+
+def parse(chunks, capacity=1024):
+    """Parses all rows into preallocated arrays that grow geometrically.
+    Returns (times, stations, values)."""
+    times = np.empty(capacity, dtype='U12')
+    stations = np.empty(capacity, dtype='U8')
+    values = np.empty((capacity, NUMERIC_COLUMNS), dtype=np.float32)
+    count = 0
+    for batch_times, batch_stations, batch_values in parse_batches(chunks):
+        n = len(batch_times)
+        if count + n > len(times):
+            capacity = max(2 * len(times), count + n)
+            times = np.resize(times, capacity)
+            stations = np.resize(stations, capacity)
+            values = np.resize(values, (capacity, NUMERIC_COLUMNS))
+        times[count:count + n] = batch_times
+        stations[count:count + n] = batch_stations
+        values[count:count + n] = batch_values
+        count += n
+    return times[:count], stations[:count], values[:count]
@@ -1,9 +1,5 @@
-from array import array
-import imgui
-import imgui.core
 import util
-import weather_data
-import glm
+import numpy as np
 
 
 class AWSPoint:
@@ -14,55 +10,38 @@ class AWSPoint:
         self.code = point_info[3]
         self.array_data = {}
         self.has_data = False
-        self.w = 0
-
-    def initialize_data(self, weather_data):
-        if self.id not in weather_data.data_hoursofday[0]:
-            return
-        for key in weather_data.keys:
-            # float conversiable ?
-            if key in ['YYMMDDHHMI', 'STN']:
-                continue
-            self.array_data[key] = array('f', [weather_data.data_hoursofday[i][self.id][key] for i in range(24)])
-        self.has_data = True
+        self.active = False
+        self.window = None
+        self.column = None
+
+    def initialize_data(self, weather_data, present=None, latest=None):
+        """Binds the point to the selected window. present and latest can be passed in when
+        initializing many points at once."""
+        self.window = weather_data.window
+        self.column = self.window.store.column(self.id)
+        # series are read from the store on demand, only for points that are drawn
+        self.array_data = {}
+        if present is None:
+            present = self.window.present()
+        if latest is None:
+            latest = self.window.frame(self.window.steps - 1)
+        self.has_data = self.column is not None and bool(present[self.column])
+        self.active = self.has_data and not np.isnan(latest[self.column]).all()
+
+    def get_series(self, key):
+        if key not in self.array_data:
+            self.array_data[key] = self.window.series(self.column, key)
+        return self.array_data[key]
 
     def get_slerped_data(self, key, time):
-        if key not in self.array_data:
+        if not self.has_data or not self.window.has_field(key):
             return 0
+        series = self.get_series(key)
         if time < 0:
-            return self.array_data[key][0]
-        if time >= 23:
-            return self.array_data[key][23]
-        return util.slerp(self.array_data[key], time)
+            return series[0]
+        if time >= len(series) - 1:
+            return series[-1]
+        return util.slerp(series, time)
 
     def draw_opengl(self, shader, viewproj_matrix):
         pass
-
-    def reset_imgui(self):
-        self.w = 0
-
-    def draw_imgui(self, viewproj_matrix, screen_size, time, delta_time):
-        v = viewproj_matrix * glm.vec3(-self.x, -self.y, 0)
-        if v.x < -1 or v.x > 1 or v.y < -1 or v.y > 1:
-            self.reset_imgui()
-            return
-        sv = glm.vec2((v.x + 1) * screen_size.x / 2 + 4, (-v.y + 1) * screen_size.y / 2)
-        self.w = self.w + (200 - self.w) * delta_time * 10
-
-        imgui.set_next_window_position(sv.x, sv.y)
-        imgui.set_next_window_size(self.w, 210)
-        imgui.begin(self.id, False, imgui.WINDOW_NO_TITLE_BAR | imgui.WINDOW_NO_RESIZE | imgui.WINDOW_NO_MOVE | imgui.WINDOW_NO_COLLAPSE | imgui.WINDOW_NO_BRING_TO_FRONT_ON_FOCUS | imgui.WINDOW_NO_MOUSE_INPUTS)
-        imgui.text(f'[{self.id}] {self.name}')
-        imgui.separator()
-        plot_size = (max(self.w - 120, 10), 30)
-        if self.has_data:
-            direction = util.get_direction(self.get_slerped_data('WD10', time))
-            imgui.plot_lines("%.1f°C" % self.get_slerped_data('TA', time), self.array_data['TA'], graph_size=plot_size)
-            imgui.plot_histogram("%.1fmm" % self.get_slerped_data('RN-DAY', time), self.array_data['RN-60m'], scale_min=0, scale_max=40, graph_size=plot_size)
-            imgui.plot_lines("%.1f%%" % self.get_slerped_data('HM', time), self.array_data['HM'], scale_min=0, scale_max=100, graph_size=plot_size)
-            imgui.plot_lines("%.1fm/s (%s)" % (self.get_slerped_data('WS10', time), direction), self.array_data['WS10'], scale_min=0, scale_max=10, graph_size=plot_size)
-            imgui.plot_lines("%.1fhPa" % self.get_slerped_data('PS', time), self.array_data['PS'], graph_size=plot_size)
-        else:
-            imgui.text("No Data")
-
-        imgui.end()
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+
+Zoom dependent clustering of station markers.
+
+Stations are indexed once in a linear quadtree: positions are quantized to a 2^depth grid over the map
+and sorted by their Morton code, so the stations of every quadtree cell at every level are a
+contiguous run, found by shifting the codes. Per level the cells holding stations, their member
+count and centroid are precomputed, and the count, mean and max of the selected variable are grouped
+reductions redone only when the values change.
+
+Per frame the level whose cells are about cluster_size pixels on screen is picked, the cells
+overlapping the view are enumerated and looked up in the sorted cell keys of that level. The cost of
+a frame depends on the number of cells in view, not on the number of stations. Cells holding a single
+station are drawn as that station, all others as a cluster marker at the centroid of its members.
+
+"""
+
+import imgui
+import glm
+import numpy as np
+
+import regions
+from palette import colorize
+
+
+def spread_bits(v):
+    """Moves the lower 32 bits of v to the even bit positions."""
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton(ix, iy):
+    return spread_bits(ix) | (spread_bits(iy) << np.uint64(1))
+
+
+class Level:
+    """Cells of one quadtree level holding at least one station, sorted by key."""
+
+    def __init__(self, keys, labels, positions):
+        self.keys, starts = np.unique(keys, return_index=True)
+        self.counts = np.diff(np.append(starts, len(keys)))
+        self.centers = np.add.reduceat(positions, starts, axis=0) / self.counts[:, None]
+        # the first member of every cell, the station of single station cells
+        self.first = starts
+        self.groups = regions.Groups(labels, len(self.keys))
+        self.stats = None
+
+
+class QuadTree:
+    def __init__(self, positions, bounds=(0, 0, 800, 760), depth=12):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.positions = positions
+        self.origin = np.array(bounds[:2], dtype=np.float64)
+        self.size = float(max(bounds[2] - bounds[0], bounds[3] - bounds[1]))
+        self.depth = depth
+
+        cells = np.clip(((positions - self.origin) / self.size * (1 << depth)).astype(np.int64), 0, (1 << depth) - 1)
+        codes = morton(cells[:, 0], cells[:, 1])
+        self.order = np.argsort(codes, kind='stable')
+        codes = codes[self.order]
+        sorted_positions = positions[self.order]
+
+        self.levels = []
+        for level in range(depth + 1):
+            keys = codes >> np.uint64(2 * (depth - level))
+            # cell index of every station, in station order
+            labels = np.empty(len(keys), dtype=np.int64)
+            labels[self.order] = np.cumsum(np.diff(keys, prepend=keys[:1]) != 0)
+            self.levels.append(Level(keys, labels, sorted_positions))
+
+    def aggregate(self, values):
+        """Recomputes count, mean and max of the station values for the cells of every level."""
+        for level in self.levels:
+            level.stats = level.groups.reduce(values)
+
+    def level_for(self, units_per_pixel, cluster_size):
+        """Finest level whose cells are at least cluster_size pixels wide."""
+        cells = self.size / (units_per_pixel * cluster_size)
+        return int(np.clip(np.floor(np.log2(max(cells, 1))), 0, self.depth))
+
+    def query(self, level, bounds):
+        """Indices of the cells of a level overlapping the (x0, y0, x1, y1) map bounds."""
+        scale = (1 << level) / self.size
+        low = np.clip(np.floor((np.array(bounds[:2]) - self.origin) * scale), 0, (1 << level) - 1).astype(np.int64)
+        high = np.clip(np.floor((np.array(bounds[2:]) - self.origin) * scale), 0, (1 << level) - 1).astype(np.int64)
+        ix, iy = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1))
+        keys = np.sort(morton(ix.reshape(-1), iy.reshape(-1)))
+        cells = self.levels[level]
+        index = np.minimum(np.searchsorted(cells.keys, keys), len(cells.keys) - 1)
+        return index[cells.keys[index] == keys]
+
+
+class ClusterLayer:
+    """Station markers and cluster markers, drawn into the background draw list."""
+
+    def __init__(self, points, cluster_size=48, depth=12):
+        self.points = list(points)
+        self.cluster_size = cluster_size
+        self.tree = QuadTree([(p.x, p.y) for p in self.points], depth=depth)
+        self.type4 = np.array([p.code[0] == '4' for p in self.points])
+        self.active = np.zeros(len(self.points), dtype=bool)
+        self.individual = np.zeros(0, dtype=np.int64)
+
+    def update(self, values):
+        """New values of the selected variable, NaN where a station has none."""
+        self.active = np.array([p.active for p in self.points])
+        self.tree.aggregate(values)
+
+    def draw(self, viewproj_matrix, screen_size, value_range=None, lut=None):
+        """Draws the markers in view. With a palette lut clusters are colored by their mean. Returns the
+        stations drawn individually."""
+        # the projection is affine, three points give it and its inverse
+        origin = viewproj_matrix * glm.vec3(0, 0, 0)
+        dx = viewproj_matrix * glm.vec3(-1, 0, 0) - origin
+        dy = viewproj_matrix * glm.vec3(0, -1, 0) - origin
+        forward = np.array([[dx.x, dy.x], [dx.y, dy.y]], dtype=np.float64)
+        inverse = np.linalg.inv(forward)
+        corners = (inverse @ (np.array([[-1, 1, -1, 1], [-1, -1, 1, 1]]) - np.array([[origin.x], [origin.y]]))).T
+        bounds = (*corners.min(axis=0), *corners.max(axis=0))
+        units_per_pixel = 2 / (abs(forward[1, 1]) * screen_size.y)
+
+        level = self.tree.level_for(units_per_pixel, self.cluster_size)
+        cells = self.tree.levels[level]
+        visible = self.tree.query(level, bounds)
+
+        def to_screen(xy):
+            ndc = forward @ xy.T + np.array([[origin.x], [origin.y]])
+            return (ndc[0] + 1) * screen_size.x / 2, (-ndc[1] + 1) * screen_size.y / 2
+
+        draw_list = imgui.get_background_draw_list()
+        single = visible[cells.counts[visible] == 1]
+        self.individual = self.tree.order[cells.first[single]]
+        sx, sy = to_screen(self.tree.positions[self.individual])
+        # same size and colors as the former quads, a quarter percent of the screen height
+        half = 0.00125 * screen_size.y
+        colors = [imgui.get_color_u32_rgba(0.8, 0.0, 0.0, 1.0), imgui.get_color_u32_rgba(0.2, 0.5, 1.0, 1.0),
+                  imgui.get_color_u32_rgba(0.3, 0.98, 0.18, 1.0)]
+        kind = np.where(self.active[self.individual], 1 + self.type4[self.individual], 0)
+        for x, y, k in zip(sx.tolist(), sy.tolist(), kind.tolist()):
+            draw_list.add_rect_filled(x - half, y - half, x + half, y + half, colors[k])
+
+        grouped = visible[cells.counts[visible] > 1]
+        if len(grouped) == 0:
+            return self.individual
+        sx, sy = to_screen(cells.centers[grouped])
+        stats = cells.stats
+        mean, maximum = stats['mean'][grouped], stats['max'][grouped]
+        fill = np.full((len(grouped), 3), 150, dtype=np.float64)
+        if lut is not None:
+            valid = ~np.isnan(mean)
+            fill[valid] = colorize(mean[valid], value_range, lut)
+        border = imgui.get_color_u32_rgba(0.06, 0.06, 0.07, 0.94)
+        text = imgui.get_color_u32_rgba(1.0, 1.0, 1.0, 1.0)
+        for k in range(len(grouped)):
+            count = int(cells.counts[grouped[k]])
+            radius = 8 + 3 * np.log2(count)
+            x, y = float(sx[k]), float(sy[k])
+            r, g, b = fill[k] / 255.0
+            draw_list.add_circle_filled(x, y, radius, imgui.get_color_u32_rgba(r, g, b, 0.85))
+            draw_list.add_circle(x, y, radius, border, thickness=1.5)
+            label = '%d' % count
+            size = imgui.calc_text_size(label)
+            draw_list.add_text(x - size.x / 2, y - size.y / 2, text, label)
+            if not np.isnan(mean[k]):
+                label = '%.1f / %.1f' % (mean[k], maximum[k])
+                draw_list.add_text(x - imgui.calc_text_size(label).x / 2, y + radius + 2, text, label)
+        return self.individual
@@ -0,0 +1,300 @@
+"""
+
+Sources of the KMA AWS text files.
+
+Files are identified by their name in the cache directory: 'data<YYYYmmddHHMM>.txt' holds the snapshot
+of all stations at a time, 'minute<YYYYmmddHHMM>.txt' the one-minute feed of the hour ending at that
+time. A source returns the content of a file as an iterable of byte chunks, so parsing starts while a
+download or an archive member is still being read. Every source can prefetch: the named files are
+read into memory by a small thread pool and later opens are served from there, which overlaps the
+downloads of a whole window with parsing and ingesting the first hours.
+
+Sources compose. The viewer reads the cache directory first and falls back to the live API through
+a recorder that writes every response into the cache, so a recorded directory can be replayed as is,
+or packed into a zip or tar file and read without extracting it.
+
+"""
+
+import abc
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import os
+import tarfile
+import threading
+import zipfile
+
+import numpy as np
+
+import aws_parser
+
+
+API_URL = 'https://apihub.kma.go.kr/api/typ01/cgi-bin/url/nph-aws2_min'
+AUTH_KEY = 'Ud0jPfajTAWdIz32o5wFcg'
+TIME_FORMAT = '%Y%m%d%H%M'
+
+
+def snapshot_name(time_str):
+    return 'data%s.txt' % time_str
+
+
+def minute_name(end_str):
+    return 'minute%s.txt' % end_str
+
+
+def parse_name(name):
+    """Returns (start, end) datetimes of the steps in a named file, one minute apart."""
+    minutes = name.startswith('minute')
+    end = datetime.datetime.strptime(name[len('minute' if minutes else 'data'):-len('.txt')], TIME_FORMAT)
+    return (end - datetime.timedelta(minutes=59) if minutes else end), end
+
+
+class DataSource(abc.ABC):
+    """Base class of the sources. Subclasses implement _open and, if they do not have every file,
+    contains."""
+
+    # sub-directory of the cache holding the stores built from this source, sources of the real
+    # feed share the top level one
+    namespace = ''
+    station_capacity = 1024
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.executor = None
+        self.prefetched = dict()
+        self.lock = threading.Lock()
+
+    def contains(self, name):
+        return True
+
+    def open(self, name):
+        """Iterable of the byte chunks of a file."""
+        with self.lock:
+            future = self.prefetched.pop(name, None)
+        if future is not None:
+            return iter(future.result())
+        return self._open(name)
+
+    def prefetch(self, names):
+        """Starts reading the named files in the background."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers)
+            for name in names:
+                if name not in self.prefetched and self.contains(name):
+                    self.prefetched[name] = self.executor.submit(lambda n=name: list(self._open(n)))
+
+    @abc.abstractmethod
+    def _open(self, name):
+        """Iterable of the byte chunks of a file, read from the source itself."""
+
+
+class HttpSource(DataSource):
+    """The live KMA API hub."""
+
+    def __init__(self, auth_key=AUTH_KEY, url=API_URL, chunk_size=1 << 16, workers=4):
+        super().__init__(workers)
+        self.auth_key = auth_key
+        self.url = url
+        self.chunk_size = chunk_size
+
+    def url_of(self, name):
+        start, end = parse_name(name)
+        params = 'stn=0&tm2=%s&disp=1&help=1&authKey=%s' % (end.strftime(TIME_FORMAT), self.auth_key)
+        if name.startswith('minute'):
+            params = 'tm1=%s&' % start.strftime(TIME_FORMAT) + params
+        return '%s?%s' % (self.url, params)
+
+    def _open(self, name):
+        # requests takes longer to import than the rest of the data modules, a warm cache never needs it
+        import requests
+
+        print('Downloading: %s' % name)
+        with requests.get(self.url_of(name), stream=True) as response:
+            response.raise_for_status()
+            yield from response.iter_content(self.chunk_size)
+
+
+class DirectorySource(DataSource):
+    """Files of a local directory, such as the download cache."""
+
+    def __init__(self, directory, workers=4):
+        super().__init__(workers)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.files = {file for file in os.listdir(directory) if file.endswith('.txt')}
+
+    def contains(self, name):
+        return name in self.files
+
+    def _open(self, name):
+        print('Using cached file: %s' % name)
+        return aws_parser.iter_file(os.path.join(self.directory, name))
+
+    def write(self, name, chunks):
+        """Writes the chunks to a file of the directory while passing them on. Only complete files
+        end up in the directory."""
+        path = os.path.join(self.directory, name)
+        with open(path + '.part', 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(path + '.part', path)
+        self.files.add(name)
+
+
+class RecordingSource(DataSource):
+    """Passes the files of another source on and records them into a DirectorySource."""
+
+    def __init__(self, source, directory, workers=4):
+        super().__init__(workers)
+        self.source = source
+        self.directory = directory
+
+    @property
+    def namespace(self):
+        return self.source.namespace
+
+    @property
+    def station_capacity(self):
+        return self.source.station_capacity
+
+    def contains(self, name):
+        return self.source.contains(name)
+
+    def _open(self, name):
+        return self.directory.write(name, self.source.open(name))
+
+
+class ArchiveSource(DataSource):
+    """Files inside of a zip or tar archive, matched by their base name and read without extracting
+    the archive."""
+
+    def __init__(self, path, chunk_size=1 << 16, workers=4):
+        super().__init__(workers)
+        self.chunk_size = chunk_size
+        # archive members are read one at a time, the archive objects are not thread safe
+        self.archive_lock = threading.Lock()
+        if zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            members = self.archive.namelist()
+        else:
+            self.archive = tarfile.open(path)
+            members = [member for member in self.archive.getmembers() if member.isfile()]
+        self.members = {os.path.basename(getattr(m, 'name', m)): m for m in members}
+
+    def contains(self, name):
+        return name in self.members
+
+    def _open(self, name):
+        with self.archive_lock:
+            if isinstance(self.archive, zipfile.ZipFile):
+                data = self.archive.read(self.members[name])
+            else:
+                data = self.archive.extractfile(self.members[name]).read()
+        for offset in range(0, len(data), self.chunk_size):
+            yield data[offset:offset + self.chunk_size]
+
+
+class SyntheticSource(DataSource):
+    """Deterministic generated feed for any number of stations. The given station ids come first,
+    further stations get ids from 100000 on. Values are smooth fields over the positions plus noise
+    seeded by the seed and the time, so the same file always has the same content."""
+
+    def __init__(self, count, ids=(), positions=None, seed=0, missing=0.02, workers=4):
+        super().__init__(workers)
+        self.count = count
+        self.seed = seed
+        self.missing = missing
+        self.namespace = 'synthetic-%d-%d' % (count, seed)
+        self.station_capacity = max(count, DataSource.station_capacity)
+        ids = list(ids)[:count]
+        self.ids = np.array([int(i) for i in ids] + list(range(100000, 100000 + count - len(ids))), dtype=np.int64)
+
+        rng = np.random.default_rng(seed)
+        known = np.zeros((0, 2)) if positions is None else np.asarray(positions, dtype=np.float64)[:len(ids)]
+        # stations without a position are spread over the map
+        extra = rng.uniform((0, 0), (800, 760), (count - len(known), 2))
+        self.positions = np.concatenate([known, extra]) / (800, 760)
+
+    def contains(self, name):
+        return name.startswith('data') or name.startswith('minute')
+
+    def frame(self, time):
+        """(stations, 16) numeric columns at a datetime, -99 for missing values."""
+        rng = np.random.default_rng((self.seed, int(time.strftime(TIME_FORMAT))))
+        x, y = self.positions[:, 0], self.positions[:, 1]
+        hours = time.hour + time.minute / 60
+        day = np.sin((hours - 9) / 24 * 2 * np.pi)
+        # a front moving across the map once a day
+        front = np.tanh((x + y - 2 * (hours / 24)) * 6)
+
+        ta = 14 + 7 * day - 10 * y - 3 * front + rng.normal(0, 0.3, self.count)
+        hm = np.clip(65 - 20 * day + 15 * front + rng.normal(0, 2, self.count), 5, 100)
+        td = ta - (100 - hm) / 5
+        ps = 1013 + 6 * front - 4 * x + rng.normal(0, 0.2, self.count)
+        wd = (225 + 60 * front + rng.normal(0, 15, self.count)) % 360
+        ws = np.abs(3 + 4 * front * front + rng.normal(0, 1, self.count))
+        rain = np.where(front > 0.5, rng.exponential(2, self.count), 0)
+
+        columns = np.column_stack([wd, ws, wd, ws * 1.5, wd, ws, ta, (rain > 0).astype(np.float64),
+                                   rain / 4, rain, rain * 3, rain * 6, hm, ps - 10, ps, td])
+        columns[rng.random(columns.shape) < self.missing] = -99.0
+        return columns
+
+    def _open(self, name):
+        start, end = parse_name(name)
+        # one format operation per minute, much faster than formatting row by row
+        fmt = ('%d,%d,' + ','.join(['%.1f'] * aws_parser.NUMERIC_COLUMNS) + ',=\n') * self.count
+        yield b'#START7777\n# YYMMDDHHMI STN WD1 WS1 WDS WSS WD10 WS10 TA RE RN-15m RN-60m RN-12H RN-DAY HM PA PS TD\n'
+        time = start
+        while time <= end:
+            table = np.column_stack([np.full(self.count, int(time.strftime(TIME_FORMAT))), self.ids, self.frame(time)])
+            yield (fmt % tuple(table.ravel().tolist())).encode('ascii')
+            time += datetime.timedelta(minutes=1)
+
+
+class FallbackSource(DataSource):
+    """Reads every file from the first source that has it. A prefetched file is opened from the source
+    it was prefetched through, which hands out and drops its copy, even if an earlier source has the
+    file by then, such as the cache a recorder wrote it into."""
+
+    def __init__(self, *sources):
+        super().__init__()
+        self.sources = sources
+
+    @property
+    def namespace(self):
+        # a cache in front of a generated feed belongs to the feed
+        return next((source.namespace for source in self.sources if source.namespace), '')
+
+    @property
+    def station_capacity(self):
+        return max(source.station_capacity for source in self.sources)
+
+    def pick(self, name):
+        for source in self.sources:
+            if source.contains(name):
+                return source
+        raise FileNotFoundError(name)
+
+    def contains(self, name):
+        return any(source.contains(name) for source in self.sources)
+
+    def open(self, name):
+        # prefetched maps names to the source they were prefetched through
+        with self.lock:
+            source = self.prefetched.pop(name, None)
+        if source is not None:
+            return source.open(name)
+        return self._open(name)
+
+    def prefetch(self, names):
+        for name in names:
+            if self.contains(name):
+                source = self.pick(name)
+                with self.lock:
+                    self.prefetched[name] = source
+                source.prefetch([name])
+
+    def _open(self, name):
+        return self.pick(name).open(name)
@@ -43,6 +43,28 @@ def delaunay(S):
     return edges
 
 
+def triangles(edges):
+    """Assumes edges is the result of delaunay().
+    Returns a list of (i, j, k) index triples, one per triangular face. Marks the edges as visited."""
+
+    faces = []
+    for e in edges:
+        if e.data is True:
+            continue
+
+        for e1 in (e, e.sym):
+            e2 = e1.sym.onext
+            e3 = e2.sym.onext
+
+            e1.data = True
+            e2.data = True
+            e3.data = True
+
+            if e1.org == e3.dest:
+                faces.append((e1.org, e2.org, e3.org))
+    return faces
+
+
 # -----------------------------------------------------------------
 # quad edge data structure.
 
@@ -0,0 +1,140 @@
+"""
+
+Gradients and derived fields over the Delaunay triangulation of the stations.
+
+A field is linear on every triangle of the triangulation of the stations reporting it, so its gradient
+on a triangle follows from the three vertex values by solving a 2 x 2 system, done for all triangles
+at once. The gradient at a station is the area weighted mean over the triangles around it. Map units
+are turned into metres east and north with the linear part of the map projection (util), so gradients
+come out per metre.
+
+Derived products are built on that: the magnitude of the temperature gradient, which is large along
+fronts, the geostrophic wind balancing the sea level pressure gradient, and differences of two fields
+such as the dew point depression TA - TD. Products are computed per step of a window on first use and
+kept in a small LRU cache, fractional steps are interpolated between the two steps around them.
+
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import dynamic_delaunay
+import util
+
+
+# latitude the projection is linearized at, the middle of the map
+REFERENCE_LATITUDE = 36.0
+EARTH_ROTATION = 7.2921e-5
+AIR_DENSITY = 1.225
+
+
+def map_to_metres():
+    """(2, 2) matrix turning a gradient per map unit into one per metre east and north."""
+    # map = M (lon, lat) + t, so d/d(lon, lat) = M^T d/dmap
+    units_per_degree = util.transformation[0][0]
+    metres_per_degree = np.array([111320.0 * np.cos(np.radians(REFERENCE_LATITUDE)), 110570.0])
+    return units_per_degree.T / metres_per_degree[:, None]
+
+
+MAP_TO_METRES = map_to_metres()
+
+
+def triangle_gradients(positions, triangles, values):
+    """Returns the (m, 2) gradients per map unit and the areas of the triangles. Triangles with a
+    missing vertex value or no area have a NaN gradient."""
+    a, b, c = (positions[triangles[:, i]] for i in range(3))
+    fa, fb, fc = (values[triangles[:, i]] for i in range(3))
+    ab, ac = b - a, c - a
+    det = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gx = ((fb - fa) * ac[:, 1] - (fc - fa) * ab[:, 1]) / det
+        gy = ((fc - fa) * ab[:, 0] - (fb - fa) * ac[:, 0]) / det
+    gradient = np.column_stack((gx, gy))
+    gradient[det == 0] = np.nan
+    return gradient, np.abs(det) / 2
+
+
+def vertex_gradients(positions, triangles, values):
+    """Returns the (n, 2) gradients per map unit at the vertices, the area weighted mean of the
+    gradients of the triangles around each, NaN for vertices without a valid triangle."""
+    gradient, area = triangle_gradients(positions, triangles, values)
+    valid = ~np.isnan(gradient).any(axis=1)
+    gradient, area, triangles = gradient[valid], area[valid], triangles[valid]
+    n = len(positions)
+    vertices = triangles.reshape(-1)
+    weights = np.repeat(area, 3)
+    total = np.bincount(vertices, weights, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.column_stack([np.bincount(vertices, weights * np.repeat(gradient[:, i], 3), n) / total for i in range(2)])
+
+
+class DerivedFields:
+    """Derived products of the fields of a window for every store column. positions are the
+    (columns, 2) map positions of the store columns, NaN for columns without a known position."""
+
+    def __init__(self, window, positions, capacity=48):
+        self.window = window
+        self.positions = np.full((window.store.station_capacity, 2), np.nan, dtype=np.float64)
+        self.positions[:len(positions)] = positions
+        # columns that can take part in a triangulation
+        self.known = np.nonzero(~np.isnan(self.positions).any(axis=1))[0]
+        self.triangulations = dict()
+        self.capacity = capacity
+        self.cache = OrderedDict()
+
+    def field(self, step, name):
+        return self.window.frame(step)[:, self.window.field(name)]
+
+    def gradient(self, step, name):
+        """(columns, 2) gradient of a field per metre east and north at a step."""
+        values = self.field(step, name)[self.known].astype(np.float64)
+        if name not in self.triangulations:
+            self.triangulations[name] = dynamic_delaunay.DynamicDelaunay(self.positions[self.known])
+        triangulation = self.triangulations[name]
+        triangulation.update(~np.isnan(values))
+        triangles = triangulation.triangles().astype(np.int64)
+        # triangles reaching out to the corner points have no meaningful gradient
+        triangles = triangles[(triangles < len(self.known)).all(axis=1)]
+
+        out = np.full((len(self.positions), 2), np.nan)
+        out[self.known] = vertex_gradients(self.positions[self.known], triangles, values) @ MAP_TO_METRES.T
+        return out
+
+    def gradient_magnitude(self, spec, step):
+        east, north = self.gradient(step, spec['field']).T
+        return np.hypot(east, north) * spec.get('scale', 1.0)
+
+    def geostrophic_wind(self, step, name='PS'):
+        """(u, v) in m/s of the geostrophic wind of a pressure field in hPa."""
+        east, north = (self.gradient(step, name) * 100).T
+        coriolis = 2 * EARTH_ROTATION * np.sin(np.radians(REFERENCE_LATITUDE))
+        return -north / (AIR_DENSITY * coriolis), east / (AIR_DENSITY * coriolis)
+
+    def geostrophic_speed(self, spec, step):
+        return np.hypot(*self.geostrophic_wind(step, spec['field']))
+
+    def difference(self, spec, step):
+        first, second = spec['fields']
+        return self.field(step, first) - self.field(step, second)
+
+    def values(self, spec, step):
+        """Values of a product at a whole step, from the cache if computed before."""
+        key = (tuple(sorted((k, str(v)) for k, v in spec.items())), step)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        with np.errstate(invalid='ignore'):
+            result = getattr(self, spec['product'])(spec, step).astype(np.float32)
+        self.cache[key] = result
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return result
+
+    def sample(self, spec, t):
+        """Values of a product at fractional step t, interpolated like Window.sample."""
+        i = min(max(int(t), 0), self.window.steps - 1)
+        f = np.float32(min(max(t - i, 0), 1))
+        if f and i + 1 < self.window.steps:
+            return self.values(spec, i) * (1 - f) + self.values(spec, i + 1) * f
+        return self.values(spec, i)
@@ -0,0 +1,354 @@
+"""
+
+Incremental Delaunay triangulation supporting single point insertion and removal.
+
+Points keep a fixed slot index for their whole lifetime, so the position buffer never changes and
+moving from one hour to the next only pays for the stations whose validity actually changed.
+The point set is enclosed by four far away corner points (the same ones update_trangulation used
+with the divide-and-conquer algorithm), which are never removed.
+
+"""
+
+import logging
+import random
+
+import numpy as np
+
+import delaunay
+
+
+# -----------------------------------------------------------------
+# Predicates
+
+
+def orient(ax, ay, bx, by, cx, cy):
+    """> 0 if a, b, c are in counterclockwise order, < 0 if clockwise, 0 if collinear."""
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def in_circle(ax, ay, bx, by, cx, cy, dx, dy):
+    """> 0 if d lies inside of the circumcircle of the counterclockwise triangle abc."""
+    a1, a2 = ax - dx, ay - dy
+    b1, b2 = bx - dx, by - dy
+    c1, c2 = cx - dx, cy - dy
+    a3, b3, c3 = a1 * a1 + a2 * a2, b1 * b1 + b2 * b2, c1 * c1 + c2 * c2
+    return a1 * (b2 * c3 - b3 * c2) - a2 * (b1 * c3 - b3 * c1) + a3 * (b1 * c2 - b2 * c1)
+
+
+# -----------------------------------------------------------------
+# Triangulation
+
+
+class DynamicDelaunay:
+    """Triangle based Delaunay triangulation.
+    Every triangle stores its vertices counterclockwise and, for each vertex, the neighbouring
+    triangle across the opposite edge (-1 if there is none)."""
+
+    def __init__(self, positions, bound=10000):
+        positions = [(float(p[0]), float(p[1])) for p in positions]
+        self.n = len(positions)
+        positions += [(-bound, -bound), (bound, -bound), (bound, bound), (-bound, bound)]
+        self.positions = np.array(positions, dtype=np.float32)
+        self.px = [p[0] for p in positions]
+        self.py = [p[1] for p in positions]
+
+        self.tri = []
+        self.nbr = []
+        self.free = []
+        self.vert_tri = [-1] * len(positions)
+        self.triangle_cache = None
+
+        # two triangles spanning the corners
+        c0, c1, c2, c3 = self.n, self.n + 1, self.n + 2, self.n + 3
+        t0 = self._new_triangle(c0, c1, c2)
+        t1 = self._new_triangle(c0, c2, c3)
+        self.nbr[t0][1] = t1
+        self.nbr[t1][2] = t0
+        for c, t in ((c0, t0), (c1, t0), (c2, t0), (c3, t1)):
+            self.vert_tri[c] = t
+        self.last = t0
+
+    # -------------------------------------------------------------
+    # public interface
+
+    def is_inserted(self, i):
+        return self.vert_tri[i] != -1
+
+    def insert(self, i):
+        """Inserts point slot i. Returns False if it is already present or duplicates another point."""
+        if self.vert_tri[i] != -1:
+            return False
+        t, k = self.locate(self.px[i], self.py[i])
+        if k == -2:
+            return False
+        self.triangle_cache = None
+        if k == -1:
+            self._split_triangle(t, i)
+        else:
+            self._split_edge(t, k, i)
+        return True
+
+    def remove(self, i):
+        """Removes point slot i and re-triangulates the hole it leaves behind."""
+        if i >= self.n:
+            raise ValueError("Corner points can not be removed.")
+        if self.vert_tri[i] == -1:
+            return False
+        self.triangle_cache = None
+
+        # collect the star of i counterclockwise
+        star, link, outer = [], [], {}
+        t = self.vert_tri[i]
+        while True:
+            v = self.tri[t]
+            k = v.index(i)
+            a, b = v[(k + 1) % 3], v[(k + 2) % 3]
+            star.append(t)
+            link.append(a)
+            outer[(a, b)] = self.nbr[t][k]
+            t = self.nbr[t][(k + 1) % 3]
+            if t == star[0]:
+                break
+
+        for t in star:
+            self._free_triangle(t)
+        self.vert_tri[i] = -1
+
+        new = self._fill_hole(link)
+
+        # stitch the new triangles together and to the surrounding triangles
+        edges = {}
+        for t in new:
+            v = self.tri[t]
+            for k in range(3):
+                edges[(v[(k + 1) % 3], v[(k + 2) % 3])] = (t, k)
+        for (a, b), (t, k) in edges.items():
+            if (b, a) in edges:
+                self.nbr[t][k] = edges[(b, a)][0]
+                continue
+            u = outer[(a, b)]
+            self.nbr[t][k] = u
+            if u != -1:
+                w = self.tri[u]
+                self.nbr[u][[j for j in range(3) if w[j] != a and w[j] != b][0]] = t
+        for t in new:
+            for j in self.tri[t]:
+                self.vert_tri[j] = t
+        self.last = new[0]
+        return True
+
+    def update(self, mask):
+        """Makes the inserted point set equal to the slots where mask is True.
+        Returns the number of insertions and removals performed."""
+        changes = 0
+        for i in range(self.n):
+            if not mask[i] and self.vert_tri[i] != -1:
+                changes += self.remove(i)
+        for i in range(self.n):
+            if mask[i] and self.vert_tri[i] == -1:
+                changes += self.insert(i)
+        return changes
+
+    def triangles(self):
+        """Returns an (m, 3) uint32 array of the vertex slots of every triangle."""
+        if self.triangle_cache is None:
+            live = [v for v in self.tri if v is not None]
+            self.triangle_cache = np.array(live, dtype=np.uint32).reshape(-1, 3)
+        return self.triangle_cache
+
+    def locate(self, x, y):
+        """Walks from the last visited triangle to the triangle containing (x, y).
+        Returns (triangle, k) where k is -1 if the point is inside the triangle, the index of the
+        vertex opposite the edge if it lies on an edge, or -2 if it coincides with a vertex."""
+        px, py = self.px, self.py
+        t = self.last
+        while True:
+            v = self.tri[t]
+            r = random.randrange(3)  # randomized edge order avoids cycling on degenerate walks
+            on_edge = -1
+            for j in range(3):
+                k = (r + j) % 3
+                a, b = v[(k + 1) % 3], v[(k + 2) % 3]
+                o = orient(px[a], py[a], px[b], py[b], x, y)
+                if o < 0:
+                    u = self.nbr[t][k]
+                    if u == -1:
+                        raise ValueError("Point (%f, %f) is outside of the triangulation." % (x, y))
+                    t = u
+                    break
+                if o == 0:
+                    on_edge = k
+            else:
+                self.last = t
+                for j in v:
+                    if px[j] == x and py[j] == y:
+                        return t, -2
+                return t, on_edge
+
+    def cross_check(self):
+        """Compares the triangulation against the divide-and-conquer result for the same points.
+        Returns True if both contain the same triangles. Cocircular points may legitimately differ."""
+        slots = [i for i in range(len(self.vert_tri)) if self.vert_tri[i] != -1]
+        edges = delaunay.delaunay([(self.px[i], self.py[i]) for i in slots])
+        expected = set(frozenset(slots[j] for j in f) for f in delaunay.triangles(edges))
+        actual = set(frozenset(int(j) for j in f) for f in self.triangles())
+        if expected != actual:
+            logging.log(logging.WARNING, "Triangulation mismatch: %d missing, %d unexpected"
+                        % (len(expected - actual), len(actual - expected)))
+            return False
+        return True
+
+    # -------------------------------------------------------------
+    # topological operators
+
+    def _new_triangle(self, a, b, c):
+        if self.free:
+            t = self.free.pop()
+            self.tri[t] = [a, b, c]
+            self.nbr[t] = [-1, -1, -1]
+        else:
+            t = len(self.tri)
+            self.tri.append([a, b, c])
+            self.nbr.append([-1, -1, -1])
+        return t
+
+    def _free_triangle(self, t):
+        self.tri[t] = None
+        self.nbr[t] = None
+        self.free.append(t)
+
+    def _replace_neighbour(self, t, old, new):
+        if t != -1:
+            n = self.nbr[t]
+            n[n.index(old)] = new
+
+    def _split_triangle(self, t, p):
+        a, b, c = self.tri[t]
+        na, nb, nc = self.nbr[t]
+        t1 = self._new_triangle(p, c, a)
+        t2 = self._new_triangle(p, a, b)
+        self.tri[t] = [p, b, c]
+        self.nbr[t] = [na, t1, t2]
+        self.nbr[t1] = [nb, t2, t]
+        self.nbr[t2] = [nc, t, t1]
+        self._replace_neighbour(nb, t, t1)
+        self._replace_neighbour(nc, t, t2)
+        for j, u in ((p, t), (a, t1), (b, t), (c, t)):
+            self.vert_tri[j] = u
+        self._legalize([(t, 0), (t1, 0), (t2, 0)])
+
+    def _split_edge(self, t, k, p):
+        v = self.tri[t]
+        c, a, b = v[k], v[(k + 1) % 3], v[(k + 2) % 3]
+        nta, ntb = self.nbr[t][(k + 1) % 3], self.nbr[t][(k + 2) % 3]
+        u = self.nbr[t][k]
+        if u == -1:
+            raise ValueError("Point lies on the boundary of the triangulation.")
+        w = self.tri[u]
+        j = [m for m in range(3) if w[m] != a and w[m] != b][0]
+        d = w[j]
+        nub, nua = self.nbr[u][(j + 1) % 3], self.nbr[u][(j + 2) % 3]
+
+        t2 = self._new_triangle(p, b, c)
+        t4 = self._new_triangle(p, a, d)
+        self.tri[t] = [p, c, a]
+        self.tri[u] = [p, d, b]
+        self.nbr[t] = [ntb, t4, t2]
+        self.nbr[t2] = [nta, t, u]
+        self.nbr[u] = [nua, t2, t4]
+        self.nbr[t4] = [nub, u, t]
+        self._replace_neighbour(nta, t, t2)
+        self._replace_neighbour(nub, u, t4)
+        for m, s in ((p, t), (a, t), (b, u), (c, t), (d, u)):
+            self.vert_tri[m] = s
+        self._legalize([(t, 0), (t2, 0), (u, 0), (t4, 0)])
+
+    def _flip(self, t, i):
+        """Flips the edge opposite vertex i of triangle t. The vertex stays at index 0 of both
+        resulting triangles."""
+        v = self.tri[t]
+        p, a, b = v[i], v[(i + 1) % 3], v[(i + 2) % 3]
+        nta, ntb = self.nbr[t][(i + 1) % 3], self.nbr[t][(i + 2) % 3]
+        u = self.nbr[t][i]
+        w = self.tri[u]
+        j = [m for m in range(3) if w[m] != a and w[m] != b][0]
+        q = w[j]
+        nub, nua = self.nbr[u][(j + 1) % 3], self.nbr[u][(j + 2) % 3]
+
+        self.tri[t] = [p, a, q]
+        self.tri[u] = [p, q, b]
+        self.nbr[t] = [nub, u, ntb]
+        self.nbr[u] = [nua, nta, t]
+        self._replace_neighbour(nub, u, t)
+        self._replace_neighbour(nta, t, u)
+        for m, s in ((p, t), (a, t), (q, t), (b, u)):
+            self.vert_tri[m] = s
+        return u
+
+    def _legalize(self, stack):
+        px, py = self.px, self.py
+        while stack:
+            t, i = stack.pop()
+            u = self.nbr[t][i]
+            if u == -1:
+                continue
+            v = self.tri[t]
+            p, a, b = v[i], v[(i + 1) % 3], v[(i + 2) % 3]
+            w = self.tri[u]
+            q = [m for m in w if m != a and m != b][0]
+            if in_circle(px[p], py[p], px[a], py[a], px[b], py[b], px[q], py[q]) > 0:
+                u = self._flip(t, i)
+                stack.append((t, 0))
+                stack.append((u, 0))
+
+    def _fill_hole(self, polygon):
+        """Triangulates the counterclockwise star polygon left by a removed vertex by clipping
+        Delaunay ears, i.e. convex ears whose circumcircle contains no other polygon vertex."""
+        px, py = self.px, self.py
+        polygon = list(polygon)
+        new = []
+        while len(polygon) > 3:
+            m = len(polygon)
+            for j in range(m):
+                a, b, c = polygon[j - 1], polygon[j], polygon[(j + 1) % m]
+                if orient(px[a], py[a], px[b], py[b], px[c], py[c]) <= 0:
+                    continue
+                if any(in_circle(px[a], py[a], px[b], py[b], px[c], py[c], px[d], py[d]) > 0
+                       for d in polygon if d != a and d != b and d != c):
+                    continue
+                new.append(self._new_triangle(a, b, c))
+                del polygon[j]
+                break
+            else:
+                raise RuntimeError("No Delaunay ear found while removing a vertex.")
+        new.append(self._new_triangle(*polygon))
+        return new
+
+
+# -----------------------------------------------------------------
+# Values
+
+
+def fill_from_neighbors(values, triangles, rounds=8):
+    """Replaces NaN rows of (vertices, k) values, column by column, with the mean of the valid
+    neighbours in the triangulation, growing inwards for up to rounds rings. Returns a copy."""
+    values = np.array(values, dtype=np.float32)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    src = triangles.reshape(-1)
+    dst = triangles[:, [1, 2, 0]].reshape(-1)
+    # every edge in both directions, inner edges appear twice which only weights the mean evenly
+    src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+    for _ in range(rounds):
+        missing = np.isnan(values)
+        if not missing.any():
+            break
+        valid = ~missing[src]
+        total = np.zeros(values.shape, dtype=np.float64)
+        count = np.zeros(values.shape, dtype=np.float64)
+        np.add.at(total, dst, np.where(valid, values[src], 0))
+        np.add.at(count, dst, valid)
+        fill = missing & (count > 0)
+        if not fill.any():
+            break
+        values[fill] = (total[fill] / count[fill]).astype(np.float32)
+    return values
@@ -0,0 +1,81 @@
+"""
+
+Event-driven frame scheduling.
+
+Frames are only drawn when something changed: the camera, the data, the time, the variable, the window
+size, user input, or while an animation is running. Without any of these the main loop blocks in
+glfw.wait_events_timeout instead of spinning at the swap interval. The heatmap pass has its own set of
+reasons, so frames that only change the imgui overlay reuse the cached heatmap texture.
+
+"""
+
+import glfw
+
+
+HEATMAP_REASONS = {'camera', 'data', 'time', 'variable', 'size'}
+
+
+class FrameScheduler:
+    def __init__(self, idle_timeout=1.0, settle_frames=3):
+        self.idle_timeout = idle_timeout
+        # imgui needs a few frames after an input to update hover and click states
+        self.settle_frames = settle_frames
+        self.settle = 0
+        self.dirty = set(HEATMAP_REASONS)
+        self.animations = set()
+        self.drawn = 0
+        self.skipped = 0
+
+    def invalidate(self, *reasons):
+        self.dirty.update(reasons)
+
+    def animate(self, name, running):
+        """Keeps frames coming while the named animation is running."""
+        if running:
+            self.animations.add(name)
+        else:
+            self.animations.discard(name)
+
+    def busy(self):
+        return bool(self.dirty or self.animations or self.settle)
+
+    def wait(self):
+        """Processes pending events, blocking until the next one when there is nothing to draw."""
+        if self.busy():
+            glfw.poll_events()
+        else:
+            glfw.wait_events_timeout(self.idle_timeout)
+
+    def begin_frame(self):
+        """Returns True if a frame has to be drawn."""
+        if 'input' in self.dirty:
+            self.dirty.discard('input')
+            self.settle = self.settle_frames
+        draw = self.busy()
+        self.settle = max(self.settle - 1, 0)
+        if draw:
+            self.drawn += 1
+        else:
+            self.skipped += 1
+        return draw
+
+    def consume_heatmap(self):
+        """Returns the reasons to render the heatmap pass again, empty if it is up to date, and clears them."""
+        reasons = self.dirty & HEATMAP_REASONS
+        self.dirty -= HEATMAP_REASONS
+        return reasons
+
+    def attach(self, window, impl):
+        """Chains input callbacks of the window so that every input event wakes the loop. Call after
+        the imgui renderer installed its own callbacks."""
+        def chain(setter, callback=None):
+            def wrapped(*args):
+                self.invalidate('input')
+                if callback is not None:
+                    callback(*args)
+            setter(window, wrapped)
+
+        chain(glfw.set_key_callback, impl.keyboard_callback)
+        chain(glfw.set_char_callback, impl.char_callback)
+        chain(glfw.set_cursor_pos_callback, impl.mouse_callback)
+        chain(glfw.set_mouse_button_callback)
@@ -0,0 +1,159 @@
+"""
+
+Streaming uploads into GL buffer objects.
+
+A StreamBuffer owns a buffer object and tracks its capacity. Storage is allocated geometrically, so
+data that grows a little every update reallocates only now and then. Whole replacements orphan the
+storage first (glBufferData with no data at the same size), which lets the driver hand out fresh
+memory instead of waiting for draws still reading the old contents. Partial updates keep a CPU shadow
+of the contents and send only the runs of elements that actually changed, with glBufferSubData.
+
+All transfers go through the GL_COPY_WRITE_BUFFER binding point, which is not part of any vertex
+array state, so uploading an element buffer never disturbs the bound VAO. Only core GL 3.3 calls are
+used, so this runs the same on Mesa's software rasterizer. Every transfer is counted in counters, and
+the storage of all live buffers in resident_bytes.
+
+"""
+
+import time
+import weakref
+
+from OpenGL.GL import *
+import numpy as np
+
+
+class UploadCounters:
+    """Bytes, calls, allocations and CPU time spent in uploads, in total and over the last frame."""
+
+    def __init__(self):
+        self.total = {'bytes': 0, 'calls': 0, 'allocations': 0, 'seconds': 0.0}
+        self.current = dict.fromkeys(self.total, 0)
+        self.last_frame = dict(self.current)
+
+    def add(self, nbytes, calls, allocations, seconds):
+        for counters in (self.total, self.current):
+            counters['bytes'] += nbytes
+            counters['calls'] += calls
+            counters['allocations'] += allocations
+            counters['seconds'] += seconds
+
+    def end_frame(self):
+        self.last_frame = self.current
+        self.current = dict.fromkeys(self.total, 0)
+
+
+counters = UploadCounters()
+# every StreamBuffer that has not been collected
+live = weakref.WeakSet()
+
+
+def resident_bytes():
+    """Storage allocated by the live stream buffers."""
+    return sum(buffer.capacity for buffer in list(live))
+
+
+class StreamBuffer:
+    def __init__(self, target=GL_ARRAY_BUFFER, usage=GL_DYNAMIC_DRAW, capacity=0, growth=2.0, max_runs=16):
+        self.target = target
+        self.usage = usage
+        self.growth = growth
+        # more changed runs than this are sent as one range spanning all of them
+        self.max_runs = max_runs
+        self.buffer = glGenBuffers(1)
+        self.capacity = 0
+        self.size = 0
+        self.shadow = None
+        live.add(self)
+        if capacity:
+            self.reserve(capacity)
+
+    def bind(self):
+        """Binds the buffer to its target, for attribute setup and drawing."""
+        glBindBuffer(self.target, self.buffer)
+
+    def reserve(self, nbytes):
+        """Makes sure the buffer holds at least nbytes. Returns True if the storage was reallocated,
+        which loses the contents."""
+        if nbytes <= self.capacity:
+            return False
+        self.capacity = max(int(nbytes), int(self.capacity * self.growth), 256)
+        begin = time.perf_counter()
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer)
+        glBufferData(GL_COPY_WRITE_BUFFER, self.capacity, None, self.usage)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        counters.add(0, 1, 1, time.perf_counter() - begin)
+        self.shadow = None
+        return True
+
+    def upload(self, data):
+        """Replaces the contents with data, orphaning the old storage."""
+        data = np.ascontiguousarray(data)
+        begin = time.perf_counter()
+        allocated = 0
+        if data.nbytes > self.capacity:
+            self.capacity = max(data.nbytes, int(self.capacity * self.growth), 256)
+            allocated = 1
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer)
+        glBufferData(GL_COPY_WRITE_BUFFER, self.capacity, None, self.usage)
+        if data.nbytes:
+            glBufferSubData(GL_COPY_WRITE_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        counters.add(data.nbytes, 2, allocated, time.perf_counter() - begin)
+        self.size = data.nbytes
+        self.shadow = None
+
+    def write(self, data, offset=0):
+        """Writes data at a byte offset without orphaning, the buffer must be large enough."""
+        data = np.ascontiguousarray(data)
+        begin = time.perf_counter()
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, offset, data.nbytes, data)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        counters.add(data.nbytes, 1, 0, time.perf_counter() - begin)
+        self.size = max(self.size, offset + data.nbytes)
+        self.shadow = None
+
+    def update(self, data):
+        """Replaces the contents with data, sending only the elements (rows of the first axis) that
+        differ from the previous update. Returns the number of bytes sent."""
+        data = np.ascontiguousarray(data)
+        if len(data) == 0 and self.shadow is not None and self.shadow.shape == data.shape:
+            return 0
+        if self.shadow is None or self.shadow.shape != data.shape or self.shadow.dtype != data.dtype:
+            self.upload(data)
+            self.shadow = data.copy()
+            return data.nbytes
+
+        # compared bitwise, so NaN payloads and signed zeros count as changes
+        old = self.shadow.view(np.uint8).reshape(len(data), -1)
+        changed = np.nonzero((old != data.view(np.uint8).reshape(len(data), -1)).any(axis=1))[0]
+        if len(changed) == 0:
+            return 0
+        # mostly new contents are cheaper to send whole into orphaned storage
+        if len(changed) * 2 > len(data):
+            self.upload(data)
+            self.shadow = data.copy()
+            return data.nbytes
+        # runs of consecutive changed elements, merged into one range when there are too many
+        breaks = np.nonzero(np.diff(changed) > 1)[0]
+        starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+        ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+        if len(starts) > self.max_runs:
+            starts, ends = starts[:1], ends[-1:]
+
+        sent = 0
+        begin = time.perf_counter()
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            chunk = data[start:end]
+            glBufferSubData(GL_COPY_WRITE_BUFFER, start * data.strides[0], chunk.nbytes, chunk)
+            sent += chunk.nbytes
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        counters.add(sent, len(starts), 0, time.perf_counter() - begin)
+        self.shadow[:] = data
+        return sent
+
+    def delete(self):
+        glDeleteBuffers(1, [self.buffer])
+        self.buffer = None
+        self.capacity = 0
@@ -0,0 +1,164 @@
+"""
+
+Progressive render target for the heatmap pass.
+
+The heatmap is rendered off screen and sampled by the territory shader. While the view moves, a pure
+pan by whole pixels reuses the previous image: it is blitted to the second target at its new offset
+and only the exposed strips are rendered. Other changes of the view, such as zooming, render into a
+reduced resolution viewport of the target, which the territory shader magnifies. Once the view has
+been still for refine_delay seconds the image is refined to full resolution.
+
+"""
+
+import logging
+
+from OpenGL.GL import *
+
+
+class RenderTarget:
+    """Framebuffer with a color texture and a depth stencil renderbuffer."""
+
+    def __init__(self, width, height):
+        self.fbo = glGenFramebuffers(1)
+        self.texture = glGenTextures(1)
+        self.rbo = glGenRenderbuffers(1)
+
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        # reduced resolution images are magnified
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        self.resize(width, height)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self.rbo)
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            logging.error("Framebuffer is not complete!")
+
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def resize(self, width, height):
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, None)
+
+        glBindRenderbuffer(GL_RENDERBUFFER, self.rbo)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
+
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+
+class ProgressiveHeatmap:
+    def __init__(self, width, height, reduced_scale=4, refine_delay=0.15):
+        self.width = width
+        self.height = height
+        self.reduced_scale = reduced_scale
+        self.refine_delay = refine_delay
+        # the first target holds the current image, the second one is the blit destination
+        self.targets = [RenderTarget(width, height), RenderTarget(width, height)]
+        self.viewport = (width, height)
+        self.zoom = None
+        self.origin = None
+        # sub-pixel error accumulated by shifting, in pixels
+        self.drift = (0.0, 0.0)
+        self.last_motion = 0.0
+        self.renders = {'full': 0, 'reduced': 0, 'shift': 0}
+
+    @property
+    def texture(self):
+        return self.targets[0].texture
+
+    @property
+    def texture_scale(self):
+        """Part of the texture holding the image, for the territory shader."""
+        return self.viewport[0] / self.width, self.viewport[1] / self.height
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        for target in self.targets:
+            target.resize(width, height)
+        self.viewport = (width, height)
+        self.zoom = None
+
+    def refining(self):
+        """True while the current image is a reduced resolution one."""
+        return self.viewport != (self.width, self.height)
+
+    def needs_refine(self, now):
+        return self.refining() and now - self.last_motion >= self.refine_delay
+
+    def render(self, zoom, origin, content_changed, draw, now, shiftable=True):
+        """Brings the image up to date. zoom identifies the view up to its position, origin is the
+        normalized device position of a fixed world point. draw issues the heatmap draw calls. Images
+        that are not shiftable are rendered again on every pan."""
+        origin = ((origin[0] + 1) * self.width / 2, (origin[1] + 1) * self.height / 2)
+        zoomed = self.zoom is not None and zoom != self.zoom
+        panned = self.origin is not None and origin != self.origin
+        dx, dy = (round(origin[0] - self.origin[0]), round(origin[1] - self.origin[1])) if panned else (0, 0)
+        drift = (self.drift[0] + origin[0] - self.origin[0] - dx, self.drift[1] + origin[1] - self.origin[1] - dy) if panned else (0, 0)
+        shiftable = shiftable and panned and not (content_changed or zoomed or self.refining()) and \
+            abs(dx) < self.width and abs(dy) < self.height
+
+        if shiftable and abs(drift[0]) < 0.25 and abs(drift[1]) < 0.25:
+            self._shift(dx, dy, draw)
+            self.drift = drift
+            self.last_motion = now
+            self.zoom = zoom
+            self.origin = origin
+            return
+
+        self.drift = (0.0, 0.0)
+        # a pan that drifted off the pixel grid is realigned at full resolution, shifting continues afterwards
+        if (zoomed or panned) and not shiftable:
+            self.viewport = (max(1, -(-self.width // self.reduced_scale)), max(1, -(-self.height // self.reduced_scale)))
+            self._draw_into(self.targets[0], [], draw)
+            self.renders['reduced'] += 1
+            self.last_motion = now
+        else:
+            self.viewport = (self.width, self.height)
+            self._draw_into(self.targets[0], [], draw)
+            self.renders['full'] += 1
+        self.zoom = zoom
+        self.origin = origin
+
+    def _shift(self, dx, dy, draw):
+        """Moves the current image by whole pixels and renders the exposed strips only."""
+        w, h = self.width, self.height
+        source, target = self.targets
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, source.fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, target.fbo)
+        glBlitFramebuffer(max(0, -dx), max(0, -dy), min(w, w - dx), min(h, h - dy),
+                          max(0, dx), max(0, dy), min(w, w + dx), min(h, h + dy), GL_COLOR_BUFFER_BIT, GL_NEAREST)
+
+        strips = []
+        if dx > 0:
+            strips.append((0, 0, dx, h))
+        elif dx < 0:
+            strips.append((w + dx, 0, -dx, h))
+        if dy > 0:
+            strips.append((0, 0, w, dy))
+        elif dy < 0:
+            strips.append((0, h + dy, w, -dy))
+        self._draw_into(target, strips, draw)
+        self.targets.reverse()
+        self.renders['shift'] += 1
+
+    def _draw_into(self, target, scissors, draw):
+        glBindFramebuffer(GL_FRAMEBUFFER, target.fbo)
+        glViewport(0, 0, self.viewport[0], self.viewport[1])
+        glClearColor(0.0, 0.0, 0.0, 1.0)
+        if scissors:
+            glEnable(GL_SCISSOR_TEST)
+            for rect in scissors:
+                glScissor(*rect)
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                draw()
+            glDisable(GL_SCISSOR_TEST)
+        else:
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            draw()
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
@@ -0,0 +1,140 @@
+"""
+
+Marching-triangles isoline extraction over a triangulation.
+
+All (level, triangle) pairs are classified at once, the crossing points of every contour segment are
+computed in bulk, and segments are stitched into polylines through the mesh edges they cross.
+
+"""
+
+from collections import OrderedDict
+
+from OpenGL.GL import *
+import numpy as np
+
+import gpu_buffers
+
+
+# the three edges of a triangle as vertex index pairs
+TRIANGLE_EDGES = np.array([[0, 1], [1, 2], [2, 0]])
+
+
+class Isolines:
+    def __init__(self, levels, segments, segment_levels, polylines):
+        self.levels = levels
+        self.segments = segments              # (k, 2, 2) float32 end points
+        self.segment_levels = segment_levels  # (k,) index into levels
+        self.polylines = polylines            # list of (level index, (m, 2) array)
+
+
+def extract_segments(positions, triangles, values, levels):
+    """Returns the contour segments of every level as (segments, edge keys, level indices).
+    The edge key of a segment end is the mesh edge it lies on, shared with the neighbouring segment."""
+    positions = np.asarray(positions, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    triangles = triangles[~np.isnan(values[triangles]).any(axis=1)]
+
+    ends = triangles[:, TRIANGLE_EDGES]                       # (m, 3, 2)
+    above = values[triangles][None, :, :] >= levels[:, None, None]  # (l, m, 3)
+    crossing = above[..., TRIANGLE_EDGES[:, 0]] != above[..., TRIANGLE_EDGES[:, 1]]
+
+    # each crossed triangle has exactly two crossed edges, nonzero lists them pairwise
+    level, tri, edge = np.nonzero(crossing)
+    a, b = ends[tri, edge, 0], ends[tri, edge, 1]
+    va, vb = values[a], values[b]
+    t = ((levels[level] - va) / (vb - va))[:, None]
+    points = positions[a] + (positions[b] - positions[a]) * t
+    # contours of different levels crossing the same mesh edge must not be joined
+    keys = (level * len(values) + np.minimum(a, b)) * len(values) + np.maximum(a, b)
+
+    segments = points.reshape(-1, 2, 2).astype(np.float32)
+    return segments, keys.reshape(-1, 2), level[::2]
+
+
+def stitch(segments, keys, segment_levels):
+    """Joins segments sharing a mesh edge into polylines. Returns a list of (level, points)."""
+    # segment end e = 2 * s + side, partner is the end of the neighbouring segment on the same edge
+    flat = keys.reshape(-1)
+    order = np.argsort(flat, kind='stable')
+    shared = np.nonzero(flat[order][1:] == flat[order][:-1])[0]
+    partner = np.full(len(flat), -1, dtype=np.int64)
+    partner[order[shared]] = order[shared + 1]
+    partner[order[shared + 1]] = order[shared]
+    partner = partner.tolist()
+    levels = segment_levels.tolist()
+    points = segments.reshape(-1, 2)
+
+    visited = [False] * len(segments)
+    polylines = []
+    # open polylines start at an end without partner, closed loops anywhere
+    starts = [e for e in range(len(partner)) if partner[e] == -1] + [2 * s for s in range(len(segments))]
+    for e in starts:
+        if visited[e >> 1]:
+            continue
+        line = [e]
+        while e != -1 and not visited[e >> 1]:
+            visited[e >> 1] = True
+            line.append(e ^ 1)
+            e = partner[e ^ 1]
+        polylines.append((levels[line[0] >> 1], points[line]))
+    return polylines
+
+
+class IsolineCache:
+    """Caches extracted isolines per (variable, time, levels)."""
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def get(self, variable, time, levels, positions, triangles, values):
+        key = (variable, time, tuple(levels))
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        segments, keys, segment_levels = extract_segments(positions, triangles, values, levels)
+        isolines = Isolines(tuple(levels), segments, segment_levels, stitch(segments, keys, segment_levels))
+        self.entries[key] = isolines
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return isolines
+
+    def clear(self):
+        self.entries.clear()
+
+
+class IsolineLayer:
+    """Single GL_LINES draw of the current isolines."""
+
+    def __init__(self):
+        self.vao = None
+        self.vbo = None
+        self.count = 0
+        self.isolines = None
+
+    def gen_buffer(self):
+        self.vao = glGenVertexArrays(1)
+        self.vbo = gpu_buffers.StreamBuffer(GL_ARRAY_BUFFER, GL_DYNAMIC_DRAW)
+        glBindVertexArray(self.vao)
+
+        self.vbo.bind()
+        glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 2 * sizeof(GLfloat), ctypes.c_void_p(0))
+        glEnableVertexAttribArray(0)
+
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def upload(self, isolines):
+        if isolines is self.isolines:
+            return
+        self.isolines = isolines
+        self.count = len(isolines.segments) * 2
+        # storage grows geometrically, so scrubbing through hours rarely reallocates
+        self.vbo.upload(isolines.segments)
+
+    def draw(self):
+        if self.count:
+            glBindVertexArray(self.vao)
+            glDrawArrays(GL_LINES, 0, self.count)
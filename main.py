@@ -1,36 +1,66 @@
-import datetime
-
 from imgui.integrations.glfw import GlfwRenderer
 from OpenGL.GL import *
-import PIL.Image
 
 import glm
 import glfw
 
 import imgui
 
+import argparse
+import datetime
+import json
 import logging
+import os
+import signal
 import sys
 import time
 import numpy as np
-import delaunay
-
-import mesh
+import dynamic_delaunay
+import frame_scheduler
+import gpu_buffers
+import heatmap_target
+import clusters
+import isolines
+import memory
+
+import raster
+import regions
+import session
 import shader
-import territory_parser
+import station_labels
 import weather_data
+import wind_field
+from assets import AssetManager, decode_image
+from palette import colorize, palette_lut
 from aws_point import AWSPoint
+from territory_mesh import TerritoryMesh
 
 
 toggle_distribution = False
+toggle_wind = False
+toggle_isolines = False
+toggle_isoline_labels = True
+toggle_regions = False
+toggle_area_weighted = False
+toggle_alerts = False
+# palette ranges from quantiles of the data instead of the configured ranges
+toggle_auto_range = True
 selected_type = 'TA'
+# multi view mode shows several variables side by side, sharing one triangulation
+toggle_multi_view = False
+view_types = ['TA', 'HM', 'WS10', 'PS']
+view_layout = 0
+# label, number of views, columns
+VIEW_LAYOUTS = [('2 × 2', 4, 2), ('1 × 2', 2, 2), ('1 × 3', 3, 3), ('1 × 4', 4, 4)]
+MAX_VIEWS = 4
 
 # set logging level
 logging.basicConfig(level=logging.INFO)
 scroll_y = 0.0
+scheduler = frame_scheduler.FrameScheduler()
 
-def impl_glfw_init():
-    width, height = 960, 960
+def impl_glfw_init(visible=True, size=(960, 960)):
+    width, height = size
     window_name = "KMeteorology - Weather Data Visualization"
 
     if not glfw.init():
@@ -46,6 +76,8 @@ def impl_glfw_init():
 
     # Enable multi-sample anti-aliasing
     glfw.window_hint(glfw.SAMPLES, 8)
+    # replays draw into a window that is never shown
+    glfw.window_hint(glfw.VISIBLE, visible)
 
     # Create a windowed mode window + its OpenGL context
     window = glfw.create_window(width, height, window_name, None, None)
@@ -59,226 +91,309 @@ def impl_glfw_init():
     return window
 
 
+def fit_framebuffer(window, size):
+    """Resizes the window so that its framebuffer has size, whatever the content scale."""
+    width, height = glfw.get_framebuffer_size(window)
+    if (width, height) != tuple(size) and width and height:
+        window_width, window_height = glfw.get_window_size(window)
+        glfw.set_window_size(window, round(window_width * size[0] / width), round(window_height * size[1] / height))
+
+
 def scroll_callback(window, xoffset, yoffset):
     global scroll_y
     scroll_y += yoffset
     scroll_y = max(0, min(15, scroll_y))
+    scheduler.invalidate('input')
 
 
 def gen_global_vbo():
-    guid = glGenBuffers(1)
-    glBindBuffer(GL_UNIFORM_BUFFER, guid)
-    glBufferData(GL_UNIFORM_BUFFER, 192, None, GL_STATIC_DRAW)
-    glBindBuffer(GL_UNIFORM_BUFFER, 0)
-    glBindBufferBase(GL_UNIFORM_BUFFER, 0, guid)
+    guid = gpu_buffers.StreamBuffer(GL_UNIFORM_BUFFER, GL_STREAM_DRAW, 192)
+    glBindBufferBase(GL_UNIFORM_BUFFER, 0, guid.buffer)
     return guid
 
 
-def create_quad():
-    quad = mesh.Mesh()
-    quad.vertices = [
-        -0.5, -0.5, 0.0,
-        0.5, -0.5, 0.0,
-        0.5, 0.5, 0.0,
-        -0.5, 0.5, 0.0
-    ]
-    quad.indices = [
-        0, 1, 2,
-        2, 3, 0
-    ]
-    quad.gen_buffer()
-    return quad
+triangulation_buffers = None
+triangulation = None
+triangulation_points = []
+triangulation_values = None
+# the first variable as interpolated by the heatmap, filled in at stations triangulated for the others
+triangulation_field = None
+# grid weights of the triangulation for area weighted statistics, dropped when its triangles change
+triangulation_raster = None
+
+
+def create_triangulation(points):
+    global triangulation_buffers, triangulation, triangulation_points, triangulation_raster
+
+    # every station keeps a fixed vertex slot, only the index buffer changes with validity
+    triangulation_points = list(points.values())
+    triangulation = dynamic_delaunay.DynamicDelaunay([(p.x, p.y) for p in triangulation_points])
+    triangulation_raster = None
+    n = len(triangulation.positions)
+
+    # positions never change, values are updated where they changed, indices are replaced
+    positions = gpu_buffers.StreamBuffer(GL_ARRAY_BUFFER, GL_STATIC_DRAW)
+    positions.upload(triangulation.positions)
+    # the values of every view interleaved per vertex
+    values = gpu_buffers.StreamBuffer(GL_ARRAY_BUFFER, GL_DYNAMIC_DRAW, n * MAX_VIEWS * 4)
+    # a triangulation of n points has fewer than 2n triangles, the index buffer never grows
+    indices = gpu_buffers.StreamBuffer(GL_ELEMENT_ARRAY_BUFFER, GL_DYNAMIC_DRAW, n * 6 * 4)
+
+    # one vertex array per view, they share positions and indices and differ in the value column only
+    vaos = []
+    for view in range(MAX_VIEWS):
+        vao = glGenVertexArrays(1)
+        glBindVertexArray(vao)
+
+        # position
+        positions.bind()
+        glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 2 * sizeof(GLfloat), ctypes.c_void_p(0))
+        glEnableVertexAttribArray(0)
+
+        # value
+        values.bind()
+        glVertexAttribPointer(1, 1, GL_FLOAT, GL_FALSE, MAX_VIEWS * sizeof(GLfloat), ctypes.c_void_p(view * sizeof(GLfloat)))
+        glEnableVertexAttribArray(1)
+
+        # indices
+        indices.bind()
+        vaos.append(vao)
 
+    glBindVertexArray(0)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
-triangulation_buffers = None
+    triangulation_buffers = (vaos, positions, values, indices)
+    return vaos
 
-def create_triangulation(n):
-    global triangulation_buffers
-    n += 4
 
-    vao = glGenVertexArrays(1)
-    vbo = glGenBuffers(2)
-    ebo = glGenBuffers(1)
+def initialize_points(points):
+    present = weather_data.window.present()
+    latest = weather_data.window.frame(weather_data.window.steps - 1)
+    for p in points.values():
+        p.initialize_data(weather_data, present, latest)
 
-    glBindVertexArray(vao)
 
-    np_positions = np.array([(0, 0) for _ in range(n)], dtype=np.float32)
-    np_values = np.array([0 for _ in range(n)], dtype=np.float32)
-    np_indices = np.array([0 for _ in range(n * 3)], dtype=np.uint32)
+def window_step(time_factor):
+    return time_factor * (weather_data.window.steps - 1)
 
-    # position
-    glBindBuffer(GL_ARRAY_BUFFER, vbo[0])
-    glBufferData(GL_ARRAY_BUFFER, np_positions.nbytes, np_positions, GL_STATIC_DRAW)
-    glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 2 * sizeof(GLfloat), ctypes.c_void_p(0))
-    glEnableVertexAttribArray(0)
 
-    # value
-    glBindBuffer(GL_ARRAY_BUFFER, vbo[1])
-    glBufferData(GL_ARRAY_BUFFER, np_values.nbytes, np_values, GL_STATIC_DRAW)
-    glVertexAttribPointer(1, 1, GL_FLOAT, GL_FALSE, sizeof(GLfloat), ctypes.c_void_p(0))
-    glEnableVertexAttribArray(1)
+def gather_points(points, frame):
+    """Rows of a per store column frame for every point, NaN where a point has no data."""
+    columns = np.array([p.column if p.has_data else -1 for p in points.values()], dtype=np.int64)
+    values = frame[np.maximum(columns, 0)]
+    values[columns < 0] = np.nan
+    return values
 
-    # indices
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
-    glBufferData(GL_ELEMENT_ARRAY_BUFFER, np_indices.nbytes, np_indices, GL_STATIC_DRAW)
 
-    glBindVertexArray(0)
-    glBindBuffer(GL_ARRAY_BUFFER, 0)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+def sample_points(points, fields, t):
+    """Values of the fields for every point at window step t, NaN where a point has no data."""
+    frame = weather_data.window.sample(t)
+    return gather_points(points, frame[:, [weather_data.window.field(f) for f in fields]])
 
-    triangulation_buffers = (vao, vbo[0], vbo[1], ebo)
-    return vao
 
+def sample_variable(points, type, t):
+    """Values of a distribution variable, plain or rolling, for every point at window step t."""
+    return gather_points(points, weather_data.sample_variable(type, t))
 
-def update_trangulation(points, type, t):
-    global triangulation_buffers
 
-    positions = []
-    values = []
-    indices = []
+def update_trangulation(points, types, t):
+    """Triangulates the stations with a value of any of the variables and uploads the values of each
+    into its own column. triangulation_values are the values of the first variable."""
+    global triangulation_buffers, triangulation_values, triangulation_field, triangulation_raster
 
-    for p in points.values():
-        value = float('NaN')
-        if p.has_data:
-            value = p.get_slerped_data(type, t)
-        if np.isnan(value):
-            continue
-        positions.append((p.x, p.y))
-        values.append(value)
+    # NaN for stations without data and the corner points
+    columns = np.full((len(triangulation.positions), MAX_VIEWS), np.nan, dtype=np.float32)
+    for view, type in enumerate(types):
+        columns[:len(points), view] = sample_variable(points, type, t)
+    triangulation_values = columns[:, 0].copy()
+    valid = ~np.isnan(columns[:, :len(types)]).all(axis=1)
 
-    inf = 10000
-    positions.append((-inf, -inf))
-    positions.append((-inf, inf))
-    positions.append((inf, -inf))
-    positions.append((inf, inf))
+    # only the stations whose validity changed are inserted or removed
+    changes = triangulation.update(valid)
+    if changes:
+        triangulation_raster = None
+    np_indices = triangulation.triangles()
+    logging.log(logging.DEBUG, "Triangulation updated: %d changes, %d triangles" % (changes, len(np_indices)))
 
-    values.append(0)
-    values.append(0)
-    values.append(0)
-    values.append(0)
+    # stations in the shared triangulation without a value of a variable take their neighbours' mean
+    if len(types) > 1:
+        columns[:len(points)] = dynamic_delaunay.fill_from_neighbors(columns, np_indices)[:len(points)]
+    triangulation_field = columns[:, 0].copy()
+    values = np.where(np.isnan(columns), 0, columns)
 
-    n = len(positions)
-    edges = delaunay.delaunay(positions)
+    # moving the time slider changes values only, and only the sub-ranges that changed are sent
+    triangulation_buffers[2].update(values)
+    if changes or triangulation_buffers[3].size != np_indices.nbytes:
+        triangulation_buffers[3].upload(np_indices)
 
-    for e in edges:
-        if e.data is True:
-            continue
+    return np_indices.size
 
-        e1 = e
-        e2 = e1.sym.onext
-        e3 = e2.sym.onext
+def update_wind(points, wind, t):
+    u, v = sample_points(points, ['U10', 'V10'], t).T
+    wind.update_field(u, v)
 
-        e4 = e.sym
-        e5 = e4.sym.onext
-        e6 = e5.sym.onext
 
-        e1.data = True
-        e2.data = True
-        e3.data = True
+def update_region_stats(points, zonal, type, t, area_weighted=False):
+    """Per region statistics of a variable at window step t. Area weighted statistics are taken over
+    the interpolated field as shown by the heatmap, the others over the stations of each region."""
+    global triangulation_raster
 
-        e4.data = True
-        e5.data = True
-        e6.data = True
+    if area_weighted:
+        # moving the time slider mostly changes values only, the weights are kept while the triangles are
+        if triangulation_raster is None:
+            triangulation_raster = raster.TriangleRaster(zonal.grid, triangulation.positions, triangulation.triangles())
+        # cells of triangles with a NaN vertex, such as a corner point, are NaN and left out
+        return zonal.area_stats(triangulation_raster.interpolate(triangulation_field))
+    return zonal.station_stats(sample_variable(points, type, t))
 
-        i1 = e1.org
-        i2 = e2.org
-        i3 = e3.org
-        i4 = e3.dest
 
-        if i1 == i4:
-            indices.append(i1)
-            indices.append(i2)
-            indices.append(i3)
+def draw_choropleth(territory_mesh, region_table, colors, color_location):
+    """Fills every region with one color, regions with a NaN color are skipped. Each region is drawn
+    with the stencil even-odd trick, the fill pass clears the stencil again for the next region."""
+    glBindVertexArray(territory_mesh.vao)
+    glClear(GL_STENCIL_BUFFER_BIT)
+    glEnable(GL_STENCIL_TEST)
+    for region, color in enumerate(colors):
+        if np.isnan(color).any():
+            continue
+        glStencilFunc(GL_ALWAYS, 0, 1)
+        glStencilOp(GL_INVERT, GL_INVERT, GL_INVERT)
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        for ring in region_table.region_rings[region]:
+            p = territory_mesh.params[ring]
+            glDrawElements(GL_TRIANGLE_FAN, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
 
-        i1 = e4.org
-        i2 = e5.org
-        i3 = e6.org
-        i4 = e6.dest
+        glStencilFunc(GL_EQUAL, 1, 1)
+        glStencilOp(GL_ZERO, GL_ZERO, GL_ZERO)
+        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+        glUniform4f(color_location, *color, 1.0)
+        for ring in region_table.region_rings[region]:
+            p = territory_mesh.params[ring]
+            glDrawElements(GL_TRIANGLE_FAN, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
+    glDisable(GL_STENCIL_TEST)
+
+
+def draw_alerts(events, viewproj_matrix, screen_size):
+    """Outlines of the alert events and the rule and peak of each next to it."""
+    draw_list = imgui.get_background_draw_list()
+    color = imgui.get_color_u32_rgba(1.0, 0.25, 0.2, 0.95)
+    for event in events:
+        outline = []
+        for x, y in event.outline.tolist():
+            v = viewproj_matrix * glm.vec3(-x, -y, 0)
+            outline.append(((v.x + 1) * screen_size.x / 2, (-v.y + 1) * screen_size.y / 2))
+        draw_list.add_polyline(outline, color, flags=imgui.DRAW_CLOSED, thickness=2)
+        x, y = max(outline, key=lambda p: (-p[1], p[0]))
+        draw_list.add_text(x, y, color, '%s (%g)' % (event.rule.name, event.peak))
+
+
+def isoline_levels(value_range, spacing):
+    """Levels every spacing over the palette range, so the isolines follow the colors of the heatmap."""
+    low, high = value_range
+    return np.arange(low, high + spacing / 2, spacing).tolist()
+
+
+def draw_isoline_labels(contours, viewproj_matrix, screen_size, min_points=8):
+    draw_list = imgui.get_background_draw_list()
+    color = imgui.get_color_u32_rgba(1.0, 1.0, 1.0, 0.9)
+    for level, line in contours.polylines:
+        if len(line) < min_points:
+            continue
+        x, y = line[len(line) // 2]
+        v = viewproj_matrix * glm.vec3(-x, -y, 0)
+        if v.x < -1 or v.x > 1 or v.y < -1 or v.y > 1:
+            continue
+        draw_list.add_text((v.x + 1) * screen_size.x / 2, (-v.y + 1) * screen_size.y / 2, color, '%g' % contours.levels[level])
 
-        if i1 == i4:
-            indices.append(i1)
-            indices.append(i2)
-            indices.append(i3)
 
-    np_positions = np.array(positions, dtype=np.float32)
-    np_values = np.array(values, dtype=np.float32)
-    np_indices = np.array(indices, dtype=np.uint32)
+tw, th = 960, 960
+heatmap = None
 
-    glBindVertexArray(triangulation_buffers[0])
 
-    glBindBuffer(GL_ARRAY_BUFFER, triangulation_buffers[1])
-    glBufferData(GL_ARRAY_BUFFER, np_positions.nbytes, np_positions, GL_STATIC_DRAW)
+def upload_lut(lut):
+    """1D texture of a palette lookup table, sampled at the same entries as palette.colorize."""
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_1D, texture)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage1D(GL_TEXTURE_1D, 0, GL_RGBA8, len(lut), 0, GL_RGB, GL_UNSIGNED_BYTE, np.ascontiguousarray(lut))
+    glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glBindTexture(GL_TEXTURE_1D, 0)
+    return texture
 
-    glBindBuffer(GL_ARRAY_BUFFER, triangulation_buffers[2])
-    glBufferData(GL_ARRAY_BUFFER, np_values.nbytes, np_values, GL_STATIC_DRAW)
 
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, triangulation_buffers[3])
-    glBufferData(GL_ELEMENT_ARRAY_BUFFER, np_indices.nbytes, np_indices, GL_STATIC_DRAW)
+def value_ranges(types):
+    """Palette range of every variable, from the data over the window with toggle_auto_range."""
+    if toggle_auto_range:
+        return {type: weather_data.variable_range(type) for type in types}
+    return {type: weather_data.distribution_types[type]['range'] for type in types}
 
-    glBindVertexArray(0)
-    glBindBuffer(GL_ARRAY_BUFFER, 0)
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
-    return len(indices)
+def draw_heatmap(shader_program, mesh, count, palette_texture, value_range, world_matrix):
+    glBindTexture(GL_TEXTURE_1D, palette_texture)
+    glUseProgram(shader_program.active_shader)
 
-texture = None
-tw, th = 960, 960
-fbo = None
-rbo = None
+    model_location = glGetUniformLocation(shader_program.active_shader, "u_PointValueRange")
+    glUniform2f(model_location, *value_range)
 
+    model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
+    glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(world_matrix))
 
-def resize_render_target(width, height):
-    global texture
+    glBindVertexArray(mesh)
+    glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT, None)
 
-    glBindTexture(GL_TEXTURE_2D, texture)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, None)
 
-    glBindRenderbuffer(GL_RENDERBUFFER, rbo)
-    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
+def shown_types():
+    """Variables shown by the heatmap, one per view."""
+    if toggle_multi_view and toggle_distribution:
+        return view_types[:VIEW_LAYOUTS[view_layout][1]]
+    return [selected_type]
 
-    glBindTexture(GL_TEXTURE_2D, 0)
-    glBindRenderbuffer(GL_RENDERBUFFER, 0)
 
+def view_rects(count, columns, width, height):
+    """(x, y, width, height) viewports of count views in rows of columns, the first view top left."""
+    rows = -(-count // columns)
+    w, h = width // columns, height // rows
+    return [(view % columns * w, height - (view // columns + 1) * h, w, h) for view in range(count)]
 
-def load_texture(file):
-    image = PIL.Image.open(file)
-    img_data = np.array(list(image.getdata()), np.uint8)
-    width, height = image.size
-    texture = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, texture)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-    glGenerateMipmap(GL_TEXTURE_2D)
-    glBindTexture(GL_TEXTURE_2D, 0)
-    return texture
 
+def scale_rects(rects, viewport, size):
+    """Rectangles of a size x size screen in a viewport of the heatmap target."""
+    return [(x * viewport[0] // size[0], y * viewport[1] // size[1], w * viewport[0] // size[0], h * viewport[1] // size[1])
+            for x, y, w, h in rects]
 
-def create_render_target(width, height):
-    global texture, fbo, rbo
 
-    fbo = glGenFramebuffers(1)
-    glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+def draw_views(shader_program, meshes, count, views, world_matrix, rects):
+    """Draws the heatmap of every (palette texture, value range) view into its viewport, one draw call
+    per view over the shared triangulation."""
+    for mesh, (palette_texture, value_range), rect in zip(meshes, views, rects):
+        glViewport(*rect)
+        draw_heatmap(shader_program, mesh, count, palette_texture, value_range, world_matrix)
 
-    texture = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, texture)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, None)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
 
-    rbo = glGenRenderbuffers(1)
-    glBindRenderbuffer(GL_RENDERBUFFER, rbo)
-    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
-    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, rbo)
+def ui_state(time_factor, window_index, minute_data):
+    """State of the controls, as kept in session recordings."""
+    state = {'time_factor': time_factor, 'window_index': window_index, 'minute_data': minute_data}
+    for key in session.STATE_KEYS:
+        if key not in state:
+            state[key] = list(globals()[key]) if key == 'view_types' else globals()[key]
+    return state
 
-    if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
-        logging.error("Framebuffer is not complete!")
 
-    glBindFramebuffer(GL_FRAMEBUFFER, 0)
-    glBindTexture(GL_TEXTURE_2D, 0)
-    glBindRenderbuffer(GL_RENDERBUFFER, 0)
+def apply_state(state):
+    """Sets the controls to a recorded state. Returns (time_factor, window_index, minute_data), which
+    are local to the main loop."""
+    # recordings made before a control existed leave it as it is
+    for key in session.STATE_KEYS:
+        if key not in state:
+            continue
+        if key == 'view_types':
+            view_types[:] = state[key]
+        elif key in globals():
+            globals()[key] = state[key]
+    return state['time_factor'], state['window_index'], state['minute_data']
 
 
 def window_resize_callback(window, width, height):
@@ -289,51 +404,95 @@ def window_resize_callback(window, width, height):
     aspect_ratio = width / height
     tw = width
     th = height
+    scheduler.invalidate('size')
 
     # resize the texture
-    if texture:
-        resize_render_target(tw, th)
+    if heatmap:
+        heatmap.resize(tw, th)
 
 
-def main():
-    global window, selected_type, toggle_distribution
-    window = impl_glfw_init()
-    imgui.create_context()
-    font_header = imgui.get_io().fonts.add_font_from_file_ttf("Resources/naru.ttf", 24, None, imgui.get_io().fonts.get_glyph_ranges_korean())
-    font_body = imgui.get_io().fonts.add_font_from_file_ttf("Resources/naru.ttf", 16, None, imgui.get_io().fonts.get_glyph_ranges_korean())
-    impl = GlfwRenderer(window)
+def load_points(file):
+    points = {}
+    with open(file, 'r') as info_file:
+        for line in info_file:
+            if line.startswith('#'):
+                continue
+            info = line.split()
+            point = AWSPoint(info)
+            points[point.id] = point
+    return points
+
+
+def main(first_frame_only=False, recorder=None, replayer=None, timer=None, source=None, end=None):
+    """Runs the viewer. recorder records the input of every frame, replayer replaces the input with a
+    recording and timer times the phases of every frame. The data comes from source and ends at end,
+    passed on to weather_data.initialize."""
+    global window, heatmap, selected_type, toggle_distribution, toggle_wind, toggle_isolines, toggle_isoline_labels, \
+        toggle_regions, toggle_area_weighted, toggle_multi_view, view_layout, toggle_alerts, toggle_auto_range, scroll_y
+
+    # I/O and CPU bound loading runs on worker threads while the GL context is created
+    assets = AssetManager()
+    territory_mesh = TerritoryMesh()
+    assets.submit('stations', load_points, 'aws_info.txt')
+    assets.submit('weather data', weather_data.initialize, 24, source, end)
+    assets.submit('territory', territory_mesh.load_data, "Resources/territory.svg")
+    assets.submit('regions', regions.Regions.load, "Resources/territory.svg")
+    for i in range(3):
+        assets.submit(f'palette{i}', decode_image, f"Resources/palette{i}.png")
+
+    with assets.step('window'):
+        window = impl_glfw_init(visible=replayer is None, size=replayer.size if replayer is not None else (960, 960))
+        if replayer is not None:
+            fit_framebuffer(window, replayer.size)
+        imgui.create_context()
+    with assets.step('fonts'):
+        font_header = imgui.get_io().fonts.add_font_from_file_ttf("Resources/naru.ttf", 24, None, imgui.get_io().fonts.get_glyph_ranges_korean())
+        font_body = imgui.get_io().fonts.add_font_from_file_ttf("Resources/naru.ttf", 16, None, imgui.get_io().fonts.get_glyph_ranges_korean())
+        impl = GlfwRenderer(window)
 
     glfw.set_window_size_callback(window, window_resize_callback)
     glfw.set_scroll_callback(window, scroll_callback)
+    scheduler.attach(window, impl)
 
-    info_file = open('aws_info.txt', 'r')
-    points = {}
-    for line in info_file:
-        if line.startswith('#'):
-            continue
-        info = line.split()
-        point = AWSPoint(info)
-        points[point.id] = point
-    weather_data.initialize()
-    for p in points.values():
-        p.initialize_data(weather_data)
-
-    palette = [load_texture(f"Resources/palette{i}.png") for i in range(3)]
-    create_render_target(tw, th)
+    heatmap = heatmap_target.ProgressiveHeatmap(tw, th)
     shaders = dict()
     shaders["DEFAULT"] = shader.Shader("Resources/vertex_default.glsl", "Resources/fragment_default.glsl")
     shaders["TERRITORY"] = shader.Shader("Resources/vertex_territory.glsl", "Resources/fragment_territory.glsl")
     shaders["HEATMAP"] = shader.Shader("Resources/vertex_heatmap.glsl", "Resources/fragment_heatmap.glsl")
 
-    distribution_types = dict()
-    distribution_types["TA"] = {'id': 'TA', 'name': '기온', 'range': (5, 35), 'palette': 0}
-    distribution_types["HM"] = {'id': 'HM', 'name': '습도', 'range': (0, 100), 'palette': 2}
-    distribution_types["WS10"] = {'id': 'WS10', 'name': '풍속', 'range': (0, 60), 'palette': 1}
-    distribution_types["PS"] = {'id': 'PS', 'name': '기압', 'range': (995, 1025), 'palette': 0}
-    distribution_types["RN-60m"] = {'id': 'RN-60m', 'name': '강수량', 'range': (0, 100), 'palette': 1}
-
-    for shader_program in shaders.values():
-        shader_program.load_shaders()
+    with assets.step('shaders'):
+        for shader_program in shaders.values():
+            shader_program.load_shaders()
+
+    # upload the results to the GPU as they complete
+    palette = [None] * 3
+    palette_luts = [None] * 3
+    points = None
+    region_table = None
+    for name, result in assets.completed():
+        with assets.step('upload ' + name):
+            if name.startswith('palette'):
+                palette_luts[int(name[len('palette'):])] = palette_lut(result)
+                palette[int(name[len('palette'):])] = upload_lut(palette_luts[int(name[len('palette'):])])
+            elif name == 'territory':
+                territory_mesh.gen_buffer()
+            elif name == 'stations':
+                points = result
+            elif name == 'regions':
+                region_table = result
+
+    if recorder is not None:
+        # the hour the data ends at, so a replay reads the same data
+        recorder.end = weather_data.time_criteria.strftime('%Y%m%d%H%M')
+    with assets.step('station data'):
+        initialize_points(points)
+    label_layer = station_labels.StationLabelLayer(points.values())
+    label_layer.refresh(weather_data.window)
+    cluster_layer = clusters.ClusterLayer(points.values())
+    with assets.step('zonal stats'):
+        zonal = regions.ZonalStats(region_table, region_table.locate([(p.x, p.y) for p in points.values()]), raster.Grid())
+
+    distribution_types = weather_data.distribution_types
 
     guid = gen_global_vbo()
 
@@ -345,33 +504,85 @@ def main():
     mouse_pos_drag = (0, 0)
     current_scale = 1.0
     time_factor = 1.0
+    window_options = [('24h', 24), ('48h', 48), ('72h', 72), ('1 week', 24 * 7)]
+    window_index = 0
+    minute_data = False
 
     camera_center = (-399, -379)
     camera_size = 400
 
     elapsed_time = time.time()
 
-    territory_mesh = territory_parser.TerritoryMesh("Resources/territory.svg")
-    triangulation_mesh = create_triangulation(len(points))
-    triangulation_indices_count = update_trangulation(points, selected_type, time_factor * 23)
-    quad_mesh = create_quad()
+    triangulation_mesh = create_triangulation(points)
+    triangulation_indices_count = update_trangulation(points, shown_types(), window_step(time_factor))
+    cluster_layer.update(triangulation_values[:len(points)])
+    wind = wind_field.WindField(triangulation.positions[:triangulation.n])
+    wind.gen_buffer()
+    update_wind(points, wind, window_step(time_factor))
+    isoline_cache = isolines.IsolineCache()
+    isoline_layer = isolines.IsolineLayer()
+    isoline_layer.gen_buffer()
+    region_stats = None
+    region_colors = None
+    events = weather_data.alert_events(window_step(time_factor))
+    shown_ranges = value_ranges(shown_types())
+
+    # subsystems are measured in this order, objects shared by two count for the first
+    memory.register('raw cache', lambda: [weather_data.source])
+    memory.register('parsed data', lambda: [weather_data.store, weather_data.minute_pyramid, weather_data.window,
+                                            weather_data.aggregates, weather_data.derived_fields, weather_data.value_ranges,
+                                            weather_data.neighbor_graphs])
+    memory.register('station series', lambda: [points, label_layer])
+    memory.register('geometry', lambda: [territory_mesh, region_table, zonal, isoline_cache, isoline_layer])
+    memory.register('triangulation', lambda: [triangulation, triangulation_values, triangulation_field, cluster_layer, wind])
+    memory.register('alerts', lambda: [weather_data.alert_engines, events])
+    # static meshes and render targets are not stream buffers, their sizes are estimated
+    memory.register('gpu buffers', estimate=lambda: gpu_buffers.resident_bytes()
+                    + 4 * (len(territory_mesh.vertices) + len(territory_mesh.indices))
+                    + 7 * heatmap.width * heatmap.height * len(heatmap.targets))
+    memory_rows = []
+    memory_growth = []
+    memory_time = 0.0
+    if hasattr(signal, 'SIGUSR1'):
+        # long running instances can be asked for a report from outside
+        signal.signal(signal.SIGUSR1, lambda signum, frame: memory.dump())
 
     glUseProgram(0)
 
-    while not glfw.window_should_close(window):
-        glfw.poll_events()
-        impl.process_inputs()
+    last_camera = None
 
-        new_time = time.time()
-        delta_time = new_time - elapsed_time
-        elapsed_time = new_time
+    while not glfw.window_should_close(window) and not (replayer is not None and replayer.done()):
+        if replayer is not None:
+            # every recorded frame is drawn
+            scheduler.invalidate('input')
+        # blocks while there is nothing to draw
+        scheduler.wait()
+        if not scheduler.begin_frame():
+            continue
+        if timer is not None:
+            timer.begin_frame()
+            timer.mark('input')
+        impl.process_inputs()
 
         mouse_pos_last = mouse_pos_current
-        mouse_pos_current = glfw.get_cursor_pos(window)
+        if replayer is None:
+            new_time = time.time()
+            # the first frame after idling must not jump animations ahead
+            delta_time = min(new_time - elapsed_time, 0.1)
+            mouse_pos_current = glfw.get_cursor_pos(window)
+            pressed = glfw.get_mouse_button(window, glfw.MOUSE_BUTTON_LEFT) == glfw.PRESS
+            captured = imgui.get_io().want_capture_mouse
+        else:
+            frame = replayer.next()
+            fit_framebuffer(window, frame['size'])
+            new_time, delta_time = elapsed_time + replayer.delta_time, replayer.delta_time
+            mouse_pos_current = tuple(frame['cursor'])
+            pressed, captured, scroll_y = frame['pressed'], frame['captured'], frame['scroll']
+        elapsed_time = new_time
 
-        if not imgui.get_io().want_capture_mouse:
+        if not captured:
             moust_pos_delta = (0, 0)
-            if glfw.get_mouse_button(window, glfw.MOUSE_BUTTON_LEFT) == glfw.PRESS:
+            if pressed:
                 moust_pos_delta = (
                     mouse_pos_current[0] - mouse_pos_last[0],
                     mouse_pos_current[1] - mouse_pos_last[1]
@@ -382,12 +593,18 @@ def main():
                 )
 
         screen_size = glm.vec2(glfw.get_framebuffer_size(window))
-        aspect_ratio = screen_size.x / screen_size.y if screen_size.y != 0.0 else 1.0
-
-        if screen_size.y != 0.0:
+        # every view shows the same part of the map in a viewport of its own
+        multi_view = toggle_multi_view and toggle_distribution
+        if multi_view:
+            rects = view_rects(VIEW_LAYOUTS[view_layout][1], VIEW_LAYOUTS[view_layout][2], int(screen_size.x), int(screen_size.y))
+        else:
+            rects = [(0, 0, int(screen_size.x), int(screen_size.y))]
+        aspect_ratio = rects[0][2] / rects[0][3] if rects[0][3] != 0 else 1.0
+
+        if rects[0][3] != 0:
             camera_center = (
-                camera_center[0] + moust_pos_delta[0] * 2.0 * camera_size / screen_size.y,
-                camera_center[1] + moust_pos_delta[1] * 2.0 * camera_size / screen_size.y
+                camera_center[0] + moust_pos_delta[0] * 2.0 * camera_size / rects[0][3],
+                camera_center[1] + moust_pos_delta[1] * 2.0 * camera_size / rects[0][3]
             )
         # clamp camera center
         camera_center = (
@@ -398,6 +615,15 @@ def main():
         a = camera_size
         b = 400 * pow(2, scroll_y * -0.5)
         camera_size = a + (b - a) * delta_time * 16.0
+        zooming = abs(b - camera_size) > b * 1e-3
+        if not zooming:
+            camera_size = b
+        scheduler.animate('zoom', zooming)
+
+        camera = (camera_center, camera_size, screen_size.x, screen_size.y, tuple(rects))
+        if camera != last_camera:
+            scheduler.invalidate('camera')
+            last_camera = camera
 
         world_matrix = glm.scale(glm.mat4(1), glm.vec3(-1.0, -1.0, 1.0))
 
@@ -405,41 +631,38 @@ def main():
         projection_matrix = glm.ortho(-aspect_ratio * camera_size, aspect_ratio * camera_size, -camera_size, camera_size, -1000.0, 1000.0)
         viewprojinv_matrix = glm.inverse(projection_matrix * view_matrix)
 
-        # update global uniform buffer
-        glBindBuffer(GL_UNIFORM_BUFFER, guid)
-        glBufferSubData(GL_UNIFORM_BUFFER, 0, 64, glm.value_ptr(view_matrix))
-        glBufferSubData(GL_UNIFORM_BUFFER, 64, 64, glm.value_ptr(projection_matrix))
-        glBufferSubData(GL_UNIFORM_BUFFER, 128, 64, glm.value_ptr(viewprojinv_matrix))
-        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        # update global uniform buffer, the three matrices in one upload
+        guid.upload(np.concatenate([np.ctypeslib.as_array(glm.value_ptr(m), (16,))
+                                    for m in (view_matrix, projection_matrix, viewprojinv_matrix)]))
 
         # First Pass
+        if timer is not None:
+            timer.mark('heatmap')
         glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
 
-        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
-        glBindTexture(GL_TEXTURE_2D, palette[distribution_types[selected_type]['palette']])
-
-        glClearColor(0.0, 0.0, 0.0, 1.0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-        glViewport(0, 0, tw, th)
-
-        shader_program = shaders["HEATMAP"]
-        glUseProgram(shader_program.active_shader)
-
-        model_location = glGetUniformLocation(shaders["HEATMAP"].active_shader, "u_PointValueRange")
-        glUniform2f(model_location, *distribution_types[selected_type]['range'])
-
-        model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
-        glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(world_matrix))
-
-        glBindVertexArray(triangulation_mesh)
-        glDrawElements(GL_TRIANGLES, triangulation_indices_count, GL_UNSIGNED_INT, None)
+        # the heatmap texture is reused as long as nothing it depends on changed, while the view moves it is
+        # shifted or rendered at reduced resolution and refined once the view is still
+        reasons = scheduler.consume_heatmap()
+        if reasons or heatmap.needs_refine(new_time):
+            origin = projection_matrix * view_matrix * glm.vec3(0, 0, 0)
+            if multi_view:
+                views = [(palette[distribution_types[t]['palette']], shown_ranges[t]) for t in shown_types()]
+                draw = lambda: draw_views(shaders["HEATMAP"], triangulation_mesh, triangulation_indices_count, views,
+                                          world_matrix, scale_rects(rects, heatmap.viewport, (tw, th)))
+            else:
+                draw = lambda: draw_heatmap(shaders["HEATMAP"], triangulation_mesh[0], triangulation_indices_count,
+                                            palette[distribution_types[selected_type]['palette']],
+                                            shown_ranges[selected_type], world_matrix)
+            # shifting would drag the image of one view across the border of the next
+            heatmap.render((camera_size, tw, th, tuple(rects)), (origin.x, origin.y), bool(reasons - {'camera', 'size'}),
+                           draw, new_time, shiftable=not multi_view)
+        scheduler.animate('refine', heatmap.refining())
 
         # Second Pass
         glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
 
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
-        glBindTexture(GL_TEXTURE_2D, texture)
+        glBindTexture(GL_TEXTURE_2D, heatmap.texture)
 
         # color: #1F2025
         glClearColor(0.12, 0.12, 0.14, 1.0)
@@ -449,81 +672,110 @@ def main():
         imgui.new_frame()
         imgui.push_font(font_body)
 
-        shader_program = shaders["TERRITORY"] if toggle_distribution else shaders["DEFAULT"]
-        glUseProgram(shader_program.active_shader)
+        # the territory of every view is filled with its part of the heatmap texture
+        if timer is not None:
+            timer.mark('territory')
+        for rect in rects:
+            glViewport(*rect)
+            shader_program = shaders["TERRITORY"] if toggle_distribution else shaders["DEFAULT"]
+            glUseProgram(shader_program.active_shader)
 
-        model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
-        glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(world_matrix))
+            model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
+            glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(world_matrix))
+
+            if toggle_distribution:
+                model_location = glGetUniformLocation(shader_program.active_shader, "u_TextureScale")
+                glUniform2f(model_location, *heatmap.texture_scale)
+                # part of the screen, and so of the heatmap texture, covered by the view
+                model_location = glGetUniformLocation(shader_program.active_shader, "u_Viewport")
+                glUniform4f(model_location, rect[0] / screen_size.x, rect[1] / screen_size.y, rect[2] / screen_size.x, rect[3] / screen_size.y)
+            else:
+                model_location = glGetUniformLocation(shader_program.active_shader, "model_Color")
+                # color: #3F4045
+                glUniform4f(model_location, 0.25, 0.25, 0.27, 1.0)
 
-        if not toggle_distribution:
-            model_location = glGetUniformLocation(shader_program.active_shader, "model_Color")
-            # color: #3F4045
-            glUniform4f(model_location, 0.25, 0.25, 0.27, 1.0)
+            glBindVertexArray(territory_mesh.vao)
+            glEnable(GL_STENCIL_TEST)
 
-        glBindVertexArray(territory_mesh.vao)
-        glEnable(GL_STENCIL_TEST)
+            glStencilFunc(GL_ALWAYS, 0, 1)
+            glStencilOp(GL_INVERT, GL_INVERT, GL_INVERT)
+            glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
 
-        glStencilFunc(GL_ALWAYS, 0, 1)
-        glStencilOp(GL_INVERT, GL_INVERT, GL_INVERT)
-        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+            for p in territory_mesh.params:
+                glDrawElements(GL_TRIANGLE_FAN, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
 
-        for p in territory_mesh.params:
-            glDrawElements(GL_TRIANGLE_FAN, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
-
-        glStencilFunc(GL_EQUAL, 1, 1)
-        glStencilOp(GL_KEEP, GL_KEEP, GL_KEEP)
-        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+            glStencilFunc(GL_EQUAL, 1, 1)
+            glStencilOp(GL_KEEP, GL_KEEP, GL_KEEP)
+            glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
 
-        for p in territory_mesh.params:
-            glDrawElements(GL_TRIANGLE_FAN, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
+            for p in territory_mesh.params:
+                glDrawElements(GL_TRIANGLE_FAN, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
 
-        shader_program = shaders["DEFAULT"]
-        glUseProgram(shader_program.active_shader)
-        glDisable(GL_STENCIL_TEST)
+            shader_program = shaders["DEFAULT"]
+            glUseProgram(shader_program.active_shader)
+            glDisable(GL_STENCIL_TEST)
 
-        model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
-        glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(world_matrix))
+            model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
+            glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(world_matrix))
 
-        model_location = glGetUniformLocation(shader_program.active_shader, "model_Color")
-        glUniform4f(model_location, 0.75, 0.75, 0.8, 1.0)
+            model_location = glGetUniformLocation(shader_program.active_shader, "model_Color")
+            if toggle_regions and toggle_distribution and not multi_view:
+                draw_choropleth(territory_mesh, region_table, region_colors, model_location)
+            glUniform4f(model_location, 0.75, 0.75, 0.8, 1.0)
 
-        for p in territory_mesh.params:
-            glDrawElements(GL_LINE_LOOP, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
+            for p in territory_mesh.params:
+                glDrawElements(GL_LINE_LOOP, p[1], GL_UNSIGNED_INT, ctypes.c_void_p(p[0] * 4))
+        glViewport(0, 0, int(screen_size.x), int(screen_size.y))
 
-        glBindVertexArray(quad_mesh.vao)
+        # the overlays follow the single view only
+        if timer is not None:
+            timer.mark('overlays')
+        scheduler.animate('wind', toggle_wind and not multi_view)
+        if toggle_wind and not multi_view:
+            wind.advance(delta_time)
+            wind.upload()
+            glUniform4f(model_location, 0.9, 0.9, 0.95, 1.0)
+            wind.draw()
+
+        if toggle_isolines and not multi_view:
+            levels = isoline_levels(shown_ranges[selected_type], distribution_types[selected_type]['isoline'])
+            contours = isoline_cache.get(selected_type, window_step(time_factor), levels,
+                                         triangulation.positions, triangulation.triangles(), triangulation_field)
+            isoline_layer.upload(contours)
+            glUniform4f(model_location, 0.05, 0.05, 0.07, 1.0)
+            isoline_layer.draw()
+
+        glBindVertexArray(0)
 
         viewproj_matrix = projection_matrix * view_matrix
 
-        for p in points.values():
-            inverse_scale = camera_size * 0.005
-            model_matrix = glm.translate(glm.mat4(1), glm.vec3(-p.x, -p.y, 0))
-            model_matrix = glm.scale(model_matrix, glm.vec3(inverse_scale, inverse_scale, inverse_scale))
-
-            point_active = p.id in weather_data.data_hoursofday[-1]
-            point_type = p.code[0] == '4'
-
-            model_location = glGetUniformLocation(shader_program.active_shader, "model_Color")
-            if point_active:
-                if point_type:
-                    glUniform4f(model_location, 0.3, 0.98, 0.18, 1.0)
-                else:
-                    glUniform4f(model_location, 0.2, 0.5, 1.0, 1.0)
-            else:
-                glUniform4f(model_location, 0.8, 0.0, 0.0, 1.0)
-            model_location = glGetUniformLocation(shader_program.active_shader, "model_Transform")
-            glUniformMatrix4fv(model_location, 1, GL_FALSE, glm.value_ptr(model_matrix))
-
-            glDrawElements(GL_TRIANGLES, len(quad_mesh.indices), GL_UNSIGNED_INT, None)
-
-            if scroll_y < 4 or (scroll_y < 8 and not point_type):
-                p.reset_imgui()
-                continue
-
-            # draw text of the point (every new window)
-            p.draw_imgui(viewproj_matrix, screen_size, time_factor * 23, delta_time)
+        # stations and clusters in view, cards only for the stations that are not part of a cluster
+        if multi_view:
+            draw_list = imgui.get_background_draw_list()
+            for type, (x, y, w, h) in zip(shown_types(), rects):
+                param = distribution_types[type]
+                top = screen_size.y - y - h
+                draw_list.add_rect(x, top, x + w, top + h, imgui.get_color_u32_rgba(0.06, 0.06, 0.07, 1.0), thickness=2)
+                draw_list.add_text(x + 8, top + h - 24, imgui.get_color_u32_rgba(1.0, 1.0, 1.0, 1.0),
+                                   '%s : %s (%g - %g)' % (param['name'], type, *shown_ranges[type]))
+        elif toggle_distribution:
+            individual = cluster_layer.draw(viewproj_matrix, screen_size, shown_ranges[selected_type],
+                                            palette_luts[distribution_types[selected_type]['palette']])
+        else:
+            individual = cluster_layer.draw(viewproj_matrix, screen_size)
+        if not multi_view:
+            label_layer.draw(viewproj_matrix, screen_size, window_step(time_factor), delta_time, scroll_y, individual)
+        scheduler.animate('labels', label_layer.animating and not multi_view)
+
+        if toggle_isolines and toggle_isoline_labels and not multi_view:
+            draw_isoline_labels(contours, viewproj_matrix, screen_size)
+        if toggle_alerts and not multi_view:
+            draw_alerts(events, viewproj_matrix, screen_size)
 
         imgui.pop_font()
         imgui.push_font(font_header)
+        if timer is not None:
+            timer.mark('ui')
 
         # Show the Title of the Application (font size: 24)
         imgui.set_next_window_position(4, 4)
@@ -556,9 +808,43 @@ def main():
         imgui.spacing()
         last_time_factor = time_factor
         time_factor = imgui.slider_float('Time Factor', time_factor, 0, 1, '')[1]
-        hours_delta = 24 * (1 - time_factor)
-        lerped_time = weather_data.time_criteria - datetime.timedelta(hours=hours_delta)
+        # minute windows resolve no more steps than the slider has pixels
+        timeline_width = int(imgui.get_item_rect_size()[0])
+        lerped_time = weather_data.window_time(window_step(time_factor))
         imgui.text('Time: %s' % lerped_time.strftime('%Y-%m-%d %H:%M'))
+        last_window = (window_index, minute_data)
+        window_index = imgui.combo('Window', window_index, [option[0] for option in window_options])[1]
+        minute_data = imgui.checkbox('1분 자료 : Minute data', minute_data)[1]
+        imgui.same_line()
+        imgui.text('(%d min)' % (weather_data.window.store.step // 60))
+        uploads = gpu_buffers.counters.last_frame
+        imgui.text('GPU upload: %.1f KB, %d calls, %.2f ms' % (uploads['bytes'] / 1024, uploads['calls'], uploads['seconds'] * 1000))
+        if imgui.collapsing_header('Memory')[0]:
+            # walking every object takes a while, the numbers are refreshed every few seconds
+            if new_time - memory_time > 3:
+                memory_rows = memory.measure()
+                memory_growth = memory.growth(5) if memory.tracing() else []
+                memory_time = new_time
+            for name, heap, mapped in memory_rows:
+                imgui.text('%-16s %8.1f MB' % (name, heap / 2 ** 20) + (' (+%.1f MB mapped)' % (mapped / 2 ** 20) if mapped else ''))
+            tracing = imgui.checkbox('tracemalloc', memory.tracing())[1]
+            if tracing != memory.tracing():
+                if tracing:
+                    memory.start_tracing()
+                    memory.take_snapshot()
+                else:
+                    memory.stop_tracing()
+            imgui.same_line()
+            if imgui.button('Dump'):
+                memory.dump()
+            if memory.tracing():
+                imgui.same_line()
+                if imgui.button('Snapshot'):
+                    memory.take_snapshot()
+                    # shown from the next frame on
+                    memory_time = 0.0
+                for line, size, count in memory_growth:
+                    imgui.text('+%.1f KB %s' % (size / 1024, line))
 
         imgui.spacing()
         imgui.spacing()
@@ -570,6 +856,7 @@ def main():
         imgui.spacing()
         clicked = imgui.radio_button('None', not toggle_distribution)
         last_selected_type = selected_type
+        last_shown_types = shown_types()
         if clicked:
             toggle_distribution = False
         for param in distribution_types.values():
@@ -577,19 +864,159 @@ def main():
             if clicked:
                 toggle_distribution = True
                 selected_type = param['id']
+        toggle_multi_view = imgui.checkbox('다중 보기 : Multi view', toggle_multi_view)[1]
+        if toggle_multi_view:
+            imgui.same_line()
+            view_layout = imgui.combo('Layout', view_layout, [layout[0] for layout in VIEW_LAYOUTS])[1]
+            ids = list(distribution_types)
+            labels = ['%s : %s' % (distribution_types[i]['name'], i) for i in ids]
+            for view in range(VIEW_LAYOUTS[view_layout][1]):
+                view_types[view] = ids[imgui.combo('View %d' % (view + 1), ids.index(view_types[view]), labels)[1]]
+        toggle_auto_range = imgui.checkbox('자동 범위 : Auto range', toggle_auto_range)[1]
+        if not toggle_multi_view and selected_type in shown_ranges:
+            imgui.same_line()
+            imgui.text('%g - %g' % shown_ranges[selected_type])
+        imgui.spacing()
+        toggle_wind = imgui.checkbox('바람 흐름 : Wind', toggle_wind)[1]
+        toggle_isolines = imgui.checkbox('등치선 : Isolines', toggle_isolines)[1]
+        if toggle_isolines:
+            imgui.same_line()
+            toggle_isoline_labels = imgui.checkbox('Labels', toggle_isoline_labels)[1]
+        last_regions = (toggle_regions, toggle_area_weighted)
+        toggle_regions = imgui.checkbox('지역 통계 : Regions', toggle_regions)[1]
+        if toggle_regions:
+            imgui.same_line()
+            toggle_area_weighted = imgui.checkbox('Area weighted', toggle_area_weighted)[1]
+        toggle_alerts = imgui.checkbox('경보 : Alerts (%d)' % len(events), toggle_alerts)[1]
+        if toggle_alerts:
+            for event in events:
+                imgui.text('%s: %d stations, peak %g since %s' % (
+                    event.rule.name, len(event.stations), event.peak,
+                    datetime.datetime.fromtimestamp(event.since, weather_data.timezone).strftime('%m-%d %H:%M')))
         imgui.end()
 
-        if last_time_factor != time_factor or last_selected_type != selected_type:
-            triangulation_indices_count = update_trangulation(points, selected_type, time_factor * 23)
+        if toggle_regions and region_stats is not None:
+            imgui.set_next_window_position(4, 80)
+            imgui.begin("Region Statistics", False, imgui.WINDOW_NO_TITLE_BAR | imgui.WINDOW_NO_RESIZE | imgui.WINDOW_NO_MOVE | imgui.WINDOW_NO_COLLAPSE | imgui.WINDOW_ALWAYS_AUTO_RESIZE)
+            imgui.text('%s : %s (%s)' % (distribution_types[selected_type]['name'], selected_type, 'area' if toggle_area_weighted else 'stations'))
+            imgui.separator()
+            imgui.columns(5, 'region_columns', False)
+            for header in ['지역', 'Mean', 'Max', 'Min', 'Cells' if toggle_area_weighted else 'Count']:
+                imgui.text(header)
+                imgui.next_column()
+            # regions with the highest maximum first
+            for r in np.argsort(-np.nan_to_num(region_stats['max'], nan=-np.inf), kind='stable'):
+                imgui.text(region_table.names[r])
+                imgui.next_column()
+                for name in ['mean', 'max', 'min']:
+                    imgui.text('%.1f' % region_stats[name][r])
+                    imgui.next_column()
+                imgui.text('%d' % region_stats['count'][r])
+                imgui.next_column()
+            imgui.columns(1)
+            imgui.end()
+
+        if replayer is not None:
+            # the recorded controls replace whatever the widgets returned
+            time_factor, window_index, minute_data = apply_state(frame['state'])
+        if recorder is not None:
+            recorder.record(mouse_pos_current, pressed, captured, scroll_y, ui_state(time_factor, window_index, minute_data),
+                            glfw.get_framebuffer_size(window))
+
+        if timer is not None:
+            timer.mark('update')
+        window_changed = last_window != (window_index, minute_data)
+        # after the recorded controls were applied, a replay switches variables too
+        shown_changed = last_shown_types != shown_types()
+        if window_changed:
+            weather_data.select_window(window_options[window_index][1], minute_data, timeline_width)
+            initialize_points(points)
+            label_layer.refresh(weather_data.window)
+            isoline_cache.clear()
+            scheduler.invalidate('data')
+        if last_time_factor != time_factor:
+            scheduler.invalidate('time')
+        if last_selected_type != selected_type or shown_changed:
+            scheduler.invalidate('variable')
+        if last_time_factor != time_factor or shown_changed or window_changed:
+            triangulation_indices_count = update_trangulation(points, shown_types(), window_step(time_factor))
+            cluster_layer.update(triangulation_values[:len(points)])
+        if last_time_factor != time_factor or window_changed:
+            update_wind(points, wind, window_step(time_factor))
+            events = weather_data.alert_events(window_step(time_factor))
+        # ranges only change when the shown data does, reading them is a lookup otherwise
+        ranges = value_ranges(shown_types())
+        ranges_changed = ranges != shown_ranges
+        if ranges_changed:
+            scheduler.invalidate('variable')
+            shown_ranges = ranges
+        if toggle_regions and len(shown_types()) == 1 and (region_stats is None or last_time_factor != time_factor or shown_changed
+                                                          or ranges_changed or window_changed or last_regions != (toggle_regions, toggle_area_weighted)):
+            region_stats = update_region_stats(points, zonal, selected_type, window_step(time_factor), toggle_area_weighted)
+            region_colors = colorize(region_stats['mean'], shown_ranges[selected_type],
+                                     palette_luts[distribution_types[selected_type]['palette']]) / 255.0
+            region_colors[np.isnan(region_stats['mean'])] = np.nan
 
         imgui.pop_font()
+        if timer is not None:
+            timer.mark('present')
         imgui.render()
         impl.render(imgui.get_draw_data())
         glfw.swap_buffers(window)
-
+        if timer is not None:
+            timer.end_frame()
+        gpu_buffers.counters.end_frame()
+        assets.first_frame()
+        if first_frame_only:
+            break
+
+    if recorder is not None:
+        recorder.save()
     impl.shutdown()
     glfw.terminate()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--first-frame-only', action='store_true', help="exit after the first frame, for startup measurements")
+    parser.add_argument('--record', metavar='FILE', help="record the input of every frame into a file")
+    parser.add_argument('--replay', metavar='FILE', help="replay a recorded session, 'standard' for the reference session")
+    parser.add_argument('--delta-time', type=float, default=1 / 60, help="seconds per replayed frame")
+    parser.add_argument('--report', metavar='FILE', help="write the frame times per phase of the replay into a file")
+    parser.add_argument('--baseline', metavar='FILE', help="fail if a phase got slower than in this report")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="allowed growth of the 95th percentile over the baseline")
+    parser.add_argument('--software', action='store_true', help="render with Mesa's software rasterizer")
+    parser.add_argument('--source', help="live, cache:DIR, archive:FILE or synthetic:COUNT[:SEED], a replay's own by default")
+    parser.add_argument('--end', help="last hour as YYYYmmddHHMM in KST, a replay's own by default")
+    args = parser.parse_args()
+
+    if args.software:
+        # read by Mesa when the context is created
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+    replayer = None
+    if args.replay == 'standard':
+        replayer = session.Replayer(session.standard_session(), args.delta_time)
+    elif args.replay:
+        replayer = session.Replayer.load(args.replay, args.delta_time)
+    # a replay reads the data it was recorded with unless told otherwise
+    source = args.source or (replayer.source if replayer is not None else None) or 'live'
+    end = args.end or (replayer.end if replayer is not None else None)
+    recorder = session.Recorder(args.record, source, end) if args.record else None
+    timer = session.PhaseTimer(glFinish) if replayer is not None else None
+    end = weather_data.timezone.localize(datetime.datetime.strptime(end, '%Y%m%d%H%M')) if end else None
+    main(args.first_frame_only, recorder, replayer, timer, weather_data.make_source(source), end)
+
+    if timer is not None:
+        report = timer.report()
+        for line in session.format_report(report):
+            logging.log(logging.INFO, line)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=1)
+        if args.baseline:
+            with open(args.baseline, 'r') as f:
+                slower = session.regressions(report, json.load(f), args.tolerance)
+            for phase, before, after in slower:
+                logging.error("Phase %s got slower: p95 %.2f ms, was %.2f ms" % (phase, after, before))
+            if slower:
+                sys.exit(1)
@@ -0,0 +1,180 @@
+"""
+
+Memory accounting per subsystem.
+
+Subsystems register a function returning the objects they hold, and their size is measured by walking
+those objects: containers and instance attributes are followed, numpy arrays count the buffer they
+view once however many views there are, and memory mapped files are counted apart from the heap since
+the page cache backs them. Subsystems are measured in registration order with one set of visited
+objects, so an object reachable from two of them is counted for the first. Memory Python cannot see,
+such as GPU buffers, is registered as an estimate instead.
+
+tracemalloc can record every Python allocation with the line that made it. Snapshots are kept with
+their time, traced memory is grouped by the module that allocated it, and comparing the latest
+snapshot with the first one shows what grew in between, the first place to look for a leak in an
+instance that has been running for days. Reports are logged or dumped into a file on demand.
+
+"""
+
+import datetime
+import logging
+import mmap
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+
+# objects that are shared by everything or owned by the interpreter, never counted
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 types.CodeType, types.FrameType)
+MAX_SNAPSHOTS = 8
+
+subsystems = dict()
+snapshots = []
+
+
+def register(name, objects=None, estimate=None):
+    """Adds a subsystem. objects returns the objects it holds, estimate returns its size in bytes."""
+    subsystems[name] = (objects, estimate)
+
+
+def array_owner(array):
+    """The object that owns the memory of an array: the base array, an mmap or a bytes object."""
+    while isinstance(getattr(array, 'base', None), (np.ndarray, mmap.mmap, bytes, bytearray, memoryview)):
+        array = array.base
+    return array
+
+
+def sizeof(objects, seen=None):
+    """Returns (heap bytes, mapped bytes) held by the objects and everything they reference."""
+    seen = set() if seen is None else seen
+    heap = mapped = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, SKIPPED_TYPES):
+            continue
+        seen.add(id(obj))
+
+        if isinstance(obj, np.ndarray):
+            heap += sys.getsizeof(obj) - (obj.nbytes if obj.base is None else 0)
+            owner = array_owner(obj)
+            if id(owner) in seen and owner is not obj:
+                continue
+            seen.add(id(owner))
+            if isinstance(owner, mmap.mmap) or isinstance(obj, np.memmap):
+                mapped += len(owner) if isinstance(owner, mmap.mmap) else obj.nbytes
+            else:
+                # buffers of bytes objects have no nbytes
+                heap += owner.nbytes if isinstance(owner, (np.ndarray, memoryview)) else len(owner)
+            continue
+
+        heap += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            # long lists of plain numbers, such as vertex lists, are estimated from their first item
+            if len(obj) > 64 and type(obj[0] if isinstance(obj, (list, tuple)) else next(iter(obj))) in (int, float):
+                heap += len(obj) * sys.getsizeof(1.0)
+            else:
+                stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+    return heap, mapped
+
+
+def measure():
+    """Returns (name, heap bytes, mapped bytes) of every subsystem, estimates counted as heap."""
+    seen = set()
+    rows = []
+    for name, (objects, estimate) in subsystems.items():
+        heap, mapped = sizeof(objects(), seen) if objects is not None else (0, 0)
+        if estimate is not None:
+            heap += estimate()
+        rows.append((name, heap, mapped))
+    return rows
+
+
+def tracing():
+    return tracemalloc.is_tracing()
+
+
+def start_tracing(frames=1):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    tracemalloc.stop()
+    snapshots.clear()
+
+
+def take_snapshot():
+    """Records a tracemalloc snapshot, the first one and the last MAX_SNAPSHOTS - 1 are kept."""
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        tracemalloc.Filter(False, '<unknown>')])
+    snapshots.append((time.time(), snapshot))
+    if len(snapshots) > MAX_SNAPSHOTS:
+        del snapshots[1]
+    return snapshot
+
+
+def module_of(filename):
+    """Module of the repository or top level package that a traced file belongs to."""
+    parts = filename.replace('\\', '/').split('/')
+    if 'site-packages' in parts:
+        return parts[parts.index('site-packages') + 1].split('.')[0]
+    return os.path.splitext(parts[-1])[0]
+
+
+def traced_by_module(snapshot):
+    """Returns (module, bytes) of the memory traced in a snapshot, largest first."""
+    totals = dict()
+    for stat in snapshot.statistics('filename'):
+        module = module_of(stat.traceback[0].filename)
+        totals[module] = totals.get(module, 0) + stat.size
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def growth(top=10):
+    """Returns (source line, bytes, allocations) that grew the most from the first snapshot to the
+    latest one."""
+    if len(snapshots) < 2:
+        return []
+    stats = snapshots[-1][1].compare_to(snapshots[0][1], 'lineno')
+    stats = sorted(stats, key=lambda stat: -stat.size_diff)[:top]
+    return [(str(stat.traceback[0]), stat.size_diff, stat.count_diff) for stat in stats if stat.size_diff > 0]
+
+
+def report(top=10):
+    """Lines of a report of the subsystems and, while tracing, of the latest snapshot."""
+    lines = ['%-20s %10s %10s' % ('subsystem', 'heap MB', 'mapped MB')]
+    for name, heap, mapped in measure():
+        lines.append('%-20s %10.2f %10.2f' % (name, heap / 2 ** 20, mapped / 2 ** 20))
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append('traced %.2f MB, peak %.2f MB' % (current / 2 ** 20, peak / 2 ** 20))
+        snapshot = take_snapshot()
+        for module, size in traced_by_module(snapshot)[:top]:
+            lines.append('    %-24s %10.2f MB' % (module, size / 2 ** 20))
+        first = datetime.datetime.fromtimestamp(snapshots[0][0]).strftime('%H:%M:%S')
+        for line, size, count in growth(top):
+            lines.append('    +%.1f KB in %d blocks since %s: %s' % (size / 1024, count, first, line))
+    return lines
+
+
+def dump(directory='Cache'):
+    """Writes a report into a time stamped file of the directory and returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, datetime.datetime.now().strftime('memory-%Y%m%d-%H%M%S.txt'))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(report()) + '\n')
+    logging.log(logging.INFO, "Memory report written to %s" % path)
+    return path
@@ -1,12 +1,84 @@
+"""
+
+Triangle meshes, imported with pyassimp or built by hand.
+
+Imports copy whole vertex and face arrays per sub-mesh and compute bounds with array reductions.
+Imported meshes are written to a binary cache: a short JSON header followed by the vertex attributes
+in one contiguous block and the indices in another. A cached mesh is memory mapped, and the two blocks
+go straight into glBufferData without being copied or converted. pyassimp is only imported when a
+model is not cached yet.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+
 from OpenGL.GL import *
 import ctypes
-import pyassimp as assimp
 import numpy as np
-import logging
+
+
+CACHE_MAGIC = b'KMESH1\n'
+CACHE_ALIGNMENT = 16
+# attribute name, components, shader location
+ATTRIBUTES = [('vertices', 3, 0), ('normals', 3, 1), ('colors', 4, 2), ('uvs', 2, 3)]
+
+
+def write_cache(path, source, attributes, indices):
+    """Writes the (n, components) float32 attributes and the uint32 indices to a cache file."""
+    header = {'source': source, 'attributes': [], 'indices': None}
+    blocks = []
+    offset = 0
+    for name, array in attributes:
+        header['attributes'].append([name, array.shape[1], offset])
+        blocks.append(array)
+        offset += array.nbytes
+    header['vertex_bytes'] = offset
+    header['indices'] = [len(indices)]
+
+    encoded = json.dumps(header).encode('utf-8')
+    start = -(-(len(CACHE_MAGIC) + 4 + len(encoded)) // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+    index_start = -(-(start + offset) // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(np.uint32(len(encoded)).tobytes())
+        f.write(encoded)
+        f.write(b'\0' * (start - f.tell()))
+        for block in blocks:
+            f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        f.write(b'\0' * (index_start - f.tell()))
+        f.write(np.ascontiguousarray(indices, dtype=np.uint32).tobytes())
+    os.replace(path + '.part', path)
+
+
+def read_cache(path):
+    """Returns (header, vertex block, {name: (n, components) view}, indices) of a cache file, all
+    arrays being views of one read-only memory map."""
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(data[:len(CACHE_MAGIC)]) != CACHE_MAGIC:
+        raise ValueError("%s is not a mesh cache file" % path)
+    length = int(data[len(CACHE_MAGIC):len(CACHE_MAGIC) + 4].view(np.uint32)[0])
+    header = json.loads(bytes(data[len(CACHE_MAGIC) + 4:len(CACHE_MAGIC) + 4 + length]))
+    start = -(-(len(CACHE_MAGIC) + 4 + length) // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+    index_start = -(-(start + header['vertex_bytes']) // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+    count = header['indices'][0]
+    if len(data) < index_start + count * 4:
+        raise ValueError("%s is truncated" % path)
+
+    vertex_block = data[start:start + header['vertex_bytes']]
+    indices = data[index_start:index_start + count * 4].view(np.uint32)
+    attributes = {}
+    ends = [a[2] for a in header['attributes'][1:]] + [header['vertex_bytes']]
+    for (name, components, offset), end in zip(header['attributes'], ends):
+        attributes[name] = vertex_block[offset:end].view(np.float32).reshape(-1, components)
+    return header, vertex_block, attributes, indices
 
 
 class Mesh:
-    def __init__(self, path=None):
+    def __init__(self, path=None, cache_directory=os.path.join('Cache', 'meshes')):
         self.vao = None
         self.vbo = None
         self.ebo = None
@@ -16,6 +88,9 @@ class Mesh:
         self.colors = []
         self.uvs = []
         self.indices = []
+        # vertex attributes as one contiguous block, set when loaded from the cache
+        self.vertex_block = None
+        self.cache_directory = cache_directory
 
         self.center = [0.0, 0.0, 0.0]
         self.radius = 0.0
@@ -26,33 +101,40 @@ class Mesh:
 
     def delete_buffers(self):
         glDeleteVertexArrays(1, [self.vao])
-        glDeleteBuffers(1, self.vbo)
+        glDeleteBuffers(1, [self.vbo])
         glDeleteBuffers(1, [self.ebo])
 
-    def load_data(self, path):
-        with assimp.load(path) as scene:
-            if not scene:
-                raise Exception("No mesh in file")
-            meshes = scene.meshes
+    def cache_path(self, path):
+        """Cache file of a model, keyed on its absolute path so that models of the same name in
+        different directories do not overwrite each other's cache."""
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_directory, '%s-%s.mesh' % (os.path.basename(path), key))
 
-        self.vertices = []
-        self.indices = []
-
-        min_coords = [float('inf') for _ in range(3)]
-        max_coords = [-float('inf') for _ in range(3)]
-
-        for mesh in meshes:
-            for i in range(len(mesh.vertices)):
-                for j in range(3):
-                    min_coords[j] = min(min_coords[j], mesh.vertices[i][j])
-                    max_coords[j] = max(max_coords[j], mesh.vertices[i][j])
-                self.vertices.extend(mesh.vertices[i])
-
-            for i in range(len(mesh.faces)):
-                self.indices.extend(mesh.faces[i])
-
-        self.center = [(min_coords[i] + max_coords[i]) / 2 for i in range(3)]
-        self.radius = max([max_coords[i] - min_coords[i] for i in range(3)]) / 2
+    def load_data(self, path):
+        """Loads a model from the cache if it is up to date, imports and caches it otherwise."""
+        stat = os.stat(path)
+        source = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+        cache = self.cache_path(path)
+        header = None
+        if os.path.exists(cache):
+            try:
+                header, self.vertex_block, attributes, self.indices = read_cache(cache)
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                # a truncated or corrupt cache is imported again like a missing one
+                logging.log(logging.WARNING, "Mesh cache %s unreadable: %s" % (cache, e))
+        if header is None or header['source'] != source:
+            # the old mapping has to be closed before its file is replaced, Windows refuses otherwise
+            self.vertex_block = attributes = None
+            self.indices = []
+            for name, _, _ in ATTRIBUTES:
+                setattr(self, name, [])
+            attributes, self.indices = self.import_data(path)
+            write_cache(cache, source, [(name, attributes[name]) for name, _, _ in ATTRIBUTES if name in attributes], self.indices)
+            _, self.vertex_block, attributes, self.indices = read_cache(cache)
+
+        for name, _, _ in ATTRIBUTES:
+            setattr(self, name, attributes.get(name, []))
+        self.update_bounds()
 
         logging.log(logging.INFO, "Mesh loaded: %s" % path)
         logging.log(logging.INFO, "Vertices: %d" % len(self.vertices))
@@ -60,20 +142,66 @@ class Mesh:
         logging.log(logging.INFO, "Center: %s" % str(self.center))
         logging.log(logging.INFO, "Radius: %f" % self.radius)
 
+    def import_data(self, path):
+        """Imports every sub-mesh of a model. Returns ({attribute: (n, components) float32}, uint32
+        indices). Normals, colors and uvs are kept if every sub-mesh has them."""
+        # pyassimp is slow to import and only needed for models that are not cached yet
+        import pyassimp
+
+        with pyassimp.load(path) as scene:
+            if not scene:
+                raise Exception("No mesh in file")
+            meshes = scene.meshes
+            parts = {name: [] for name, _, _ in ATTRIBUTES}
+            indices = []
+            base = 0
+            for mesh in meshes:
+                vertices = np.asarray(mesh.vertices, dtype=np.float32).reshape(-1, 3)
+                parts['vertices'].append(vertices)
+                if len(mesh.normals):
+                    parts['normals'].append(np.asarray(mesh.normals, dtype=np.float32).reshape(-1, 3))
+                if len(mesh.colors) and len(mesh.colors[0]):
+                    parts['colors'].append(np.asarray(mesh.colors[0], dtype=np.float32).reshape(-1, 4))
+                if len(mesh.texturecoords) and len(mesh.texturecoords[0]):
+                    parts['uvs'].append(np.asarray(mesh.texturecoords[0], dtype=np.float32).reshape(len(vertices), -1)[:, :2])
+                # faces index the vertices of their own sub-mesh
+                indices.append(np.asarray(mesh.faces, dtype=np.uint32).reshape(-1) + np.uint32(base))
+                base += len(vertices)
+
+        attributes = {name: np.concatenate(arrays) for name, arrays in parts.items() if arrays and len(arrays) == len(meshes)}
+        return attributes, np.concatenate(indices) if indices else np.zeros(0, dtype=np.uint32)
+
+    def update_bounds(self):
+        vertices = np.asarray(self.vertices, dtype=np.float32).reshape(-1, 3)
+        if len(vertices) == 0:
+            return
+        low, high = vertices.min(axis=0), vertices.max(axis=0)
+        self.center = ((low + high) / 2).tolist()
+        self.radius = float((high - low).max()) / 2
+
     def gen_buffer(self):
-        np_vertices = np.array(self.vertices, dtype=np.float32)
-        np_indices = np.array(self.indices, dtype=np.uint32)
+        # attributes of hand-built meshes are packed into a block like the cache holds it
+        if self.vertex_block is None:
+            arrays = [np.asarray(getattr(self, name), dtype=np.float32).reshape(-1, size)
+                      for name, size, _ in ATTRIBUTES if len(getattr(self, name))]
+            self.vertex_block = np.concatenate([a.reshape(-1) for a in arrays]).view(np.uint8)
+        np_indices = np.ascontiguousarray(self.indices, dtype=np.uint32)
+        count = len(np.asarray(self.vertices).reshape(-1)) // 3
 
         self.vao = glGenVertexArrays(1)
         self.vbo = glGenBuffers(1)
         self.ebo = glGenBuffers(1)
         glBindVertexArray(self.vao)
 
-        # position
+        # attributes follow each other in the buffer
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, np_vertices.nbytes, np_vertices, GL_STATIC_DRAW)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * sizeof(GLfloat), ctypes.c_void_p(0))
-        glEnableVertexAttribArray(0)
+        glBufferData(GL_ARRAY_BUFFER, self.vertex_block.nbytes, self.vertex_block, GL_STATIC_DRAW)
+        offset = 0
+        for name, size, location in ATTRIBUTES:
+            if len(getattr(self, name)):
+                glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, size * sizeof(GLfloat), ctypes.c_void_p(offset))
+                glEnableVertexAttribArray(location)
+                offset += count * size * 4
 
         # indices
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
@@ -81,4 +209,4 @@ class Mesh:
 
         glBindVertexArray(0)
         glBindBuffer(GL_ARRAY_BUFFER, 0)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
\ No newline at end of file
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
@@ -0,0 +1,152 @@
+"""
+
+Palettes as 1D lookup tables, and value ranges taken from the data.
+
+A palette image is reduced once to a table of LUT_SIZE colors, the lowest value first. The same table
+colors values on the CPU (colorize) and, uploaded as a 1D texture sampled with GL_NEAREST, in the
+heatmap shader, so both pick entry floor(f * LUT_SIZE) for a value at fraction f of the range.
+
+Fixed ranges saturate when the weather leaves the usual span, a winter day is all one end of the
+temperature palette. A range can instead come from robust quantiles of the values over the loaded
+window. Every variable keeps a histogram of fine bins per hour, over its configured range widened by
+the span on both sides and by the physical limits of its field, so a typhoon does not pile up in the
+end bins. Values are added as they arrive or are computed, one bincount per hour, and the range over a
+run of hours comes from the cumulative counts of the sum of their histograms, without reading any
+data.
+
+"""
+
+import numpy as np
+
+
+LUT_SIZE = 256
+# quantiles the automatic ranges span
+QUANTILES = (0.02, 0.98)
+BINS = 1024
+
+
+def palette_lut(image, size=LUT_SIZE):
+    """Table of size colors along the middle column of a palette image, whose top row is the highest
+    value. Returns a (size, 3) uint8 array, the lowest value first."""
+    column = image[::-1, image.shape[1] // 2, :3]
+    return np.ascontiguousarray(column[(np.arange(size) * len(column)) // size])
+
+
+def colorize(values, value_range, lut):
+    """Maps values through a palette like the heatmap shader, clamping to the palette ends."""
+    low, high = value_range
+    index = (np.asarray(values) - low) / (high - low) * len(lut)
+    index = np.clip(np.nan_to_num(index), 0, len(lut) - 1).astype(np.int64)
+    return lut[index]
+
+
+class RangeHistogram:
+    """Counts of values in BINS bins over bounds, values outside going to the end bins."""
+
+    def __init__(self, bounds, bins=BINS):
+        self.low, self.high = bounds
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def bincount(self, values):
+        """Counts of the values per bin, NaN skipped."""
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        values = values[~np.isnan(values)]
+        index = ((values - self.low) / (self.high - self.low) * len(self.counts)).astype(np.int64)
+        return np.bincount(np.clip(index, 0, len(self.counts) - 1), minlength=len(self.counts))
+
+    def add(self, values):
+        self.counts += self.bincount(values)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def quantiles(self, qs):
+        """Values at the quantiles qs, interpolated within their bins."""
+        cumulative = np.cumsum(self.counts)
+        width = (self.high - self.low) / len(self.counts)
+        out = []
+        for q in qs:
+            target = q * cumulative[-1]
+            i = min(int(np.searchsorted(cumulative, target)), len(self.counts) - 1)
+            before = cumulative[i - 1] if i else 0
+            fraction = (target - before) / self.counts[i] if self.counts[i] else 0.0
+            out.append(self.low + (i + fraction) * width)
+        return out
+
+
+class ValueRanges:
+    """Histograms of the values of the variables per hour (epoch seconds of its start), ranges over runs
+    of hours from robust quantiles of their sum. params are the distribution types, with the configured
+    'range' and 'isoline' spacing of every variable, limits the (low, high) values a variable can take
+    by name, such as qc.LIMITS."""
+
+    def __init__(self, params, limits=None, quantiles=QUANTILES, min_values=32):
+        self.params = params
+        self.limits = limits or dict()
+        self.quantiles = quantiles
+        self.min_values = min_values
+        # {variable: {hour: counts}}
+        self.hours = dict()
+        # keys of the values added per variable, such as the steps of computed values
+        self.keys = dict()
+        self.empty = dict()
+        self.cache = dict()
+
+    def histogram(self, variable):
+        """Empty histogram of a variable, over its configured range widened by the span on both sides
+        and by its limits."""
+        if variable not in self.empty:
+            low, high = self.params[variable]['range']
+            low, high = low - (high - low), high + (high - low)
+            if variable in self.limits:
+                low, high = min(low, self.limits[variable][0]), max(high, self.limits[variable][1])
+            self.empty[variable] = RangeHistogram((low, high))
+        return self.empty[variable]
+
+    def has(self, variable, hour):
+        return hour in self.hours.get(variable, ())
+
+    def set(self, variable, hour, values):
+        """Replaces the values of a variable in an hour, such as after quality control flagged some."""
+        self.hours.setdefault(variable, dict())[hour] = self.histogram(variable).bincount(values).astype(np.int32)
+        self.cache.pop(variable, None)
+
+    def add(self, variable, hour, values, key):
+        """Adds values of a variable to an hour, once per key, the epoch seconds they are at."""
+        keys = self.keys.setdefault(variable, set())
+        if key in keys:
+            return
+        keys.add(key)
+        counts = self.hours.setdefault(variable, dict())
+        counts[hour] = counts.get(hour, 0) + self.histogram(variable).bincount(values).astype(np.int32)
+        self.cache.pop(variable, None)
+
+    def prune(self, before):
+        """Drops the hours and keys before a time."""
+        for variable, counts in self.hours.items():
+            for hour in [hour for hour in counts if hour < before]:
+                del counts[hour]
+            self.cache.pop(variable, None)
+        for variable, keys in self.keys.items():
+            keys.difference_update([key for key in keys if key < before])
+
+    def range(self, variable, start, end):
+        """(low, high) spanning the quantiles of the hours from start to end (epoch seconds), widened
+        to multiples of the isoline spacing. None until enough values were added."""
+        cache = self.cache.setdefault(variable, dict())
+        if (start, end) in cache:
+            return cache[(start, end)]
+        histogram = self.histogram(variable)
+        total = RangeHistogram((histogram.low, histogram.high), len(histogram.counts))
+        for hour, counts in self.hours.get(variable, dict()).items():
+            if start // 3600 * 3600 <= hour <= end:
+                total.counts += counts
+        if total.total() < self.min_values:
+            return None
+        low, high = total.quantiles(self.quantiles)
+        spacing = self.params[variable]['isoline']
+        low, high = np.floor(low / spacing) * spacing, np.ceil(high / spacing) * spacing
+        if high - low < spacing:
+            high = low + spacing
+        cache[(start, end)] = (float(low), float(high))
+        return cache[(start, end)]
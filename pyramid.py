@@ -0,0 +1,120 @@
+"""
+
+Multi-resolution pyramid over minute station data.
+
+The base level holds the raw one-minute values, every coarser level holds the min, max, mean, sum and
+count of each field per bin, computed from the level below it. Queries pick the coarsest level that
+still resolves the requested time span at the requested number of points, so scrubbing over minute
+data costs about as much as scrubbing over hourly data.
+
+"""
+
+import os
+
+import numpy as np
+
+import timeseries
+
+
+# name, step in seconds, steps per chunk file
+LEVELS = [('1min', 60, 1440), ('10min', 600, 144), ('1h', 3600, 24 * 7), ('1d', 86400, 366)]
+AGGREGATES = ['min', 'max', 'mean', 'sum', 'count']
+
+
+class LevelWindow(timeseries.Window):
+    """Window over an aggregated level, plain field names resolve to one aggregate."""
+
+    def __init__(self, store, start, end, aggregate='mean'):
+        super().__init__(store, start, end)
+        self.aggregate = aggregate
+
+    def field(self, name):
+        if '.' not in name:
+            name = name + '.' + self.aggregate
+        return self.store.field_index[name]
+
+
+def aggregate(block, fields, raw):
+    """Reduces a (bins, k, stations, ...) block over its second axis.
+    raw blocks hold plain field values, others the aggregates of a finer level.
+    Returns a (bins, stations, fields * aggregates) array."""
+    if raw:
+        low = high = total = block
+        count = ~np.isnan(block)
+    else:
+        block = block.reshape(block.shape[:3] + (fields, len(AGGREGATES)))
+        low, high = block[..., 0], block[..., 1]
+        total, count = block[..., 3], block[..., 4]
+
+    count = np.nansum(count, axis=1, dtype=np.float32)
+    out = np.empty(count.shape + (len(AGGREGATES),), dtype=np.float32)
+    out[..., 0] = np.fmin.reduce(low, axis=1)
+    out[..., 1] = np.fmax.reduce(high, axis=1)
+    out[..., 3] = np.where(count > 0, np.nansum(total, axis=1), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[..., 2] = out[..., 3] / count
+    out[..., 4] = count
+    return out.reshape(count.shape[:2] + (-1,))
+
+
+class Pyramid:
+    def __init__(self, directory, fields, station_capacity=1024):
+        self.fields = list(fields)
+        self.stores = []
+        for i, (name, step, chunk_steps) in enumerate(LEVELS):
+            level_fields = self.fields if i == 0 else [f + '.' + a for f in self.fields for a in AGGREGATES]
+            self.stores.append(timeseries.TimeSeriesStore(os.path.join(directory, name), level_fields, step,
+                                                          chunk_steps, station_capacity))
+
+    @property
+    def base(self):
+        return self.stores[0]
+
+    def contains(self, time):
+        return self.base.contains(time)
+
+    def append(self, time, stations, values):
+        """Appends raw one-minute values, call rollup afterwards to refresh the coarser levels."""
+        self.base.append(time, stations, values)
+
+    def rollup(self, start, end, max_bins=24):
+        """Recomputes every coarser bin overlapping start to end (inclusive) from the level below."""
+        start, end = timeseries.to_timestamp(start), timeseries.to_timestamp(end)
+        for level in range(1, len(self.stores)):
+            finer, store = self.stores[level - 1], self.stores[level]
+            k = store.step // finer.step
+            # columns of every level line up with the base level
+            store.register(self.base.stations)
+
+            first = start // store.step * store.step
+            last = end // store.step * store.step
+            for batch in range(first, last + 1, store.step * max_bins):
+                bins = min(max_bins, (last - batch) // store.step + 1)
+                block = finer.window(batch, batch + bins * store.step - finer.step).block()
+                block = block.reshape((bins, k) + block.shape[1:])
+                result = aggregate(block, len(self.fields), level == 1)
+                present = result.reshape(bins, result.shape[1], len(self.fields), len(AGGREGATES))[..., 4].sum(axis=2) > 0
+                for b in range(bins):
+                    columns = np.nonzero(present[b])[0]
+                    if len(columns):
+                        store.append(batch + b * store.step, [store.stations[c] for c in columns], result[b, columns])
+
+    def flush(self):
+        for store in self.stores:
+            store.flush()
+
+    def select(self, start, end, max_points):
+        """Index of the coarsest level that still gives max_points steps over start to end, such as
+        the width in pixels of the timeline showing them."""
+        span = timeseries.to_timestamp(end) - timeseries.to_timestamp(start)
+        level = 0
+        for i, store in enumerate(self.stores):
+            if store.step * max_points <= span:
+                level = i
+        return level
+
+    def window(self, start, end, max_points, aggregate='mean'):
+        level = self.select(start, end, max_points)
+        if level == 0:
+            return self.base.window(start, end)
+        return LevelWindow(self.stores[level], start, end, aggregate)
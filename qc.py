@@ -0,0 +1,155 @@
+"""
+
+Vectorized quality control of station observations.
+
+Every check runs over a whole (steps, stations, fields) block at once and sets its bit in a uint8 flag
+array of the same shape. The range check compares against fixed climatological limits, the step check
+looks for spikes and jumps between consecutive observations, the persistence check finds values that
+stay exactly the same for too long (a stuck sensor), and the buddy check compares every station with
+the mean of its neighbours in the Delaunay triangulation of the station positions. Checks after the
+range check work on the series of the fields they cover, copied once into a (fields, stations, steps)
+layout so that every series is contiguous. Neighbour sums are a product with the adjacency matrix,
+which for a few hundred stations is faster than any grouped reduction. Flags are stored next to the
+values, windows read flagged values as missing.
+
+"""
+
+import logging
+
+import numpy as np
+
+import dynamic_delaunay
+
+
+RANGE = 1
+STEP = 2
+PERSISTENCE = 4
+BUDDY = 8
+
+# physically plausible limits
+LIMITS = {
+    'WD1': (0, 360), 'WS1': (0, 75), 'WDS': (0, 360), 'WSS': (0, 75), 'WD10': (0, 360), 'WS10': (0, 75),
+    'TA': (-40, 45), 'RE': (0, 1), 'RN-15m': (0, 150), 'RN-60m': (0, 300), 'RN-12H': (0, 1000),
+    'RN-DAY': (0, 1500), 'HM': (0, 100), 'PA': (500, 1080), 'PS': (850, 1080), 'TD': (-50, 40),
+}
+# largest change between consecutive observations one minute and one hour apart
+STEP_LIMITS = {'TA': (3, 10), 'TD': (3, 12), 'HM': (15, 50), 'PA': (0.5, 6), 'PS': (0.5, 6)}
+# hours a value may stay exactly the same
+PERSISTENCE_HOURS = {'TA': 6, 'TD': 6, 'HM': 12, 'PA': 6, 'PS': 6}
+# smallest deviation from the neighbour mean that is flagged, the spread of the neighbours widens it
+BUDDY_TOLERANCE = {'TA': 8, 'TD': 10, 'HM': 40, 'PS': 6}
+
+
+def reach(step):
+    """Steps before newly added data whose flags the checks of the new data can change."""
+    return max(PERSISTENCE_HOURS.values()) * 3600 // step + 1
+
+
+def neighbors(positions, max_distance=60.0):
+    """Returns (src, dst) index arrays of the Delaunay edges between stations, in both directions.
+    Rows of positions that are NaN take no part, edges longer than max_distance map units (such as to
+    remote islands) are dropped."""
+    positions = np.asarray(positions, dtype=np.float64)
+    valid = ~np.isnan(positions).any(axis=1)
+    index = np.nonzero(valid)[0]
+    triangulation = dynamic_delaunay.DynamicDelaunay(positions[index])
+    triangulation.update(np.ones(len(index), dtype=bool))
+
+    triangles = triangulation.triangles().astype(np.int64)
+    # triangles touching the corner points are not part of the station mesh
+    triangles = triangles[(triangles < len(index)).all(axis=1)]
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)
+    src, dst = index[edges[:, 0]], index[edges[:, 1]]
+    length = np.hypot(*(positions[src] - positions[dst]).T)
+    keep = length <= max_distance
+    return src[keep], dst[keep]
+
+
+def range_check(block, fields):
+    """Values outside of LIMITS, all fields of a (..., fields) block in one pass."""
+    low = np.array([LIMITS.get(name, (-np.inf, np.inf))[0] for name in fields], dtype=np.float32)
+    high = np.array([LIMITS.get(name, (-np.inf, np.inf))[1] for name in fields], dtype=np.float32)
+    with np.errstate(invalid='ignore'):
+        return (block < low) | (block > high)
+
+
+def step_check(series, limit):
+    """Spikes, values far from both of their neighbours in time, and jumps next to a gap, along the
+    last axis."""
+    before = np.full_like(series, np.nan)
+    after = np.full_like(series, np.nan)
+    before[..., 1:] = np.abs(series[..., 1:] - series[..., :-1])
+    after[..., :-1] = before[..., 1:]
+    with np.errstate(invalid='ignore'):
+        exceeds_before, exceeds_after = before > limit, after > limit
+    spike = exceeds_before & exceeds_after
+    jump = (exceeds_before & np.isnan(after)) | (exceeds_after & np.isnan(before))
+    return spike | jump
+
+
+def persistence_check(series, steps):
+    """Runs of at least steps identical values along the last axis."""
+    # a run starts wherever the value differs from the one before, NaN never continues a run
+    starts = np.ones(series.shape, dtype=bool)
+    starts[..., 1:] = ~(series[..., 1:] == series[..., :-1])
+    run = np.cumsum(starts.reshape(-1)) - 1
+    length = np.bincount(run)
+    return (length[run] >= steps).reshape(series.shape) & ~np.isnan(series)
+
+
+def buddy_check(series, edges, tolerance, min_neighbors=3):
+    """Values of (stations, steps) series deviating from the mean of their valid neighbours by more
+    than tolerance and three neighbour standard deviations."""
+    src, dst = edges
+    adjacency = np.zeros((len(series), len(series)), dtype=np.float32)
+    adjacency[dst, src] = 1
+    valid = ~np.isnan(series)
+    values = np.where(valid, series, np.float32(0))
+    count = adjacency @ valid.astype(np.float32)
+    total = adjacency @ values
+    squares = adjacency @ (values * values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        spread = np.sqrt(np.maximum(squares / count - mean * mean, 0))
+        return (count >= min_neighbors) & (np.abs(series - mean) > np.maximum(tolerance, 3 * spread))
+
+
+def run(block, fields, step, edges=None):
+    """Returns the uint8 flags of a (steps, stations, fields) block, fields naming its last axis and
+    step being the seconds between steps. Without edges the buddy check is skipped."""
+    out_of_range = range_check(block, fields)
+    flags = out_of_range.view(np.uint8) * np.uint8(RANGE)
+    counts = {'range': np.count_nonzero(out_of_range), 'step': 0, 'persistence': 0, 'buddy': 0}
+
+    # (fields, stations, steps) series of the fields the other checks cover, values out of range
+    # take no part in them
+    names = [name for name in fields if name in STEP_LIMITS or name in PERSISTENCE_HOURS or name in BUDDY_TOLERANCE]
+    columns = [fields.index(name) for name in names]
+    series = np.ascontiguousarray(block[:, :, columns].transpose(2, 1, 0))
+    series[out_of_range[:, :, columns].transpose(2, 1, 0)] = np.nan
+    series_flags = np.zeros(series.shape, dtype=np.uint8)
+
+    for i, name in enumerate(names):
+        if name in STEP_LIMITS:
+            per_minute, per_hour = STEP_LIMITS[name]
+            flagged = step_check(series[i], min(per_minute * np.sqrt(step / 60), per_hour))
+            series_flags[i][flagged] |= STEP
+            counts['step'] += np.count_nonzero(flagged)
+        if name in PERSISTENCE_HOURS:
+            flagged = persistence_check(series[i], max(PERSISTENCE_HOURS[name] * 3600 // step, 2))
+            series_flags[i][flagged] |= PERSISTENCE
+            counts['persistence'] += np.count_nonzero(flagged)
+
+    if edges is not None:
+        # neighbours that failed a check of their own do not count either
+        series[series_flags != 0] = np.nan
+        for i, name in enumerate(names):
+            if name in BUDDY_TOLERANCE:
+                flagged = buddy_check(series[i], edges, BUDDY_TOLERANCE[name])
+                series_flags[i][flagged] |= BUDDY
+                counts['buddy'] += np.count_nonzero(flagged)
+
+    flags[:, :, columns] |= series_flags.transpose(2, 1, 0)
+    logging.log(logging.INFO, "Quality control flagged %s" % ', '.join('%d %s' % (n, c) for c, n in counts.items()))
+    return flags
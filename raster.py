@@ -0,0 +1,99 @@
+"""
+
+Interpolation of values at triangulation vertices onto a regular grid.
+
+The barycentric weights of every grid cell are computed once per triangulation (vectorized over all
+triangles at once), after which any number of value arrays can be interpolated with a gather and a
+weighted sum. Triangles are scanned row by row: every (triangle, row) pair yields the exact span of
+cells whose centers lie inside, so long thin triangles cost their area, not their bounding box.
+
+"""
+
+import numpy as np
+
+
+class Grid:
+    """Regular grid of cell centers in map coordinates."""
+
+    def __init__(self, x0=0.0, y0=0.0, width=800, height=760, cell=4.0):
+        self.x0 = x0
+        self.y0 = y0
+        self.cell = cell
+        self.shape = (int(np.ceil(height / cell)), int(np.ceil(width / cell)))
+
+    def centers(self):
+        """Returns the (x, y) coordinates of the cell centers as two (rows, cols) arrays."""
+        ys = self.y0 + (np.arange(self.shape[0]) + 0.5) * self.cell
+        xs = self.x0 + (np.arange(self.shape[1]) + 0.5) * self.cell
+        return np.meshgrid(xs, ys)
+
+    def to_cell(self, x, y):
+        """Continuous cell coordinates of map positions, cell centers are at integers."""
+        return (x - self.x0) / self.cell - 0.5, (y - self.y0) / self.cell - 0.5
+
+
+class TriangleRaster:
+    """Barycentric weights of the grid cells covered by a triangulation."""
+
+    def __init__(self, grid, positions, triangles):
+        self.grid = grid
+        rows, cols = grid.shape
+        positions = np.asarray(positions, dtype=np.float64)
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+
+        a, b, c = positions[triangles[:, 0]], positions[triangles[:, 1]], positions[triangles[:, 2]]
+        corners = np.stack((a, b, c), axis=1)  # (m, 3, 2)
+        _, lo_y = grid.to_cell(0, corners[..., 1].min(1))
+        _, hi_y = grid.to_cell(0, corners[..., 1].max(1))
+        j0 = np.clip(np.ceil(lo_y), 0, rows).astype(np.int64)
+        j1 = np.clip(np.floor(hi_y), -1, rows - 1).astype(np.int64)
+        counts = np.maximum(j1 - j0 + 1, 0)
+
+        # one (triangle, row) pair per row crossing the triangle, spanning the cells between the edges
+        tri = np.repeat(np.arange(len(triangles)), counts)
+        jj = j0[tri] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        py = grid.y0 + (jj + 0.5) * grid.cell
+        start, end = corners[tri], corners[tri][:, [1, 2, 0]]
+        y = py[:, None]
+        crosses = (np.minimum(start[..., 1], end[..., 1]) <= y) & (y <= np.maximum(start[..., 1], end[..., 1])) & \
+                  (start[..., 1] != end[..., 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = start[..., 0] + (y - start[..., 1]) * (end[..., 0] - start[..., 0]) / (end[..., 1] - start[..., 1])
+        lo_x, _ = grid.to_cell(np.where(crosses, x, np.inf).min(1), 0)
+        hi_x, _ = grid.to_cell(np.where(crosses, x, -np.inf).max(1), 0)
+        # spans are widened slightly, the barycentric test below decides about cells on an edge
+        i0 = np.clip(np.ceil(lo_x - 1e-6), 0, cols).astype(np.int64)
+        i1 = np.clip(np.floor(hi_x + 1e-6), -1, cols - 1).astype(np.int64)
+        span = np.maximum(i1 - i0 + 1, 0)
+
+        # one candidate per (triangle, cell of a span)
+        pair = np.repeat(np.arange(len(tri)), span)
+        ii = i0[pair] + np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span)
+        tri = tri[pair]
+        jj = jj[pair]
+        px = grid.x0 + (ii + 0.5) * grid.cell
+        py = py[pair]
+
+        ax, ay, bx, by, cx, cy = a[tri, 0], a[tri, 1], b[tri, 0], b[tri, 1], c[tri, 0], c[tri, 1]
+        det = (by - cy) * (ax - cx) + (cx - bx) * (ay - cy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            l1 = ((by - cy) * (px - cx) + (cx - bx) * (py - cy)) / det
+            l2 = ((cy - ay) * (px - cx) + (ax - cx) * (py - cy)) / det
+        l3 = 1.0 - l1 - l2
+        eps = -1e-9
+        inside = (det != 0) & (l1 >= eps) & (l2 >= eps) & (l3 >= eps)
+
+        cells, first = np.unique((jj * cols + ii)[inside], return_index=True)
+        tri = tri[inside][first]
+        self.cells = cells
+        self.triangles = tri
+        self.vertices = triangles[tri]
+        self.weights = np.stack((l1[inside][first], l2[inside][first], l3[inside][first]), axis=1).astype(np.float32)
+
+    def interpolate(self, values, out=None):
+        """Interpolates per vertex values onto the grid. Cells outside of the triangulation are NaN."""
+        if out is None:
+            out = np.full(self.grid.shape, np.nan, dtype=np.float32)
+        values = np.asarray(values, dtype=np.float32)
+        out.reshape(-1)[self.cells] = (values[self.vertices] * self.weights).sum(axis=1)
+        return out
@@ -0,0 +1,155 @@
+"""
+
+Region lookup and zonal statistics over the territory polygons.
+
+Every path of territory.svg belongs to a region (its id), a region can have many rings. Stations are
+assigned to regions once: a bounding box index picks the rings that can contain a station and an
+even-odd crossing test against all edges of those rings runs vectorized over the candidate stations.
+Zonal statistics are then grouped reductions over stations sorted by region, one reduceat call per
+statistic for all regions at once. The same reductions over grid cells labelled by region give
+area-weighted statistics of an interpolated field.
+
+"""
+
+import numpy as np
+
+import territory_parser
+
+
+STATISTICS = ['mean', 'max', 'min', 'count']
+
+
+class Regions:
+    """Rings of the territory grouped by region. Ring order matches parse_territory_file."""
+
+    def __init__(self, territories):
+        self.names = []
+        self.rings = []
+        ring_region = []
+        index = {}
+        for name, d in territories:
+            if name not in index:
+                index[name] = len(self.names)
+                self.names.append(name)
+            self.rings.append(np.array(d[:len(d) // 2 * 2], dtype=np.float64).reshape(-1, 2))
+            ring_region.append(index[name])
+        self.ring_region = np.array(ring_region, dtype=np.int64)
+        self.region_rings = [np.nonzero(self.ring_region == r)[0] for r in range(len(self.names))]
+
+        # empty rings get an inverted box that never matches
+        self.bounds = np.array([[ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max()]
+                                if len(ring) else [np.inf, np.inf, -np.inf, -np.inf] for ring in self.rings])
+        self.vertices = np.concatenate(self.rings)
+        self.vertex_region = np.repeat(self.ring_region, [len(ring) for ring in self.rings])
+
+    @classmethod
+    def load(cls, file):
+        return cls(territory_parser.parse_territory_file(file))
+
+    def contains(self, points, batch=256):
+        """Returns an (n, regions) bool array, True where a point lies inside a region (even-odd rule
+        over the rings of the region)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = points[:, 0:1], points[:, 1:2]
+        inside = np.zeros((len(points), len(self.names)), dtype=bool)
+        candidates = (x >= self.bounds[:, 0]) & (x <= self.bounds[:, 2]) & (y >= self.bounds[:, 1]) & (y <= self.bounds[:, 3])
+
+        for r in np.nonzero(candidates.any(axis=0))[0]:
+            a = self.rings[r]
+            b = np.roll(a, -1, axis=0)
+            for k in np.array_split(np.nonzero(candidates[:, r])[0], -(-candidates[:, r].sum() // batch)):
+                px, py = x[k], y[k]
+                # edges crossing the horizontal ray to the right of the point
+                spans = (a[:, 1] > py) != (b[:, 1] > py)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    cross = spans & (px < a[:, 0] + (py - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1]))
+                inside[k, self.ring_region[r]] ^= (np.count_nonzero(cross, axis=1) & 1).astype(bool)
+        return inside
+
+    def locate(self, points, tolerance=3.0):
+        """Region index of every point, -1 outside of all regions. Points outside but within
+        tolerance of a ring vertex, such as coastal stations, snap to the region of that vertex."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        inside = self.contains(points)
+        # nested regions resolve to the innermost one, the one with the fewest vertices
+        size = np.bincount(self.vertex_region, minlength=len(self.names))
+        region = np.where(inside.any(axis=1), np.argmin(np.where(inside, size, np.iinfo(np.int64).max), axis=1), -1)
+
+        for i in np.nonzero(region < 0)[0]:
+            distance = np.hypot(self.vertices[:, 0] - points[i, 0], self.vertices[:, 1] - points[i, 1])
+            nearest = np.argmin(distance)
+            if distance[nearest] <= tolerance:
+                region[i] = self.vertex_region[nearest]
+        return region
+
+    def rasterize(self, grid):
+        """Region index of every cell of a grid, -1 outside."""
+        # only area weighted statistics need PIL, lookups and station statistics do not
+        from PIL import Image, ImageDraw
+
+        rows, cols = grid.shape
+        labels = np.full(grid.shape, -1, dtype=np.int64)
+        for r in range(len(self.names)):
+            mask = np.zeros(grid.shape, dtype=bool)
+            for ring in self.region_rings[r]:
+                if len(self.rings[ring]) < 3:
+                    continue
+                image = Image.new('1', (cols, rows))
+                cells = (self.rings[ring] - (grid.x0, grid.y0)) / grid.cell
+                ImageDraw.Draw(image).polygon([tuple(p) for p in cells], fill=1)
+                mask ^= np.asarray(image)
+            labels[mask] = r
+        return labels
+
+
+class Groups:
+    """Members sorted by group, for grouped reductions with reduceat."""
+
+    def __init__(self, labels, count):
+        labels = np.asarray(labels).reshape(-1)
+        order = np.argsort(labels, kind='stable')
+        self.order = order[labels[order] >= 0]
+        self.groups, self.starts = np.unique(labels[self.order], return_index=True)
+        self.count = count
+
+    def reduce(self, values):
+        """Returns {statistic: (groups, ...) array} over the first axis of values, ignoring NaN.
+        Groups without any valid member are NaN with a count of 0."""
+        values = np.asarray(values, dtype=np.float32)
+        values = values.reshape((-1,) + values.shape[1:])[self.order]
+        shape = (self.count,) + values.shape[1:]
+        out = {name: np.full(shape, np.nan, dtype=np.float32) for name in STATISTICS}
+        out['count'][:] = 0
+        if len(self.order) == 0:
+            return out
+
+        valid = ~np.isnan(values)
+        count = np.add.reduceat(valid, self.starts, axis=0, dtype=np.float32)
+        total = np.add.reduceat(np.where(valid, values, 0), self.starts, axis=0)
+        out['count'][self.groups] = count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out['mean'][self.groups] = total / count
+        out['max'][self.groups] = np.fmax.reduceat(values, self.starts, axis=0)
+        out['min'][self.groups] = np.fmin.reduceat(values, self.starts, axis=0)
+        return out
+
+
+class ZonalStats:
+    """Per region statistics of station values and, with a grid, of interpolated fields."""
+
+    def __init__(self, regions, station_regions, grid=None):
+        self.regions = regions
+        self.station_regions = np.asarray(station_regions)
+        self.stations = Groups(self.station_regions, len(regions.names))
+        self.grid = grid
+        self.cells = Groups(regions.rasterize(grid), len(regions.names)) if grid is not None else None
+
+    def station_stats(self, values):
+        """Statistics of (stations, ...) values per region."""
+        return self.stations.reduce(values)
+
+    def area_stats(self, field):
+        """Area-weighted statistics of a (rows, cols, ...) field on the grid. Every cell has the same
+        area, so the cell mean is the area-weighted mean, and count * cell ** 2 is the covered area."""
+        field = np.asarray(field)
+        return self.cells.reduce(field.reshape((-1,) + field.shape[2:]))
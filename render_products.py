@@ -0,0 +1,228 @@
+"""
+
+Headless batch rendering of the hourly map products.
+
+Every (variable, hour) pair of the selected window is rendered to a PNG on the CPU: station values
+are interpolated through the triangulation onto the pixel grid, mapped through the palette, clipped
+to the territory and overlaid with the territory outline and the station markers. Jobs are spread
+over a process pool. Workers open the memory-mapped store themselves and share the rasterized
+territory mask through a memory-mapped file, so only job tuples cross process boundaries.
+
+Usage: python render_products.py [--hours 24] [--output Products] [--workers N] [--scale 1.0]
+
+"""
+
+from collections import OrderedDict
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+import numpy as np
+
+import derived
+import dynamic_delaunay
+import raster
+import rolling
+import territory_parser
+import timeseries
+import weather_data
+from assets import decode_image
+from palette import colorize, palette_lut
+
+
+MAP_WIDTH, MAP_HEIGHT = 800, 760
+
+# colors of the viewer, as 8 bit RGB
+BACKGROUND_COLOR = (31, 32, 37)       # #1F2025
+TERRITORY_COLOR = (64, 64, 69)        # #3F4045
+OUTLINE_COLOR = (191, 191, 204)
+STATION_COLORS = {'active': (51, 128, 255), 'active4': (77, 250, 46), 'inactive': (204, 0, 0)}
+
+
+def territory_rings(file, scale):
+    """Outlines of the territory in pixel coordinates, one list of (x, y) tuples per ring."""
+    rings = []
+    for _, d in territory_parser.parse_territory_file(file):
+        if len(d) >= 6:
+            rings.append([(d[i] * scale, d[i + 1] * scale) for i in range(0, len(d) - 1, 2)])
+    return rings
+
+
+def territory_mask(rings, size):
+    """Rasterizes the rings with the even-odd rule of the viewer's stencil pass."""
+    mask = np.zeros((size[1], size[0]), dtype=bool)
+    for ring in rings:
+        image = Image.new('1', size)
+        ImageDraw.Draw(image).polygon(ring, fill=1)
+        mask ^= np.asarray(image)
+    return mask
+
+
+class ProductRenderer:
+    """Per process rendering state. Triangulations are kept per variable and updated incrementally,
+    so consecutive hours of one variable only insert or remove the stations whose validity changed."""
+
+    def __init__(self, store, start, end, stations, mask, rings, palettes, scale, ranges=None):
+        self.window = store.window(start, end)
+        self.aggregates = rolling.Aggregates(self.window)
+        self.derived = derived.DerivedFields(self.window, weather_data.column_positions(store, stations))
+        ids, self.positions, codes = stations
+        columns = [store.column(station) for station in ids]
+        self.columns = np.array([-1 if c is None else c for c in columns], dtype=np.int64)
+        self.type4 = np.array([code[0] == '4' for code in codes])
+        self.mask = mask
+        self.rings = rings
+        self.palettes = palettes
+        # palette ranges by variable, the configured ranges for the others
+        self.ranges = ranges or dict()
+        self.scale = scale
+        self.grid = raster.Grid(width=MAP_WIDTH, height=MAP_HEIGHT, cell=1.0 / scale)
+        self.triangulations = {}
+        self.rasters = OrderedDict()
+
+    def station_values(self, hour):
+        """(stations, fields) values at a window step, NaN for stations without data."""
+        values = self.window.frame(hour)[np.maximum(self.columns, 0)]
+        values[self.columns < 0] = np.nan
+        return values
+
+    def heatmap(self, variable, values):
+        if variable not in self.triangulations:
+            self.triangulations[variable] = dynamic_delaunay.DynamicDelaunay(self.positions)
+        triangulation = self.triangulations[variable]
+        valid = ~np.isnan(values)
+        triangulation.update(valid)
+
+        # rasters only depend on which stations are valid, hours with the same set share one
+        key = valid.tobytes()
+        if key in self.rasters:
+            self.rasters.move_to_end(key)
+        else:
+            self.rasters[key] = raster.TriangleRaster(self.grid, triangulation.positions, triangulation.triangles())
+            if len(self.rasters) > 8:
+                self.rasters.popitem(last=False)
+
+        # the corner points are 0 like in the viewer
+        vertex_values = np.zeros(len(triangulation.positions), dtype=np.float32)
+        vertex_values[:len(values)] = np.where(valid, values, 0)
+        return self.rasters[key].interpolate(vertex_values)
+
+    def render(self, variable, hour):
+        param = weather_data.distribution_types[variable]
+        values = self.station_values(hour)
+        variable_values = weather_data.sample_variable(variable, hour, self.aggregates, self.derived)[np.maximum(self.columns, 0)]
+        variable_values[self.columns < 0] = np.nan
+        grid = self.heatmap(variable, variable_values)
+
+        height, width = self.mask.shape
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[:] = BACKGROUND_COLOR
+        colors = colorize(grid[:height, :width], self.ranges.get(variable, param['range']), self.palettes[param['palette']])
+        inside = self.mask & ~np.isnan(grid[:height, :width])
+        pixels[inside] = colors[inside]
+        pixels[self.mask & ~inside] = TERRITORY_COLOR
+
+        image = Image.fromarray(pixels, 'RGB')
+        draw = ImageDraw.Draw(image)
+        for ring in self.rings:
+            draw.line(ring + ring[:1], fill=OUTLINE_COLOR)
+
+        # stations that reported any value at this hour are active
+        active = ~np.isnan(values).all(axis=1)
+        r = max(1.0, self.scale)
+        for (x, y), is_active, is_type4 in zip(self.positions * self.scale, active, self.type4):
+            color = STATION_COLORS[('active4' if is_type4 else 'active') if is_active else 'inactive']
+            draw.rectangle((x - r, y - r, x + r, y + r), fill=color)
+
+        timestamp = datetime.datetime.fromtimestamp(self.window.timestamp(hour), weather_data.timezone)
+        draw.text((8, 8), '%s %s' % (variable, timestamp.strftime('%Y-%m-%d %H:%M')), fill=(255, 255, 255))
+        return image, timestamp
+
+
+renderer = None
+
+
+def init_worker(store_directory, start, end, stations, mask_file, rings, palette_files, scale, ranges):
+    global renderer
+    store = timeseries.TimeSeriesStore(store_directory, weather_data.fields)
+    mask = np.load(mask_file, mmap_mode='r')
+    palettes = [palette_lut(decode_image(file)) for file in palette_files]
+    renderer = ProductRenderer(store, start, end, stations, mask, rings, palettes, scale, ranges)
+
+
+def render_job(job):
+    variable, hour, output = job
+    image, timestamp = renderer.render(variable, hour)
+    path = os.path.join(output, variable, '%s.png' % timestamp.strftime('%Y%m%d%H%M'))
+    image.save(path)
+    return path
+
+
+def window_ranges(variables):
+    """Palette ranges of the variables from quantiles over the whole selected window, computed once so
+    that every worker and every hour uses the same range. Derived variables are computed at every step
+    first, as every hour is rendered anyway."""
+    for variable in variables:
+        if 'derived' in weather_data.distribution_types[variable]:
+            for step in range(weather_data.window.steps):
+                weather_data.range_derived(variable, step)
+    return {variable: weather_data.variable_range(variable) for variable in variables}
+
+
+def render_products(hours=24, variables=None, output='Products', workers=None, scale=1.0, source=None, end=None,
+                    auto_range=False):
+    """Renders every variable at every hour of the last hours up to end, the last full hour by default.
+    With auto_range the palettes span the data of the window instead of the configured ranges.
+    Returns the written paths."""
+    variables = variables or list(weather_data.distribution_types)
+    weather_data.initialize(hours, source, end)
+    window = weather_data.window
+    stations = weather_data.load_stations('aws_info.txt')
+    rings = territory_rings('Resources/territory.svg', scale)
+    size = (int(round(MAP_WIDTH * scale)), int(round(MAP_HEIGHT * scale)))
+    palette_files = ['Resources/palette%d.png' % i for i in range(3)]
+    ranges = window_ranges(variables) if auto_range else None
+
+    for variable in variables:
+        os.makedirs(os.path.join(output, variable), exist_ok=True)
+    # hours of one variable are contiguous, so each worker chunk reuses its triangulation
+    jobs = [(variable, hour, output) for variable in variables for hour in range(window.steps)]
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(jobs) // (workers * 4))
+
+    with tempfile.TemporaryDirectory() as directory:
+        mask_file = os.path.join(directory, 'territory_mask.npy')
+        np.save(mask_file, territory_mask(rings, size))
+        initargs = (window.store.directory, window.start, window.timestamp(window.steps - 1), stations,
+                    mask_file, rings, palette_files, scale, ranges)
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as executor:
+            return list(executor.map(render_job, jobs, chunksize=chunksize))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders hourly PNG products without a display.")
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--variables', nargs='+', choices=list(weather_data.distribution_types))
+    parser.add_argument('--output', default='Products')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--source', default='live', help="live, cache:DIR, archive:FILE or synthetic:COUNT[:SEED]")
+    parser.add_argument('--end', help="last hour as YYYYmmddHHMM in KST")
+    parser.add_argument('--auto-range', action='store_true', help="palette ranges from quantiles of the data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    source = weather_data.make_source(args.source)
+    end = weather_data.timezone.localize(datetime.datetime.strptime(args.end, '%Y%m%d%H%M')) if args.end else None
+    begin = time.perf_counter()
+    paths = render_products(args.hours, args.variables, args.output, args.workers, args.scale, source, end, args.auto_range)
+    logging.log(logging.INFO, "Rendered %d products in %.2f s" % (len(paths), time.perf_counter() - begin))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+
+Rolling aggregates over the station time series of a window.
+
+Sums and means come from prefix sums: the sum over any run of steps is the difference of two prefix
+sums, so every window of every station is answered with two lookups once the prefix sums are built in
+one pass. Minima and maxima of windows of one fixed width, as needed to show a rolling variable at
+every step, come from the van Herk / Gil-Werman scheme, the array form of the monotonic deque: the
+series is cut into blocks of the window width, and the extreme over a window is the extreme of a
+suffix of one block and a prefix of the next. Extremes over arbitrary windows come from a sparse
+table of the extremes over all power of two runs, two overlapping runs cover any window.
+
+Accumulated fields such as RN-60m are summed over samples one accumulation period apart, so that
+every minute of rain counts once. All prefixes run over the series reshaped to (samples, stride,
+stations), which makes every sample series a run along the first axis. Missing values are skipped,
+a window without any value is NaN.
+
+"""
+
+import numpy as np
+
+
+def strided(series, stride, fill=np.nan):
+    """(samples, stride, stations) view of a (steps, stations) series, padded at the end so that
+    step i is sample i // stride of lane i % stride."""
+    steps = len(series)
+    samples = -(-steps // stride)
+    padded = np.full((samples * stride,) + series.shape[1:], fill, dtype=series.dtype)
+    padded[:steps] = series
+    return padded.reshape((samples, stride) + series.shape[1:])
+
+
+def unstrided(layout, steps):
+    return layout.reshape((-1,) + layout.shape[2:])[:steps]
+
+
+def running_extreme(samples, width, reduce):
+    """Extreme of the last width samples at every sample along the first axis, fewer at the start.
+    reduce is np.fmin or np.fmax, which skip NaN."""
+    count = len(samples)
+    blocks = -(-count // width)
+    padded = np.full((blocks * width,) + samples.shape[1:], np.nan, dtype=samples.dtype)
+    padded[:count] = samples
+    padded = padded.reshape((blocks, width) + samples.shape[1:])
+    prefix = reduce.accumulate(padded, axis=1).reshape((-1,) + samples.shape[1:])
+    suffix = reduce.accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape(prefix.shape)
+
+    # a window ending at i starts at i - width + 1, within the block before the one holding i
+    out = prefix[:count].copy()
+    if count >= width:
+        out[width - 1:] = reduce(suffix[:count - width + 1], prefix[width - 1:count])
+    return out
+
+
+class SparseTable:
+    """Extremes of all runs of 2^k samples along the first axis, for any window in two lookups."""
+
+    def __init__(self, samples, reduce):
+        self.reduce = reduce
+        self.levels = [samples]
+        length = 1
+        while length * 2 <= len(samples):
+            previous = self.levels[-1]
+            self.levels.append(reduce(previous[:-length], previous[length:]))
+            length *= 2
+
+    def query(self, first, last):
+        """Extreme over samples first to last (inclusive)."""
+        k = int(last - first + 1).bit_length() - 1
+        level = self.levels[k]
+        return self.reduce(level[first], level[last - (1 << k) + 1])
+
+
+class Aggregates:
+    """Rolling sum, mean, min and max of the fields of a window, for all stations at once. Prefix
+    sums, tables and rolled series are built on first use and kept for the life of the window."""
+
+    REDUCE = {'min': np.fmin, 'max': np.fmax}
+
+    def __init__(self, window):
+        self.window = window
+        self.columns = len(window.store.stations)
+        self.series_cache = {}
+        self.prefixes = {}
+        self.tables = {}
+        self.rolled = {}
+
+    def field_name(self, field, how):
+        # coarser pyramid levels keep the extremes of every bin, the mean would flatten them
+        if how in self.REDUCE and self.window.has_field(field + '.' + how):
+            return field + '.' + how
+        return field
+
+    def series(self, field, how='sum'):
+        """(steps, stations) values of a field."""
+        name = self.field_name(field, how)
+        if name not in self.series_cache:
+            self.series_cache[name] = self.window.block(self.columns, [name])[:, :, 0]
+        return self.series_cache[name]
+
+    def prefix(self, field, stride=1):
+        """(samples + 1, stride, stations) prefix sums and counts of the valid values."""
+        key = (field, stride)
+        if key not in self.prefixes:
+            layout = strided(self.series(field), stride)
+            valid = ~np.isnan(layout)
+            sums = np.zeros((len(layout) + 1,) + layout.shape[1:], dtype=np.float64)
+            counts = np.zeros(sums.shape, dtype=np.int32)
+            np.cumsum(np.where(valid, layout, 0), axis=0, out=sums[1:])
+            np.cumsum(valid, axis=0, out=counts[1:])
+            self.prefixes[key] = (sums, counts)
+        return self.prefixes[key]
+
+    def table(self, field, how, stride=1):
+        key = (field, how, stride)
+        if key not in self.tables:
+            self.tables[key] = SparseTable(strided(self.series(field, how), stride), self.REDUCE[how])
+        return self.tables[key]
+
+    def query(self, field, how, start, end, stride=1):
+        """Aggregate of every station over the steps start to end (inclusive) of the window, taking
+        every stride-th step counted back from end. Returns a (stations,) array."""
+        start, end = max(int(start), 0), min(int(end), self.window.steps - 1)
+        lane, last = end % stride, end // stride
+        first = max(-(-(start - lane) // stride), 0)
+        if how in self.REDUCE:
+            return self.table(field, how, stride).query(first, last)[lane].astype(np.float32)
+        sums, counts = self.prefix(field, stride)
+        total = sums[last + 1, lane] - sums[first, lane]
+        count = counts[last + 1, lane] - counts[first, lane]
+        return self.finish(total, count, how)
+
+    def sliding(self, field, how, samples, stride=1):
+        """(steps, stations) aggregate of the last samples values stride steps apart ending at every
+        step of the window, over fewer values near the start of the window."""
+        key = (field, how, samples, stride)
+        if key not in self.rolled:
+            if how in self.REDUCE:
+                layout = strided(self.series(field, how), stride)
+                out = running_extreme(layout, samples, self.REDUCE[how])
+            else:
+                sums, counts = self.prefix(field, stride)
+                lower = np.maximum(np.arange(1, len(sums)) - samples, 0)
+                out = self.finish(sums[1:] - sums[lower], counts[1:] - counts[lower], how)
+            self.rolled[key] = unstrided(out, self.window.steps).astype(np.float32)
+        return self.rolled[key]
+
+    @staticmethod
+    def finish(total, count, how):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if how == 'mean':
+                return (total / count).astype(np.float32)
+            return np.where(count > 0, total, np.nan).astype(np.float32)
+
+    def rolling_series(self, spec):
+        """(steps, stations) values of a rolling variable. spec gives the field, how to aggregate, the
+        length of the window in seconds and, for accumulated fields, the accumulation period in seconds."""
+        step = self.window.store.step
+        stride = max(spec.get('period', step) // step, 1)
+        samples = max(int(round(spec['seconds'] / (stride * step))), 1)
+        return self.sliding(spec['field'], spec['how'], samples, stride)
+
+    def sample(self, spec, t):
+        """Values of a rolling variable at fractional step t, linearly interpolated like
+        Window.sample."""
+        rolled = self.rolling_series(spec)
+        out = np.full(self.window.store.station_capacity, np.nan, dtype=np.float32)
+        i = min(max(int(t), 0), self.window.steps - 1)
+        f = np.float32(min(max(t - i, 0), 1))
+        if f and i + 1 < self.window.steps:
+            out[:self.columns] = rolled[i] * (1 - f) + rolled[i + 1] * f
+        else:
+            out[:self.columns] = rolled[i]
+        return out
@@ -0,0 +1,208 @@
+"""
+
+Recording and replaying input sessions of the viewer, and frame times per phase of the render loop.
+
+A recording holds one entry per drawn frame: the cursor position, whether the left button was down,
+whether imgui had the mouse, the zoom (scroll) level, the framebuffer size and the state of the
+controls such as the time slider and the selected variable. It also names the data source and the
+last hour of the data, so a replay draws the same values as the recording did. Replaying feeds the entries back in order instead of reading glfw
+and imgui, with a fixed delta_time and a clock that advances by it every frame, so a replay draws the
+same frames on every run and machine. Replays run in a hidden window, with LIBGL_ALWAYS_SOFTWARE=1 on
+Mesa's software rasterizer, and never wait for input.
+
+The render loop marks where each of its phases begins, and the time from one mark to the next is
+counted for the phase, with glFinish before every mark when timing a replay so that GL work is counted
+for the phase that issued it rather than for the swap. The report gives the distribution of the frame
+times of every phase, and comparing it with a saved report flags phases that got slower.
+
+standard_session() scripts the session used as a reference: pan across Korea, zoom in on Seoul, scrub
+the time slider over the whole 24 hour window, then switch the variable and show four at once.
+
+    python main.py --record Cache/session.json --source synthetic:700 --end 202401150900
+    python main.py --replay Cache/session.json --report Cache/frames.json
+    python main.py --replay standard --baseline Cache/frames.json --software
+
+"""
+
+import json
+import logging
+import time
+
+import numpy as np
+
+import util
+
+
+VERSION = 1
+# controls of the viewer kept in a recording, see main.ui_state
+STATE_KEYS = ['time_factor', 'window_index', 'minute_data', 'selected_type', 'toggle_distribution', 'toggle_wind',
+              'toggle_isolines', 'toggle_isoline_labels', 'toggle_regions', 'toggle_area_weighted', 'toggle_alerts',
+              'toggle_auto_range', 'toggle_multi_view', 'view_layout', 'view_types']
+
+
+class Recorder:
+    """Collects the input of every drawn frame and writes it into a file."""
+
+    def __init__(self, path, source='live', end=None):
+        self.path = path
+        # data source spec as taken by weather_data.make_source, and last hour as YYYYmmddHHMM
+        self.source = source
+        self.end = end
+        self.frames = []
+
+    def record(self, cursor, pressed, captured, scroll, state, size):
+        self.frames.append({'cursor': list(cursor), 'pressed': bool(pressed), 'captured': bool(captured),
+                            'scroll': scroll, 'size': list(size), 'state': dict(state)})
+
+    def save(self):
+        # the window is created at the size of the first frame
+        size = self.frames[0]['size'] if self.frames else None
+        with open(self.path, 'w') as f:
+            json.dump({'version': VERSION, 'size': size, 'source': self.source, 'end': self.end,
+                       'frames': self.frames}, f)
+        logging.log(logging.INFO, "Recorded %d frames into %s" % (len(self.frames), self.path))
+
+
+class Replayer:
+    """Hands out the frames of a recording in order, with a fixed time step."""
+
+    def __init__(self, session, delta_time=1 / 60):
+        if session.get('version') != VERSION:
+            raise ValueError("Unsupported session version %s" % session.get('version'))
+        self.size = tuple(session['size'])
+        self.source = session.get('source')
+        self.end = session.get('end')
+        self.frames = session['frames']
+        self.delta_time = delta_time
+        self.index = -1
+        self.clock = 0.0
+
+    @classmethod
+    def load(cls, path, delta_time=1 / 60):
+        with open(path, 'r') as f:
+            return cls(json.load(f), delta_time)
+
+    def done(self):
+        return self.index + 1 >= len(self.frames)
+
+    def next(self):
+        """The next frame, advancing the clock by delta_time."""
+        self.index += 1
+        self.clock += self.delta_time
+        return self.frames[self.index]
+
+
+def standard_session(size=(960, 960), camera_size=400, camera_center=(-399, -379), source=None, end=None):
+    """Reference session: pan across Korea, zoom in on Seoul, scrub the 24 hour window and switch
+    variables, first the selected one and then to four views side by side. Drags are
+    turned into cursor moves with the pan scale of the viewer, 2 * camera_size / height map units per
+    pixel, and the zoom eases in over the frames after each scroll like in the viewer. source and end
+    are left to the command line if None."""
+    state = {'time_factor': 1.0, 'window_index': 0, 'minute_data': False, 'selected_type': 'TA',
+             'toggle_distribution': True, 'toggle_wind': False, 'toggle_isolines': True, 'toggle_isoline_labels': True,
+             'toggle_regions': False, 'toggle_area_weighted': False, 'toggle_alerts': True, 'toggle_auto_range': True,
+             'toggle_multi_view': False,
+             'view_layout': 0, 'view_types': ['TA', 'HM', 'WS10', 'PS']}
+    frames = []
+    cursor = np.array(size, dtype=np.float64) / 2
+    scroll = 0.0
+
+    def add(count, pressed=False, move=(0, 0), **changes):
+        nonlocal cursor
+        for _ in range(count):
+            cursor = cursor + np.array(move) / count
+            state.update(changes)
+            frames.append({'cursor': cursor.tolist(), 'pressed': pressed, 'captured': False, 'scroll': scroll,
+                           'size': list(size), 'state': dict(state)})
+
+    def drag(target, center, count):
+        """Drags the map so that the map position target ends up at the center of the view."""
+        pixels = (np.array(center) + np.array(target)) * size[1] / (2 * camera_size)
+        add(1)
+        add(count, pressed=True, move=-pixels)
+        add(1)
+        return (-target[0], -target[1])
+
+    add(10)
+    # west to east and back across the mainland
+    center = drag((150, 200), camera_center, 60)
+    center = drag((650, 200), center, 120)
+    center = drag((400, 500), center, 90)
+    # Seoul, then zoom in one notch at a time
+    center = drag(tuple(util.transform_coordinate(126.978, 37.5665)), center, 90)
+    for _ in range(6):
+        scroll += 1
+        add(20)
+    # the whole window, oldest to newest
+    for step in range(241):
+        add(1, time_factor=step / 240)
+    # every switch triangulates and uploads the values of the shown variables again
+    for variable in ['HM', 'WS10', 'PS', 'TA']:
+        add(30, selected_type=variable)
+    add(30, toggle_multi_view=True, view_layout=0)
+    add(30, view_types=['TA', 'HM', 'WS10', 'RN-60m'])
+    add(30, toggle_multi_view=False)
+    return {'version': VERSION, 'size': list(size), 'source': source, 'end': end, 'frames': frames}
+
+
+class PhaseTimer:
+    """Time per frame spent in every phase of the render loop. mark() ends the current phase and begins
+    the named one, sync is called first so that GL work is counted for the phase that issued it."""
+
+    def __init__(self, sync=None):
+        self.sync = sync
+        self.times = dict()
+        self.current = None
+        self.begin = None
+        self.frame = None
+        self.frame_begin = None
+
+    def begin_frame(self):
+        self.frame = dict()
+        self.frame_begin = time.perf_counter()
+        self.current, self.begin = None, self.frame_begin
+
+    def mark(self, phase):
+        if self.frame is None:
+            return
+        if self.sync is not None:
+            self.sync()
+        now = time.perf_counter()
+        if self.current is not None:
+            self.frame[self.current] = self.frame.get(self.current, 0.0) + now - self.begin
+        self.current, self.begin = phase, now
+
+    def end_frame(self):
+        if self.frame is None:
+            return
+        self.mark(None)
+        self.frame['frame'] = time.perf_counter() - self.frame_begin
+        for phase, seconds in self.frame.items():
+            self.times.setdefault(phase, []).append(seconds)
+        self.frame = None
+
+    def report(self):
+        """{phase: {'mean', 'p50', 'p95', 'p99', 'max'}} in milliseconds, the whole frame as 'frame'."""
+        out = dict()
+        for phase, seconds in self.times.items():
+            ms = np.array(seconds) * 1000
+            out[phase] = {'frames': len(ms), 'mean': float(ms.mean()), 'p50': float(np.percentile(ms, 50)),
+                          'p95': float(np.percentile(ms, 95)), 'p99': float(np.percentile(ms, 99)), 'max': float(ms.max())}
+        return out
+
+
+def format_report(report):
+    lines = ['%-12s %7s %8s %8s %8s %8s' % ('phase', 'frames', 'mean', 'p50', 'p95', 'max')]
+    for phase, row in sorted(report.items(), key=lambda item: item[0] == 'frame'):
+        lines.append('%-12s %7d %8.2f %8.2f %8.2f %8.2f' % (phase, row['frames'], row['mean'], row['p50'], row['p95'], row['max']))
+    return lines
+
+
+def regressions(report, baseline, tolerance=1.25, floor=0.5):
+    """Phases whose 95th percentile grew beyond tolerance times the baseline, ignoring phases under floor
+    milliseconds where timer noise dominates. Returns (phase, baseline ms, ms)."""
+    out = []
+    for phase, row in report.items():
+        if phase in baseline and row['p95'] > max(baseline[phase]['p95'] * tolerance, floor):
+            out.append((phase, baseline[phase]['p95'], row['p95']))
+    return out
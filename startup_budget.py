@@ -0,0 +1,123 @@
+"""
+
+Import time and time to first frame budgets.
+
+Every module is imported in a fresh interpreter with -X importtime, which logs the own and the
+cumulative import time of every module as it is imported. The cumulative time of the measured module
+and of its heaviest direct imports are reported, and the run fails when a module takes longer than its
+budget. Imports done by the interpreter itself (site and its .pth files) come before the module and
+are not counted. Each measurement is repeated and the fastest run kept, the others mostly measure the
+disk cache.
+
+With --first-frame the viewer is started with --first-frame-only as well and the wall time from
+launching it to its exit after the first frame is held against its own budget.
+
+    python startup_budget.py
+    python startup_budget.py weather_data --budget weather_data=150
+    python startup_budget.py --first-frame --first-frame-budget 3000
+
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+import time
+
+
+# cumulative import time in milliseconds
+BUDGETS = {'weather_data': 250, 'render_products': 450, 'main': 1200}
+FIRST_FRAME_BUDGET = 5000
+
+
+def parse_importtime(output):
+    """Returns (name, own ms, cumulative ms, depth) of every import logged by -X importtime, in the
+    order they finished: every module comes after the modules it imported."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(own) / 1000, int(cumulative) / 1000, depth))
+    return entries
+
+
+def import_entries(module, python=sys.executable, repeat=3):
+    """Import time entries of the module and its direct imports from the fastest of repeat runs:
+    ((name, own, cumulative), [(name, own, cumulative) of the direct imports])."""
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([python, '-X', 'importtime', '-c', 'import %s' % module],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError("importing %s failed:\n%s" % (module, result.stderr[-2000:]))
+        children = []
+        for name, own, cumulative, depth in parse_importtime(result.stderr):
+            if depth == 0:
+                if name == module:
+                    break
+                children = []
+            elif depth == 1:
+                children.append((name, own, cumulative))
+        else:
+            raise RuntimeError("no import time logged for %s" % module)
+        if best is None or cumulative < best[0][2]:
+            best = ((name, own, cumulative), children)
+    return best
+
+
+def first_frame_time(python=sys.executable, timeout=120):
+    """Returns (wall ms from launch to exit, time to first frame ms as logged by the viewer) of a
+    viewer run that exits after the first frame."""
+    begin = time.perf_counter()
+    result = subprocess.run([python, 'main.py', '--first-frame-only'], capture_output=True, text=True, timeout=timeout)
+    wall = (time.perf_counter() - begin) * 1000
+    if result.returncode != 0:
+        raise RuntimeError("the viewer failed:\n%s" % result.stderr[-2000:])
+    logged = re.search(r'Time to first frame: ([0-9.]+) ms', result.stderr)
+    return wall, float(logged.group(1)) if logged else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', help="modules to measure, all modules with a budget by default")
+    parser.add_argument('--budget', action='append', default=[], metavar='MODULE=MS', help="budget of a module in ms")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=8, help="direct imports listed per module")
+    parser.add_argument('--first-frame', action='store_true', help="also measure the time to the first frame of the viewer")
+    parser.add_argument('--first-frame-budget', type=float, default=FIRST_FRAME_BUDGET)
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for budget in args.budget:
+        module, ms = budget.split('=')
+        budgets[module] = float(ms)
+
+    failed = []
+    for module in args.modules or list(BUDGETS):
+        (_, own, cumulative), children = import_entries(module, repeat=args.repeat)
+        budget = budgets.get(module)
+        over = budget is not None and cumulative > budget
+        print("%-20s %8.1f ms (own %.1f ms)%s" % (module, cumulative, own,
+                                                '' if budget is None else ' budget %.0f ms%s' % (budget, ' EXCEEDED' if over else '')))
+        for name, own, total in sorted(children, key=lambda child: -child[2])[:args.top]:
+            print("    %-30s %8.1f ms" % (name, total))
+        if over:
+            failed.append(module)
+
+    if args.first_frame:
+        wall, logged = first_frame_time()
+        over = wall > args.first_frame_budget
+        print("%-20s %8.1f ms (%s after imports) budget %.0f ms%s" % ('first frame', wall, 'n/a' if logged is None else '%.1f ms' % logged,
+                                                                     args.first_frame_budget, ' EXCEEDED' if over else ''))
+        if over:
+            failed.append('first frame')
+
+    if failed:
+        print("Over budget: %s" % ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
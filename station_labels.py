@@ -0,0 +1,192 @@
+"""
+
+Station cards with sparklines, drawn into a single imgui draw list.
+
+Series of all stations are read from the window in one block when the data changes and every card's
+sparklines are built once, in card-local unit coordinates. Per frame, station positions are projected
+in one vectorized step, visible stations are ranked by priority and only the first max_cards cards are
+drawn, each as a handful of draw list primitives offset to its screen position.
+
+"""
+
+import imgui
+import glm
+import numpy as np
+
+import util
+
+
+CARD_WIDTH = 200
+HEADER_HEIGHT = 24
+ROW_HEIGHT = 36
+PLOT_HEIGHT = 30
+MAX_SAMPLES = 64
+
+# field of the sparkline, field and format of the value, fixed scale (None to fit the series), histogram
+ROWS = [
+    ('TA', 'TA', "%.1f°C", None, False),
+    ('RN-60m', 'RN-DAY', "%.1fmm", (0, 40), True),
+    ('HM', 'HM', "%.1f%%", (0, 100), False),
+    ('WS10', 'WS10', "%.1fm/s", (0, 10), False),
+    ('PS', 'PS', "%.1fhPa", None, False),
+]
+
+
+def downsample(series, samples):
+    """Averages a (steps, ...) series down to at most samples steps."""
+    steps = len(series)
+    if steps <= samples:
+        return series
+    edges = np.linspace(0, steps, samples + 1).astype(np.int64)
+    with np.errstate(invalid='ignore'):
+        sums = np.add.reduceat(np.nan_to_num(series), edges[:-1], axis=0)
+        counts = np.add.reduceat(~np.isnan(series), edges[:-1], axis=0)
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+class StationLabelLayer:
+    """Cards of the stations in view. refresh() after the window or data changed, draw() every frame."""
+
+    def __init__(self, points, max_cards=48):
+        self.points = list(points)
+        self.max_cards = max_cards
+        self.positions = np.array([(p.x, p.y) for p in self.points], dtype=np.float32)
+        self.type4 = np.array([p.code[0] == '4' for p in self.points])
+        self.labels = [f'[{p.id}] {p.name}' for p in self.points]
+        self.widths = np.zeros(len(self.points), dtype=np.float32)
+        self.animating = False
+        self.window = None
+        self.columns = None
+        self.has_data = None
+        self.active = None
+        self.series = None
+        self.sparklines = {}
+
+    def refresh(self, window):
+        """Reads the series of all stations from the window and drops the built sparklines."""
+        self.window = window
+        self.columns = np.array([p.column if p.has_data else -1 for p in self.points], dtype=np.int64)
+        self.has_data = self.columns >= 0
+        self.active = np.array([p.active for p in self.points])
+
+        # (samples, stations, rows), normalized to 0..1 of each row's scale
+        # only the label rows, and only up to the last column of a station
+        block = window.block(int(self.columns.max(initial=0)) + 1, [row[0] for row in ROWS])
+        block = block[:, np.maximum(self.columns, 0)]
+        series = downsample(block, MAX_SAMPLES)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for i, (_, _, _, scale, _) in enumerate(ROWS):
+                if scale is None:
+                    low, high = np.nanmin(series[:, :, i], axis=0), np.nanmax(series[:, :, i], axis=0)
+                    high = np.where(high > low, high, low + 1)
+                else:
+                    low, high = scale
+                series[:, :, i] = np.clip((series[:, :, i] - low) / (high - low), 0, 1)
+        self.series = series
+        self.sparklines = {}
+
+    def sparkline(self, station):
+        """Card-local primitives of a station: per row, polylines as lists of (x, y) in 0..1, or
+        histogram bars as (x0, x1, height) tuples."""
+        if station not in self.sparklines:
+            series = self.series[:, station]
+            samples = len(series)
+            xs = np.linspace(0, 1, samples) if samples > 1 else np.zeros(1)
+            rows = []
+            for i, (_, _, _, _, histogram) in enumerate(ROWS):
+                ys = series[:, i]
+                valid = ~np.isnan(ys)
+                if histogram:
+                    bars = np.nonzero(valid & (ys > 0))[0]
+                    rows.append([(k / samples, (k + 1) / samples, float(ys[k])) for k in bars])
+                    continue
+                # runs of valid samples become separate polylines
+                breaks = np.nonzero(np.diff(valid.astype(np.int8)))[0] + 1
+                runs = np.split(np.arange(samples), breaks)
+                rows.append([list(zip(xs[run].tolist(), (1 - ys[run]).tolist())) for run in runs if valid[run[0]] and len(run) > 1])
+            self.sparklines[station] = rows
+        return self.sparklines[station]
+
+    def visible(self, viewproj_matrix, screen_size, scroll_y, stations=None):
+        """Screen positions of every station and the stations to draw cards for, in priority order.
+        stations limits the cards to the given stations, such as the ones not merged into a cluster."""
+        # the projection is affine, three points give it for every station at once
+        origin = viewproj_matrix * glm.vec3(0, 0, 0)
+        dx = viewproj_matrix * glm.vec3(-1, 0, 0) - origin
+        dy = viewproj_matrix * glm.vec3(0, -1, 0) - origin
+        x = origin.x + self.positions[:, 0] * dx.x + self.positions[:, 1] * dy.x
+        y = origin.y + self.positions[:, 0] * dx.y + self.positions[:, 1] * dy.y
+        inside = (x >= -1) & (x <= 1) & (y >= -1) & (y <= 1)
+        sx = (x + 1) * screen_size.x / 2 + 4
+        sy = (-y + 1) * screen_size.y / 2
+
+        # type 4 stations show up first when zooming in, every station from zoom level 8
+        if scroll_y < 4:
+            inside[:] = False
+        elif scroll_y < 8:
+            inside &= self.type4
+        if stations is not None:
+            inside &= np.isin(np.arange(len(inside)), stations)
+        candidates = np.nonzero(inside)[0]
+        # active stations before inactive ones, then the stations closest to the screen center
+        distance = np.hypot(x[candidates], y[candidates])
+        order = np.lexsort((distance, ~self.type4[candidates], ~self.active[candidates]))
+        return sx, sy, candidates[order[:self.max_cards]]
+
+    def draw(self, viewproj_matrix, screen_size, time, delta_time, scroll_y, stations=None):
+        sx, sy, cards = self.visible(viewproj_matrix, screen_size, scroll_y, stations)
+        shown = np.zeros(len(self.points), dtype=bool)
+        shown[cards] = True
+        self.widths[~shown] = 0
+        self.widths[cards] += (CARD_WIDTH - self.widths[cards]) * min(delta_time * 10, 1)
+        # cards still growing need more frames
+        self.animating = bool((self.widths[cards] < CARD_WIDTH - 0.5).any())
+        if len(cards) == 0:
+            return
+
+        frame = self.window.sample(time)[np.maximum(self.columns[cards], 0)]
+        values = frame[:, [self.window.field(row[1]) for row in ROWS]]
+        directions = frame[:, self.window.field('WD10')]
+
+        draw_list = imgui.get_background_draw_list()
+        background = imgui.get_color_u32_rgba(0.06, 0.06, 0.07, 0.94)
+        border = imgui.get_color_u32_rgba(0.43, 0.43, 0.5, 0.5)
+        text = imgui.get_color_u32_rgba(1.0, 1.0, 1.0, 1.0)
+        plot = imgui.get_color_u32_rgba(0.61, 0.61, 0.61, 1.0)
+        bar = imgui.get_color_u32_rgba(0.9, 0.7, 0.0, 1.0)
+        frame_color = imgui.get_color_u32_rgba(0.16, 0.29, 0.48, 0.54)
+        height = HEADER_HEIGHT + len(ROWS) * ROW_HEIGHT + 8
+
+        # cards are drawn back to front, the highest priority one ends up on top
+        for k in range(len(cards) - 1, -1, -1):
+            station = cards[k]
+            x0, y0, width = float(sx[station]), float(sy[station]), float(self.widths[station])
+            has_data = self.has_data[station]
+            card_height = height if has_data else HEADER_HEIGHT + ROW_HEIGHT
+            draw_list.add_rect_filled(x0, y0, x0 + width, y0 + card_height, background)
+            draw_list.add_rect(x0, y0, x0 + width, y0 + card_height, border)
+            draw_list.push_clip_rect(x0, y0, x0 + width, y0 + card_height, True)
+            draw_list.add_text(x0 + 8, y0 + 4, text, self.labels[station])
+            draw_list.add_line(x0, y0 + HEADER_HEIGHT, x0 + width, y0 + HEADER_HEIGHT, border)
+
+            if not has_data:
+                draw_list.add_text(x0 + 8, y0 + HEADER_HEIGHT + 8, text, "No Data")
+                draw_list.pop_clip_rect()
+                continue
+
+            plot_width = max(width - 120, 10)
+            for i, primitives in enumerate(self.sparkline(station)):
+                px, py = x0 + 8, y0 + HEADER_HEIGHT + 4 + i * ROW_HEIGHT
+                draw_list.add_rect_filled(px, py, px + plot_width, py + PLOT_HEIGHT, frame_color)
+                if ROWS[i][4]:
+                    for a, b, h in primitives:
+                        draw_list.add_rect_filled(px + a * plot_width, py + (1 - h) * PLOT_HEIGHT,
+                                                  px + b * plot_width - 1, py + PLOT_HEIGHT, bar)
+                else:
+                    for line in primitives:
+                        draw_list.add_polyline([(px + u * plot_width, py + v * PLOT_HEIGHT) for u, v in line], plot, thickness=1.0)
+                label = ROWS[i][2] % values[k, i]
+                if ROWS[i][1] == 'WS10':
+                    label += ' (%s)' % util.get_direction(directions[k])
+                draw_list.add_text(px + plot_width + 8, py + 8, text, label)
+            draw_list.pop_clip_rect()
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+import data_sources
+
+
+class FallbackSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_prefetch_through_recorder_is_consumed(self):
+        cache = data_sources.DirectorySource(self.directory.name)
+        recorder = data_sources.RecordingSource(data_sources.SyntheticSource(20, seed=1), cache)
+        source = data_sources.FallbackSource(cache, recorder)
+        name = data_sources.snapshot_name('202610120100')
+
+        source.prefetch([name])
+        # the recorder writes the file into the cache while prefetching it
+        recorder.prefetched[name].result()
+        self.assertTrue(cache.contains(name))
+
+        content = b''.join(source.open(name))
+        self.assertEqual(recorder.prefetched, {})
+        self.assertEqual(source.prefetched, {})
+        with open(os.path.join(self.directory.name, name), 'rb') as f:
+            self.assertEqual(content, f.read())
+
+    def test_data_source_is_abstract(self):
+        with self.assertRaises(TypeError):
+            data_sources.DataSource()
+
+
+if __name__ == '__main__':
+    unittest.main()
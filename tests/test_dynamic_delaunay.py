@@ -0,0 +1,64 @@
+import os
+import random
+import unittest
+
+import numpy as np
+
+import dynamic_delaunay
+import util
+
+STATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws_info.txt')
+
+
+def station_positions(file):
+    """Map positions of the stations in an aws_info file, read like weather_data.load_stations
+    without its dependencies."""
+    positions = []
+    # the header comments are EUC-KR encoded
+    with open(file, 'r', encoding='cp949') as info_file:
+        for line in info_file:
+            if not line.startswith('#'):
+                info = line.split()
+                positions.append(util.transform_coordinate(float(info[1]), float(info[2])))
+    return np.array(positions, dtype=np.float32)
+
+
+class DynamicDelaunayTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.positions = station_positions(STATION_FILE)
+
+    def test_insert_and_remove_stations(self):
+        triangulation = dynamic_delaunay.DynamicDelaunay(self.positions)
+        rng = np.random.default_rng(7)
+        mask = rng.random(len(self.positions)) < 0.5
+        self.assertGreater(triangulation.update(mask), 0)
+        self.assertTrue(triangulation.cross_check())
+
+        # a few stations dropping out and coming back, like between two hours
+        for _ in range(3):
+            flip = rng.random(len(self.positions)) < 0.05
+            mask = mask ^ flip
+            triangulation.update(mask)
+            self.assertTrue(triangulation.cross_check())
+
+        self.assertGreater(triangulation.update(np.ones(len(self.positions), dtype=bool)), 0)
+        self.assertTrue(triangulation.cross_check())
+
+    def test_single_insertions_and_removals(self):
+        triangulation = dynamic_delaunay.DynamicDelaunay(self.positions[:200])
+        slots = list(range(200))
+        random.Random(3).shuffle(slots)
+        for i in slots:
+            triangulation.insert(i)
+        self.assertTrue(triangulation.cross_check())
+        for i in slots[:150]:
+            self.assertTrue(triangulation.remove(i))
+        self.assertTrue(triangulation.cross_check())
+        self.assertFalse(triangulation.remove(slots[0]))
+        with self.assertRaises(ValueError):
+            triangulation.remove(200)
+
+
+if __name__ == '__main__':
+    unittest.main()
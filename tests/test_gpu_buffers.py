@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import gpu_buffers
+except ImportError:
+    gpu_buffers = None
+
+
+class FakeBuffer:
+    """Bytes of one buffer object, written through the GL calls StreamBuffer makes."""
+
+    def __init__(self):
+        self.bytes = bytearray()
+
+    def buffer_data(self, target, size, data, usage):
+        self.bytes = bytearray(size)
+
+    def buffer_sub_data(self, target, offset, size, data):
+        self.bytes[offset:offset + size] = np.ascontiguousarray(data).tobytes()[:size]
+
+
+@unittest.skipIf(gpu_buffers is None, "PyOpenGL is not installed")
+class StreamBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.gl = FakeBuffer()
+        patches = {'glGenBuffers': lambda n: 1, 'glBindBuffer': lambda target, buffer: None,
+                   'glBufferData': self.gl.buffer_data, 'glBufferSubData': self.gl.buffer_sub_data}
+        for name, function in patches.items():
+            patcher = mock.patch.object(gpu_buffers, name, function)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def contents(self, like):
+        return np.frombuffer(bytes(self.gl.bytes[:like.nbytes]), dtype=like.dtype).reshape(like.shape)
+
+    def test_update_writes_changed_rows_of_2d_arrays(self):
+        buffer = gpu_buffers.StreamBuffer()
+        data = np.arange(400, dtype=np.float32).reshape(100, 4)
+        buffer.update(data)
+        for rows in [slice(50, 55), slice(0, 1), slice(99, 100)]:
+            data = data.copy()
+            data[rows] += 1000
+            sent = buffer.update(data)
+            self.assertEqual(sent, data[rows].nbytes)
+            np.testing.assert_array_equal(self.contents(data), data)
+
+    def test_update_with_many_runs_matches_upload(self):
+        buffer = gpu_buffers.StreamBuffer(max_runs=2)
+        data = np.zeros((64, 4), dtype=np.float32)
+        buffer.update(data)
+        data = data.copy()
+        data[[3, 10, 20, 30], 2] = 7
+        buffer.update(data)
+        np.testing.assert_array_equal(self.contents(data), data)
+
+    def test_update_of_view_columns(self):
+        # the heatmap values, one column per view, with stations dropping out of some views
+        buffer = gpu_buffers.StreamBuffer()
+        values = np.zeros((500, 4), dtype=np.float32)
+        values[:, 0] = np.linspace(-10, 30, 500)
+        buffer.update(values)
+        for views, dropped in [(1, slice(100, 105)), (4, slice(100, 105)), (4, slice(240, 260))]:
+            values = values.copy()
+            values[:, 1:views] = np.linspace(0, 100, 500)[:, None]
+            values[dropped, :views] = 0
+            buffer.update(values)
+            np.testing.assert_array_equal(self.contents(values), values)
+
+    def test_update_with_empty_array(self):
+        buffer = gpu_buffers.StreamBuffer()
+        empty = np.zeros((0, 4), dtype=np.float32)
+        buffer.update(empty)
+        self.assertEqual(buffer.update(empty), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
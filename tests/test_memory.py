@@ -0,0 +1,24 @@
+import unittest
+
+import numpy as np
+
+import memory
+
+
+class SizeofTest(unittest.TestCase):
+    def test_views_count_their_buffer_once(self):
+        array = np.zeros(1000)
+        heap, mapped = memory.sizeof([array, array[10:], array[::2]])
+        self.assertGreaterEqual(heap, array.nbytes)
+        self.assertLess(heap, 2 * array.nbytes)
+        self.assertEqual(mapped, 0)
+
+    def test_arrays_over_bytes(self):
+        for buffer in (b'\0' * 64, bytearray(64), memoryview(bytearray(64))):
+            heap, mapped = memory.sizeof([np.frombuffer(buffer, np.float32)])
+            self.assertGreaterEqual(heap, 64)
+            self.assertEqual(mapped, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
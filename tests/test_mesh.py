@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import mesh
+except ImportError:
+    mesh = None
+
+
+@unittest.skipIf(mesh is None, "PyOpenGL is not installed")
+class MeshCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.model = os.path.join(self.directory, 'model.obj')
+        with open(self.model, 'w') as f:
+            f.write('model')
+        vertices = np.arange(12, dtype=np.float32).reshape(4, 3)
+        self.imported = ({'vertices': vertices}, np.array([0, 1, 2, 2, 3, 0], dtype=np.uint32))
+
+    def load(self):
+        model = mesh.Mesh(cache_directory=self.directory)
+        with mock.patch.object(mesh.Mesh, 'import_data', return_value=self.imported) as imported:
+            model.load_data(self.model)
+        return model, imported.call_count
+
+    def test_second_load_reads_the_cache(self):
+        self.assertEqual(self.load()[1], 1)
+        model, imports = self.load()
+        self.assertEqual(imports, 0)
+        np.testing.assert_array_equal(model.vertices, self.imported[0]['vertices'])
+
+    def test_truncated_cache_is_a_miss(self):
+        self.load()
+        cache = mesh.Mesh(cache_directory=self.directory).cache_path(self.model)
+        for size in (os.path.getsize(cache) - 4, 10, 0):
+            with open(cache, 'r+b') as f:
+                f.truncate(size)
+            model, imports = self.load()
+            self.assertEqual(imports, 1)
+            np.testing.assert_array_equal(model.indices, self.imported[1])
+
+    def test_reload_replaces_the_mapped_cache(self):
+        model, _ = self.load()
+        os.utime(self.model, ns=(0, 0))
+        with mock.patch.object(mesh.Mesh, 'import_data', return_value=self.imported):
+            model.load_data(self.model)
+        np.testing.assert_array_equal(model.indices, self.imported[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+import palette
+
+
+PARAMS = {'PS': {'range': (995, 1025), 'isoline': 2}, 'TA': {'range': (5, 35), 'isoline': 2}}
+
+
+class ValueRangesTest(unittest.TestCase):
+    def test_limits_widen_the_bins(self):
+        ranges = palette.ValueRanges(PARAMS, {'PS': (850, 1090)})
+        ranges.set('PS', 0, np.linspace(930, 1000, 1000))
+        low, high = ranges.range('PS', 0, 0)
+        self.assertLess(low, 940)
+        self.assertGreaterEqual(high, 998)
+
+    def test_range_over_the_selected_hours(self):
+        ranges = palette.ValueRanges(PARAMS)
+        ranges.set('TA', 0, np.full(100, 10.0))
+        ranges.set('TA', 3600, np.full(100, 30.0))
+        self.assertLess(ranges.range('TA', 0, 0)[1], 20)
+        self.assertGreater(ranges.range('TA', 0, 3600)[1], 20)
+        self.assertIsNone(ranges.range('TA', 7200, 7200))
+
+    def test_add_once_per_key(self):
+        ranges = palette.ValueRanges(PARAMS)
+        ranges.add('TA', 0, np.full(20, 10.0), 0)
+        ranges.add('TA', 0, np.full(20, 10.0), 0)
+        self.assertIsNone(ranges.range('TA', 0, 0))
+        ranges.add('TA', 0, np.full(20, 10.0), 60)
+        self.assertIsNotNone(ranges.range('TA', 0, 0))
+
+    def test_prune(self):
+        ranges = palette.ValueRanges(PARAMS)
+        ranges.add('TA', 0, np.full(100, 10.0), 0)
+        ranges.prune(3600)
+        self.assertFalse(ranges.has('TA', 0))
+        ranges.add('TA', 0, np.full(100, 10.0), 0)
+        self.assertTrue(ranges.has('TA', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
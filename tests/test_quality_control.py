@@ -0,0 +1,66 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import weather_data
+except ImportError:
+    weather_data = None
+import qc
+import timeseries
+
+HOUR = 3600
+START = 1790000000 // HOUR * HOUR
+
+
+@unittest.skipIf(weather_data is None, "pytz is not installed")
+class QualityControlTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = timeseries.TimeSeriesStore(directory.name, ['TA', 'HM'])
+        patcher = mock.patch.object(weather_data, 'neighbor_graph', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def append(self, hours):
+        rng = np.random.default_rng(0)
+        for hour in hours:
+            values = np.column_stack([15 + rng.normal(0, 1, 3), 60 + rng.normal(0, 5, 3)]).astype(np.float32)
+            # a stuck temperature sensor from hour 10 to 16
+            if 10 <= hour <= 16:
+                values[0, 0] = 12.5
+            self.store.append(START + hour * HOUR, ['1', '2', '3'], values)
+
+    def stuck_flags(self):
+        return self.store.window(START + 10 * HOUR, START + 16 * HOUR, raw=True).flags(1)[:, 0, 0]
+
+    def test_run_crossing_the_start_of_a_check_is_flagged(self):
+        self.append(range(48))
+        weather_data.quality_control(self.store, START + 13 * HOUR, START + 47 * HOUR)
+        self.assertTrue((self.stuck_flags()[3:] & qc.PERSISTENCE).all())
+
+    def test_hourly_ingest_flags_like_one_check(self):
+        for hour in range(48):
+            self.append([hour])
+            weather_data.quality_control(self.store, START + hour * HOUR, START + hour * HOUR)
+        incremental = self.store.window(START, START + 47 * HOUR, raw=True).flags(3)
+        weather_data.quality_control(self.store, START, START + 47 * HOUR)
+        whole = self.store.window(START, START + 47 * HOUR, raw=True).flags(3)
+        np.testing.assert_array_equal(incremental, whole)
+        self.assertTrue((self.stuck_flags() & qc.PERSISTENCE).all())
+
+    def test_only_steps_within_reach_are_written(self):
+        self.append(range(48))
+        flags = self.store.window(START, START + 47 * HOUR, raw=True)
+        self.store.write_flags(START, np.full((48, 3, 2), 255, dtype=np.uint8))
+        weather_data.quality_control(self.store, START + 47 * HOUR, START + 47 * HOUR)
+        written = flags.flags(3)[:, 0, 0] != 255
+        self.assertEqual(written.sum(), qc.reach(HOUR) + 1)
+        self.assertTrue(written[-qc.reach(HOUR) - 1:].all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import json
+import sys
+import unittest
+from unittest import mock
+
+import session
+
+# the viewer is imported without a display, its window and widget modules replaced
+with mock.patch.dict(sys.modules, {name: mock.MagicMock() for name in
+                                   ('glfw', 'imgui', 'imgui.integrations', 'imgui.integrations.glfw')}):
+    try:
+        import main
+    except ImportError:
+        main = None
+
+
+@unittest.skipIf(main is None, "PyOpenGL, glm or pytz is not installed")
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        state = main.ui_state(0.0, 0, False)
+        self.addCleanup(main.apply_state, state)
+
+    def test_standard_session_switches_variables(self):
+        replayer = session.Replayer(json.loads(json.dumps(session.standard_session())))
+        switches = []
+        last = None
+        while not replayer.done():
+            frame = replayer.next()
+            self.assertEqual(sorted(frame['state']), sorted(session.STATE_KEYS))
+            self.assertEqual(main.apply_state(frame['state']), (frame['state']['time_factor'], frame['state']['window_index'],
+                                                                frame['state']['minute_data']))
+            types = main.shown_types()
+            if last is not None and types != last:
+                switches.append(types)
+            last = types
+        self.assertEqual(switches, [['HM'], ['WS10'], ['PS'], ['TA'], ['TA', 'HM', 'WS10', 'PS'],
+                                    ['TA', 'HM', 'WS10', 'RN-60m'], ['TA']])
+        self.assertAlmostEqual(replayer.clock, len(replayer.frames) / 60)
+
+    def test_state_round_trip(self):
+        state = main.ui_state(0.5, 1, False)
+        state.update(selected_type='PS', toggle_distribution=True, toggle_multi_view=True, view_layout=1, view_types=['HM', 'PS', 'TA', 'TA'])
+        main.apply_state(state)
+        self.assertEqual(main.ui_state(0.5, 1, False), state)
+        self.assertEqual(main.shown_types(), ['HM', 'PS'])
+
+
+class SessionFileTest(unittest.TestCase):
+    def test_recording_keeps_source_end_and_size(self):
+        recorder = session.Recorder(None, 'synthetic:700', '202401150900')
+        recorder.record((1, 2), False, False, 0.0, {}, (1280, 720))
+        with mock.patch('builtins.open', mock.mock_open()) as opened:
+            recorder.save()
+        replayer = session.Replayer(json.loads(''.join(call.args[0] for call in opened().write.call_args_list)))
+        self.assertEqual((replayer.source, replayer.end, replayer.size), ('synthetic:700', '202401150900', (1280, 720)))
+        self.assertEqual(replayer.next()['size'], [1280, 720])
+
+    def test_replayer_rejects_other_versions(self):
+        with self.assertRaises(ValueError):
+            session.Replayer({'version': session.VERSION + 1, 'size': [1, 1], 'frames': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+"""
+
+Chunked, memory-mapped store for station time series.
+
+Values live in fixed size chunk files of shape (chunk_steps, station_capacity, fields) next to a
+presence mask telling which stations reported at which step and the quality control flags of every
+value. A timestamp maps to its chunk and row with two integer divisions, and windows only page in the
+rows they actually touch, so looking at a week costs about the same resident memory as looking at a
+day. Windows hide flagged values unless they are opened raw.
+
+"""
+
+from collections import OrderedDict
+import json
+import os
+
+import numpy as np
+
+
+def to_timestamp(time):
+    """Epoch seconds of a datetime or number."""
+    return int(time.timestamp()) if hasattr(time, 'timestamp') else int(time)
+
+
+class TimeSeriesStore:
+    """Append-only station x time x field store. Rows are written as data arrives, never deleted."""
+
+    def __init__(self, directory, fields, step=3600, chunk_steps=24, station_capacity=1024, max_open_chunks=16):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta_path = os.path.join(directory, 'meta.json')
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta['fields'] != list(fields) or meta['step'] != step:
+                raise ValueError("Store at %s was created with different fields or step." % directory)
+            chunk_steps = meta['chunk_steps']
+            station_capacity = meta['station_capacity']
+            stations = meta['stations']
+        else:
+            stations = []
+
+        self.fields = list(fields)
+        self.field_index = {name: i for i, name in enumerate(self.fields)}
+        self.step = step
+        self.chunk_steps = chunk_steps
+        self.station_capacity = station_capacity
+        self.stations = stations
+        self.columns = {station: i for i, station in enumerate(stations)}
+        self.max_open_chunks = max_open_chunks
+        self.chunks = OrderedDict()
+
+        if not os.path.exists(self.meta_path):
+            self._write_meta()
+
+    def _write_meta(self):
+        with open(self.meta_path, 'w') as f:
+            json.dump({'fields': self.fields, 'step': self.step, 'chunk_steps': self.chunk_steps,
+                       'station_capacity': self.station_capacity, 'stations': self.stations}, f)
+
+    def locate(self, time):
+        """Returns (chunk, row) of a timestamp."""
+        index = to_timestamp(time) // self.step
+        return index // self.chunk_steps, index % self.chunk_steps
+
+    def chunk(self, index, create=False):
+        """Returns the (values, present, flags) memory maps of a chunk, or None if it does not exist."""
+        if index in self.chunks:
+            self.chunks.move_to_end(index)
+            return self.chunks[index]
+
+        path = os.path.join(self.directory, 'chunk%d' % index)
+        shape = (self.chunk_steps, self.station_capacity)
+        if os.path.exists(path + '.npy'):
+            values_map = np.load(path + '.npy', mmap_mode='r+')
+            present_map = np.load(path + '.present.npy', mmap_mode='r+')
+        elif create:
+            # freshly created files are sparse, absent values are masked out by the presence map
+            values_map = np.lib.format.open_memmap(path + '.npy', 'w+', np.float32, shape + (len(self.fields),))
+            present_map = np.lib.format.open_memmap(path + '.present.npy', 'w+', np.bool_, shape)
+        else:
+            return None
+        # stores written before quality control get empty flags
+        if os.path.exists(path + '.flags.npy'):
+            flags_map = np.load(path + '.flags.npy', mmap_mode='r+')
+        else:
+            flags_map = np.lib.format.open_memmap(path + '.flags.npy', 'w+', np.uint8, shape + (len(self.fields),))
+
+        chunk = (values_map, present_map, flags_map)
+        self.chunks[index] = chunk
+        if len(self.chunks) > self.max_open_chunks:
+            _, maps = self.chunks.popitem(last=False)
+            for m in maps:
+                m.flush()
+        return chunk
+
+    def column(self, station, create=False):
+        if station not in self.columns:
+            if not create:
+                return None
+            if len(self.stations) >= self.station_capacity:
+                raise ValueError("Store is full, capacity of %d stations reached." % self.station_capacity)
+            self.columns[station] = len(self.stations)
+            self.stations.append(station)
+        return self.columns[station]
+
+    def register(self, stations):
+        """Assigns columns to stations seen for the first time, in order."""
+        count = len(self.stations)
+        columns = [self.column(station, create=True) for station in stations]
+        if len(self.stations) != count:
+            self._write_meta()
+        return columns
+
+    def contains(self, time):
+        chunk, row = self.locate(time)
+        chunk = self.chunk(chunk)
+        return chunk is not None and bool(chunk[1][row].any())
+
+    def append(self, time, stations, values):
+        """Writes the (len(stations), fields) values reported at a timestamp."""
+        columns = self.register(stations)
+        chunk, row = self.locate(time)
+        values_map, present_map, flags_map = self.chunk(chunk, create=True)
+        values_map[row, columns] = values
+        present_map[row, columns] = True
+        # new values have not been checked yet
+        flags_map[row, columns] = 0
+
+    def write_flags(self, start, flags):
+        """Writes (steps, k, fields) quality control flags of the first k columns from start on."""
+        start = to_timestamp(start) // self.step * self.step
+        window = self.window(start, start + (len(flags) - 1) * self.step, raw=True)
+        for offset, chunk, row, count in window._spans():
+            if chunk is not None:
+                chunk[2][row:row + count, :flags.shape[1]] = flags[offset:offset + count]
+
+    def flush(self):
+        for maps in self.chunks.values():
+            for m in maps:
+                m.flush()
+
+    def window(self, start, end, raw=False):
+        return Window(self, start, end, raw)
+
+
+class Window:
+    """Steps from start to end (inclusive) of a store, read lazily from the chunk files. Values flagged
+    by quality control read as NaN unless the window is raw."""
+
+    def __init__(self, store, start, end, raw=False):
+        self.store = store
+        self.start = to_timestamp(start) // store.step * store.step
+        self.steps = (to_timestamp(end) - self.start) // store.step + 1
+        self.raw = raw
+        self.empty = np.full((store.station_capacity, len(store.fields)), np.nan, dtype=np.float32)
+
+    def timestamp(self, t):
+        return self.start + t * self.store.step
+
+    def field(self, name):
+        return self.store.field_index[name]
+
+    def has_field(self, name):
+        try:
+            self.field(name)
+        except KeyError:
+            return False
+        return True
+
+    def frame(self, i):
+        """Values of all stations at step i, NaN where a station did not report."""
+        i = min(max(int(i), 0), self.steps - 1)
+        chunk, row = self.store.locate(self.timestamp(i))
+        chunk = self.store.chunk(chunk)
+        if chunk is None:
+            return self.empty
+        values, present = chunk[0][row], chunk[1][row][:, None]
+        if not self.raw:
+            present = present & (chunk[2][row] == 0)
+        return np.where(present, values, np.float32(np.nan))
+
+    def sample(self, t):
+        """Values of all stations linearly interpolated at fractional step t."""
+        i = int(t)
+        if t <= 0:
+            return self.frame(0)
+        if i >= self.steps - 1:
+            return self.frame(self.steps - 1)
+        f = np.float32(t - i)
+        return self.frame(i) * (1 - f) + self.frame(i + 1) * f
+
+    def _spans(self):
+        """Yields (window offset, chunk, first row, row count) covering the window."""
+        offset = 0
+        while offset < self.steps:
+            chunk, row = self.store.locate(self.timestamp(offset))
+            count = min(self.store.chunk_steps - row, self.steps - offset)
+            yield offset, self.store.chunk(chunk), row, count
+            offset += count
+
+    def block(self, columns=None, fields=None):
+        """Values of all stations, or of the first columns, over the whole window as a
+        (steps, stations, fields) copy. fields names a subset of the fields to read."""
+        columns = self.empty.shape[0] if columns is None else columns
+        index = slice(None) if fields is None else [self.field(name) for name in fields]
+        width = self.empty.shape[1] if fields is None else len(index)
+        out = np.full((self.steps, columns, width), np.nan, dtype=np.float32)
+        for offset, chunk, row, count in self._spans():
+            if chunk is not None:
+                values = chunk[0][row:row + count, :columns][..., index]
+                present = np.broadcast_to(chunk[1][row:row + count, :columns, None], values.shape)
+                if not self.raw:
+                    present = present & (chunk[2][row:row + count, :columns][..., index] == 0)
+                out[offset:offset + count][present] = values[present]
+        return out
+
+    def flags(self, columns=None):
+        """Quality control flags over the whole window, shaped like block()."""
+        columns = self.empty.shape[0] if columns is None else columns
+        out = np.zeros((self.steps, columns, self.empty.shape[1]), dtype=np.uint8)
+        for offset, chunk, row, count in self._spans():
+            if chunk is not None:
+                out[offset:offset + count] = chunk[2][row:row + count, :columns]
+        return out
+
+    def series(self, column, field):
+        """Values of one station and field over the whole window."""
+        field = self.field(field)
+        out = np.full(self.steps, np.nan, dtype=np.float32)
+        for offset, chunk, row, count in self._spans():
+            if chunk is not None:
+                present = chunk[1][row:row + count, column]
+                if not self.raw:
+                    present = present & (chunk[2][row:row + count, column, field] == 0)
+                out[offset:offset + count][present] = chunk[0][row:row + count, column, field][present]
+        return out
+
+    def present(self):
+        """Stations that reported at least once within the window."""
+        out = np.zeros(self.store.station_capacity, dtype=bool)
+        for offset, chunk, row, count in self._spans():
+            if chunk is not None:
+                out |= chunk[1][row:row + count].any(axis=0)
+        return out
@@ -43,7 +43,9 @@ transformation = [
 
 
 def transform_coordinate(x_A, y_A):
-    index = 0 if np.cross(PA[0] - PA[1], np.array([x_A, y_A] - PA[1])) < 0 else 1
+    a, b = PA[0] - PA[1], np.array([x_A, y_A]) - PA[1]
+    # 2D cross product, np.cross no longer accepts 2D vectors
+    index = 0 if a[0] * b[1] - a[1] * b[0] < 0 else 1
     A_coord = np.array([x_A, y_A])
     B_coord = transformation[index][0].dot(A_coord) + transformation[index][1]
     return B_coord
@@ -57,7 +59,13 @@ def get_direction(wd):
     return direction_str[int((wd + 22.5) / 45) % 8] if not np.isnan(wd) else 'nan'
 
 
+def wind_components(wd, ws):
+    """Converts wind direction (degrees, where the wind blows from) & speed to u (east) & v (north)"""
+    rad = np.radians(wd)
+    return -ws * np.sin(rad), -ws * np.cos(rad)
+
+
 def slerp(data, time):
     i = int(time)
     t = time - i
-    return data[i] * (1 - t) + data[i + 1] * t if i < 23 else data[23]
\ No newline at end of file
+    return data[i] * (1 - t) + data[i + 1] * t if i < len(data) - 1 else data[-1]
\ No newline at end of file
@@ -1,71 +1,372 @@
-import requests  
 import time  
 import datetime
+import logging
 import pytz
 import os
 
-data_hoursofday = []
+import numpy as np
+
+import alerts
+import aws_parser
+import data_sources
+import derived
+import palette
+import pyramid
+import qc
+import rolling
+import timeseries
+import util
+
 time_criteria = None
 keys = ['YYMMDDHHMI', 'STN', 'WD1', 'WS1', 'WDS', 'WSS', 'WD10', 'WS10', 'TA', 'RE', 'RN-15m', 'RN-60m', 'RN-12H', 'RN-DAY', 'HM', 'PA', 'PS', 'TD']
+# numeric columns kept in the store, wind components are derived at ingest
+fields = keys[2:] + ['U10', 'V10']
 cache_directory = 'Cache'
-data_cache = {}
+source = None
+store = None
+minute_pyramid = None
+window = None
+# rolling aggregates and derived fields of the selected window
+aggregates = None
+derived_fields = None
+# hourly value histograms of the variables by store directory, and those of the selected window
+range_histograms = dict()
+value_ranges = None
+# hours of histograms kept before the newest data, the longest window and a day
+range_hours = 24 * 8
+# ranges of the selected window, each fixed when first read, and the rolling variables added to them
+window_ranges = dict()
+ranged_rolling = set()
+station_file = 'aws_info.txt'
+# positions of and Delaunay edges between the columns of a store, by store directory
+neighbor_graphs = dict()
+# threshold alerts, evaluated over every store as data is ingested
+alert_rules = [alerts.Rule.parse(rule) for rule in ['RN-60m > 30', 'WS10 > 14 for 10 min', 'TA > 33 for 2 h']]
+alert_engines = dict()
+alert_engine = None
+timezone = pytz.timezone('Asia/Seoul')
+
+# variables that can be shown as a heatmap, shared by the viewer and the product renderer
+distribution_types = dict()
+distribution_types["TA"] = {'id': 'TA', 'name': '기온', 'range': (5, 35), 'palette': 0, 'isoline': 2}
+distribution_types["HM"] = {'id': 'HM', 'name': '습도', 'range': (0, 100), 'palette': 2, 'isoline': 10}
+distribution_types["WS10"] = {'id': 'WS10', 'name': '풍속', 'range': (0, 60), 'palette': 1, 'isoline': 2}
+distribution_types["PS"] = {'id': 'PS', 'name': '기압', 'range': (995, 1025), 'palette': 0, 'isoline': 2}
+distribution_types["RN-60m"] = {'id': 'RN-60m', 'name': '강수량', 'range': (0, 100), 'palette': 1, 'isoline': 5}
+# rolling variables aggregate a field over the time before every step, accumulated fields over
+# samples one accumulation period apart
+distribution_types["RN-3H"] = {'id': 'RN-3H', 'name': '3시간 강수량', 'range': (0, 150), 'palette': 1, 'isoline': 10,
+                               'rolling': {'field': 'RN-60m', 'how': 'sum', 'seconds': 3 * 3600, 'period': 3600}}
+distribution_types["WSS-6H"] = {'id': 'WSS-6H', 'name': '6시간 최대순간풍속', 'range': (0, 60), 'palette': 1, 'isoline': 5,
+                                'rolling': {'field': 'WSS', 'how': 'max', 'seconds': 6 * 3600}}
+# derived variables are computed per step from the fields, gradients over the station triangulation
+distribution_types["TA-GRAD"] = {'id': 'TA-GRAD', 'name': '기온 경도', 'range': (0, 10), 'palette': 1, 'isoline': 1,
+                                 'derived': {'product': 'gradient_magnitude', 'field': 'TA', 'scale': 1e5}}
+distribution_types["PS-WIND"] = {'id': 'PS-WIND', 'name': '지균풍', 'range': (0, 40), 'palette': 1, 'isoline': 5,
+                                 'derived': {'product': 'geostrophic_speed', 'field': 'PS'}}
+distribution_types["TA-TD"] = {'id': 'TA-TD', 'name': '이슬점 편차', 'range': (0, 20), 'palette': 2, 'isoline': 2,
+                               'derived': {'product': 'difference', 'fields': ('TA', 'TD')}}
+distribution_types["U10"] = {'id': 'U10', 'name': '동서 바람', 'range': (-15, 15), 'palette': 0, 'isoline': 2}
+distribution_types["V10"] = {'id': 'V10', 'name': '남북 바람', 'range': (-15, 15), 'palette': 0, 'isoline': 2}
+distribution_types["TA-MIN-12H"] = {'id': 'TA-MIN-12H', 'name': '12시간 최저기온', 'range': (-5, 30), 'palette': 0, 'isoline': 2,
+                                    'rolling': {'field': 'TA', 'how': 'min', 'seconds': 12 * 3600}}
+
+
+def load_stations(file):
+    """Returns (ids, (n, 2) map positions, codes) of the stations in an aws_info file."""
+    ids, positions, codes = [], [], []
+    # the header comments are EUC-KR encoded
+    with open(file, 'r', encoding='cp949') as info_file:
+        for line in info_file:
+            if line.startswith('#'):
+                continue
+            info = line.split()
+            ids.append(info[0])
+            positions.append(util.transform_coordinate(float(info[1]), float(info[2])))
+            codes.append(info[3])
+    return ids, np.array(positions, dtype=np.float32), codes
+
+
+def default_source():
+    """The cache directory, falling back to the live API whose responses are recorded into the cache."""
+    cache = data_sources.DirectorySource(cache_directory)
+    return data_sources.FallbackSource(cache, data_sources.RecordingSource(data_sources.HttpSource(), cache))
 
 
-def load_cached_files():
-    if not os.path.exists(cache_directory):
-        os.makedirs(cache_directory)
-    for file in os.listdir(cache_directory):
-        if file.startswith('data') and file.endswith('.txt'):
-            data_cache[file] = open(cache_directory + '/' + file, 'r').read()
+def make_source(spec):
+    """Source from a command line spec: 'live' (the default source), 'cache:DIR', 'archive:FILE' or
+    'synthetic:COUNT[:SEED]'. Generated files are recorded like downloads, so repeated runs replay
+    them from the cache instead of formatting them again."""
+    kind, _, argument = spec.partition(':')
+    if kind == 'live':
+        return default_source()
+    if kind == 'cache':
+        return data_sources.DirectorySource(argument or cache_directory)
+    if kind == 'archive':
+        return data_sources.ArchiveSource(argument)
+    if kind == 'synthetic':
+        count, _, seed = argument.partition(':')
+        ids, positions, _ = load_stations(station_file)
+        synthetic = data_sources.SyntheticSource(int(count or len(ids)), ids, positions, int(seed or 0))
+        cache = data_sources.DirectorySource(os.path.join(cache_directory, synthetic.namespace))
+        return data_sources.FallbackSource(cache, data_sources.RecordingSource(synthetic, cache))
+    raise ValueError("Unknown data source %s" % spec)
 
 
-def download_file(file_url, filename):
-    path = cache_directory + '/' + filename
-    print('Downloading: %s' % filename)
-    with open(path, 'wb') as f: # Open file to be saved in binary write mode
-        response = requests.get(file_url) # Send GET request to file URL
-        f.write(response.content) # Write contents of response to file
-    data_cache[filename] = open(path, 'r').read()
+def get_minute_file(end_str):
+    return source.open(data_sources.minute_name(end_str))
 
 
 def get_file(time_str):
-    filename = 'data%s.txt' % time_str
-    if filename not in data_cache:
-        url = 'https://apihub.kma.go.kr/api/typ01/cgi-bin/url/nph-aws2_min?stn=0&tm2=%s&disp=1&help=1&authKey=Ud0jPfajTAWdIz32o5wFcg' % time_str
-        download_file(url, filename)
-    else:
-        print('Using cached file: %s' % filename)
-    return data_cache[filename]
+    return source.open(data_sources.snapshot_name(time_str))
+
+
+def process_file(chunks):
+    """Parses the chunks of a file. Returns (times, stations, values) with the numeric columns as
+    an (n, 16) array, NaN for missing values."""
+    return aws_parser.parse(chunks)
+
+
+def derive_fields(values):
+    """Appends the derived store fields to the (n, 16) numeric columns."""
+    u, v = util.wind_components(values[:, keys.index('WD10') - 2], values[:, keys.index('WS10') - 2])
+    return np.column_stack((values, u, v))
+
 
+def ingest(target_time, data):
+    times, stations, values = data
+    store.append(target_time, stations.tolist(), derive_fields(values))
 
-def process_file(file_content):
-    data = dict()
-    lines = file_content.split('\n')
-    for line in lines:
-        if line.startswith('#'):
+
+def store_geometry(target_store):
+    """Map positions of the registered columns of a store and the Delaunay edges between them, rebuilt
+    when stations were added."""
+    key = target_store.directory
+    count = len(target_store.stations)
+    if key not in neighbor_graphs or neighbor_graphs[key][0] != count:
+        positions = column_positions(target_store)
+        neighbor_graphs[key] = (count, positions, qc.neighbors(positions))
+    return neighbor_graphs[key][1:]
+
+
+def neighbor_graph(target_store):
+    """Buddy check edges between the registered columns of a store."""
+    # stations missing from the info file only get the checks of their own series
+    return store_geometry(target_store)[1]
+
+
+def column_positions(target_store, stations=None):
+    """(columns, 2) map positions of the registered columns of a store, NaN for stations missing from
+    the station file. stations are (ids, positions, codes) as loaded by load_stations."""
+    ids, positions, _ = stations if stations is not None else load_stations(station_file)
+    lookup = dict(zip(ids, positions))
+    return np.array([lookup.get(station, (np.nan, np.nan)) for station in target_store.stations], dtype=np.float64).reshape(-1, 2)
+
+
+def quality_control(target_store, first, last):
+    """Flags the newly ingested values of a store from first to last (inclusive), and again the
+    qc.reach steps before them whose flags the new values can change. Every checked step is read with
+    qc.reach steps of history before it, so its flags do not depend on the window selected when its
+    data came in."""
+    reach = qc.reach(target_store.step)
+    begin = timeseries.to_timestamp(first) // target_store.step * target_store.step - reach * target_store.step
+    block = target_store.window(begin - reach * target_store.step, last, raw=True).block(len(target_store.stations))
+    flags = qc.run(block, target_store.fields, target_store.step, neighbor_graph(target_store))
+    target_store.write_flags(begin, flags[reach:])
+    return begin
+
+
+def store_ranges(target_store):
+    """Hourly value histograms of the variables of a store."""
+    key = target_store.directory
+    if key not in range_histograms:
+        range_histograms[key] = palette.ValueRanges(distribution_types, qc.LIMITS)
+    return range_histograms[key]
+
+
+def update_ranges(target_store, first, last, missing_only=False):
+    """Sets the histograms of the store fields shown as variables in the hours from first to last, as
+    read with the quality control flags. With missing_only the hours that have them are skipped."""
+    ranges = store_ranges(target_store)
+    names = [name for name in distribution_types if name in target_store.field_index]
+    first = timeseries.to_timestamp(first) // 3600 * 3600
+    for hour in range(first, timeseries.to_timestamp(last) + 1, 3600):
+        if missing_only and ranges.has(names[0], hour):
             continue
-        info = line.split(',')
-        if info[-1] == '=':
-            for i in range(2, 18):
-                info[i] = float(info[i])
-                info[i] = float('NaN') if info[i] <= -50.0 else info[i]
-            data[info[1]] = dict(zip(keys, info))
-    return data
-
-
-def initialize():
-    global time_criteria
-    # Call file download function
-    load_cached_files()
-
-    # current time to KST
-    time_criteria = datetime.datetime.now(pytz.timezone('Asia/Seoul'))
-    time_criteria -= datetime.timedelta(minutes=1)
-    time_criteria = time_criteria.replace(minute=0, second=0, microsecond=0)
-
-    for hour_delta in range(0, 24):
-        target_time = time_criteria - datetime.timedelta(hours=hour_delta)
-        target_time_str = target_time.strftime('%Y%m%d%H%M')
-        content = get_file(target_time_str)
-        data = process_file(content)
-        data_hoursofday.insert(0, data)
\ No newline at end of file
+        block = target_store.window(hour, hour + 3600 - target_store.step).block(len(target_store.stations), names)
+        for i, name in enumerate(names):
+            ranges.set(name, hour, block[:, :, i])
+    ranges.prune(timeseries.to_timestamp(last) - range_hours * 3600)
+
+
+def update_alerts(target_store, start, end):
+    """Evaluates the alert rules over the steps from start to end of a store not evaluated before and
+    logs the events at end."""
+    global alert_engine
+    key = target_store.directory
+    if key not in alert_engines:
+        alert_engines[key] = alerts.AlertEngine(target_store, alert_rules, revisit=qc.reach(target_store.step))
+    alert_engine = alert_engines[key]
+    evaluated = alert_engine.update(start, end)
+    events = alert_engine.events(end, *store_geometry(target_store)) if evaluated else []
+    for rule in alert_rules:
+        matched = [event for event in events if event.rule is rule]
+        if matched:
+            logging.log(logging.INFO, "Alert %s: %d events over %d stations, peak %.1f" % (
+                rule.name, len(matched), sum(len(event.stations) for event in matched), rule.peak([event.peak for event in matched])))
+
+
+def alert_events(t):
+    """Alert events at the step of the selected window nearest to fractional step t."""
+    target_store = alert_engine.store
+    return alert_engine.events(window.timestamp(int(round(t))), *store_geometry(target_store))
+
+
+def ingest_minutes(start, end):
+    """Ingests the one-minute feed from start to end hour by hour, checks it and refreshes the pyramid
+    levels."""
+    hour = start.replace(minute=0)
+    missing = []
+    while hour < end:
+        hour += datetime.timedelta(hours=1)
+        if not minute_pyramid.contains(hour):
+            missing.append(hour)
+    # later hours download while the first ones are parsed
+    source.prefetch([data_sources.minute_name(hour_end.strftime('%Y%m%d%H%M')) for hour_end in missing])
+
+    for hour_end in missing:
+        chunks = get_minute_file(hour_end.strftime('%Y%m%d%H%M'))
+        # batches are appended as they are parsed, the file is never held as a whole
+        for times, stations, values in aws_parser.parse_batches(chunks):
+            values = derive_fields(values)
+            for time_str in np.unique(times):
+                rows = times == time_str
+                target_time = timezone.localize(datetime.datetime.strptime(time_str, '%Y%m%d%H%M'))
+                minute_pyramid.append(target_time, stations[rows].tolist(), values[rows])
+    if missing:
+        begin = quality_control(minute_pyramid.base, missing[0] - datetime.timedelta(minutes=59), missing[-1])
+        update_ranges(minute_pyramid.base, begin, missing[-1])
+    minute_pyramid.rollup(start, end)
+    minute_pyramid.flush()
+
+
+def select_window(hours, minutes=False, max_points=None):
+    """Makes sure the last hours up to time_criteria are in the store and selects them as window.
+    With minutes the one-minute feed is used, at the coarsest resolution that still gives max_points
+    steps, the width in pixels of the timeline showing the window, the finest if None."""
+    global window, minute_pyramid, aggregates, derived_fields, value_ranges
+    start = time_criteria - datetime.timedelta(hours=hours - 1)
+    window_ranges.clear()
+    ranged_rolling.clear()
+    if minutes:
+        if minute_pyramid is None:
+            minute_pyramid = pyramid.Pyramid(os.path.join(cache_directory, source.namespace, 'pyramid'), fields,
+                                             source.station_capacity)
+        ingest_minutes(start - datetime.timedelta(hours=1), time_criteria)
+        update_alerts(minute_pyramid.base, start, time_criteria)
+        # hours read before this session have no histograms yet
+        update_ranges(minute_pyramid.base, start, time_criteria, missing_only=True)
+        if max_points is None:
+            window = minute_pyramid.base.window(start, time_criteria)
+        else:
+            window = minute_pyramid.window(start, time_criteria, max_points)
+        aggregates = rolling.Aggregates(window)
+        derived_fields = derived.DerivedFields(window, column_positions(minute_pyramid.base))
+        value_ranges = store_ranges(minute_pyramid.base)
+        return
+
+    missing = [time_criteria - datetime.timedelta(hours=hour_delta) for hour_delta in range(0, hours)]
+    missing = [target_time for target_time in missing if not store.contains(target_time)]
+    source.prefetch([data_sources.snapshot_name(target_time.strftime('%Y%m%d%H%M')) for target_time in missing])
+    for target_time in missing:
+        content = get_file(target_time.strftime('%Y%m%d%H%M'))
+        ingest(target_time, process_file(content))
+    if missing:
+        begin = quality_control(store, min(missing), max(missing))
+        update_ranges(store, begin, max(missing))
+    store.flush()
+    update_alerts(store, start, time_criteria)
+    update_ranges(store, start, time_criteria, missing_only=True)
+    window = store.window(start, time_criteria)
+    aggregates = rolling.Aggregates(window)
+    derived_fields = derived.DerivedFields(window, column_positions(store))
+    value_ranges = store_ranges(store)
+
+
+def sample_variable(variable, t, target_aggregates=None, target_derived=None):
+    """Values of a distribution variable for every store column at fractional step t of the window of
+    target_aggregates and target_derived, the selected window by default."""
+    param = distribution_types[variable]
+    if 'rolling' in param:
+        if target_aggregates is None:
+            range_rolling(variable)
+        return (target_aggregates or aggregates).sample(param['rolling'], t)
+    if 'derived' in param:
+        if target_derived is None:
+            i = min(max(int(t), 0), window.steps - 1)
+            for step in {i, min(i + 1, window.steps - 1)} if t > i else {i}:
+                range_derived(variable, step)
+        return (target_derived or derived_fields).sample(param['derived'], t)
+    target_window = (target_aggregates or aggregates).window
+    return target_window.sample(t)[:, target_window.field(variable)]
+
+
+def range_rolling(variable):
+    """Adds the values of a rolling variable over the selected window to its histograms, at the steps
+    not added before. The series is computed for showing it anyway."""
+    if variable in ranged_rolling:
+        return
+    ranged_rolling.add(variable)
+    series = aggregates.rolling_series(distribution_types[variable]['rolling'])
+    for step in range(window.steps):
+        timestamp = window.timestamp(step)
+        value_ranges.add(variable, timestamp // 3600 * 3600, series[step], timestamp)
+
+
+def range_derived(variable, step):
+    """Adds the values of a derived variable at a step of the selected window to its histograms."""
+    timestamp = window.timestamp(step)
+    value_ranges.add(variable, timestamp // 3600 * 3600, derived_fields.values(distribution_types[variable]['derived'], step),
+                     timestamp)
+
+
+def variable_range(variable):
+    """Robust range of a distribution variable over the selected window, from the hourly histograms.
+    It is fixed for the window once read, so that scrubbing never rescales the palette, derived
+    variables taking the steps computed until then. The configured range until enough values were
+    added."""
+    if variable in window_ranges:
+        return window_ranges[variable]
+    if 'rolling' in distribution_types[variable]:
+        range_rolling(variable)
+    value_range = value_ranges.range(variable, window.start, window.timestamp(window.steps - 1))
+    if value_range is None:
+        return distribution_types[variable]['range']
+    window_ranges[variable] = value_range
+    return value_range
+
+
+def window_time(t):
+    """Datetime of fractional step t of the window."""
+    return datetime.datetime.fromtimestamp(window.timestamp(t), timezone)
+
+
+def initialize(hours=24, data_source=None, end=None):
+    """Selects the last hours up to end, the last full hour by default, reading missing files from
+    data_source (default_source() if None)."""
+    global time_criteria, store, source, minute_pyramid
+    source = data_source or default_source()
+    # stores of generated feeds are kept apart from the real ones
+    store = timeseries.TimeSeriesStore(os.path.join(cache_directory, source.namespace, 'store'), fields,
+                                       station_capacity=source.station_capacity)
+    minute_pyramid = None
+
+    if end is None:
+        # current time to KST
+        time_criteria = datetime.datetime.now(timezone)
+        time_criteria -= datetime.timedelta(minutes=1)
+        time_criteria = time_criteria.replace(minute=0, second=0, microsecond=0)
+    else:
+        time_criteria = end
+
+    select_window(hours)
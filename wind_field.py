@@ -0,0 +1,112 @@
+from OpenGL.GL import *
+import numpy as np
+
+import dynamic_delaunay
+import gpu_buffers
+import raster
+
+
+class WindField:
+    """Wind vectors interpolated onto a grid through a triangulation of the stations, advecting a
+    set of particles that are rendered as one batch of line segments. The stations with wind are
+    triangulated apart from the heatmap, whose stations are those with a value of the shown variables,
+    so showing the wind never changes the heatmap."""
+
+    def __init__(self, positions, count=10000, grid=None, speed_scale=1.5, max_age=80, seed=0):
+        self.grid = grid if grid is not None else raster.Grid()
+        self.triangulation = dynamic_delaunay.DynamicDelaunay(positions)
+        self.raster = None
+        self.uv = np.zeros(self.grid.shape + (2,), dtype=np.float32)
+
+        self.count = count
+        self.speed_scale = speed_scale
+        self.max_age = max_age
+        self.rng = np.random.default_rng(seed)
+        self.positions = np.empty((count, 2), dtype=np.float32)
+        self.age = self.rng.integers(0, max_age, count).astype(np.int32)
+        self.segments = np.empty((count, 2, 2), dtype=np.float32)
+        self._respawn(np.ones(count, dtype=bool))
+
+        self.vao = None
+        self.vbo = None
+
+    def update_field(self, u, v):
+        """Sets the station wind components, NaN for stations without data. Only the stations whose
+        validity changed are inserted or removed, and the grid weights are kept while the triangles are."""
+        n = self.triangulation.n
+        u = np.asarray(u, dtype=np.float32)
+        v = np.asarray(v, dtype=np.float32)
+        valid = ~(np.isnan(u) | np.isnan(v))
+        if self.triangulation.update(valid) or self.raster is None:
+            self.raster = raster.TriangleRaster(self.grid, self.triangulation.positions, self.triangulation.triangles())
+
+        # the corner points are calm
+        values = np.zeros(len(self.triangulation.positions), dtype=np.float32)
+        values[:n] = np.where(valid, u, 0)
+        self.uv[..., 0] = np.nan_to_num(self.raster.interpolate(values))
+        values[:n] = np.where(valid, v, 0)
+        self.uv[..., 1] = np.nan_to_num(self.raster.interpolate(values))
+
+    def sample(self, x, y):
+        """Bilinear sample of the wind grid at map positions, returns an (n, 2) array of u, v."""
+        rows, cols = self.grid.shape
+        gx, gy = self.grid.to_cell(x, y)
+        np.clip(gx, 0, cols - 1.001, out=gx)
+        np.clip(gy, 0, rows - 1.001, out=gy)
+        i = gx.astype(np.int32)
+        j = gy.astype(np.int32)
+        fx = gx - np.floor(gx)
+        fy = gy - np.floor(gy)
+        # u, v pairs gathered as single complex values
+        uv = self.uv.view(np.complex64).reshape(-1)
+        k = j * cols + i
+        top = uv[k] * (1 - fx) + uv[k + 1] * fx
+        bottom = uv[k + cols] * (1 - fx) + uv[k + cols + 1] * fx
+        return (top * (1 - fy) + bottom * fy).view(np.float32).reshape(-1, 2)
+
+    def advance(self, delta_time):
+        self.segments[:, 0] = self.positions
+        uv = self.sample(self.positions[:, 0], self.positions[:, 1])
+        # map y grows southwards
+        uv[:, 1] *= -1
+        uv *= self.speed_scale * min(delta_time, 0.1) * 60
+        self.positions += uv
+        self.age += 1
+
+        x, y = self.positions[:, 0], self.positions[:, 1]
+        rows, cols = self.grid.shape
+        outside = (x < self.grid.x0) | (y < self.grid.y0) | \
+                  (x >= self.grid.x0 + cols * self.grid.cell) | (y >= self.grid.y0 + rows * self.grid.cell)
+        self._respawn((self.age > self.max_age) | outside)
+        self.segments[:, 1] = self.positions
+
+    def _respawn(self, mask):
+        k = int(np.count_nonzero(mask))
+        if k == 0:
+            return
+        rows, cols = self.grid.shape
+        self.positions[mask, 0] = self.grid.x0 + self.rng.random(k, dtype=np.float32) * cols * self.grid.cell
+        self.positions[mask, 1] = self.grid.y0 + self.rng.random(k, dtype=np.float32) * rows * self.grid.cell
+        self.age[mask] = self.rng.integers(0, self.max_age // 4 + 1, k)
+        # no streak from the old position
+        self.segments[mask, 0] = self.positions[mask]
+
+    def gen_buffer(self):
+        self.vao = glGenVertexArrays(1)
+        # every particle moves every frame, the whole buffer is streamed into orphaned storage
+        self.vbo = gpu_buffers.StreamBuffer(GL_ARRAY_BUFFER, GL_STREAM_DRAW, self.segments.nbytes)
+        glBindVertexArray(self.vao)
+
+        self.vbo.bind()
+        glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 2 * sizeof(GLfloat), ctypes.c_void_p(0))
+        glEnableVertexAttribArray(0)
+
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def upload(self):
+        self.vbo.upload(self.segments)
+
+    def draw(self):
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_LINES, 0, self.count * 2)